@@ -0,0 +1,690 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local stand-ins for Google Sheets, Github and the EPFL LDAP directory.
+
+The Sheets and LDAP fakes are in-process objects with the interface of the
+gdata client and of the ldap module. The Github fake is a real HTTP server,
+so that the github3 client, its pagination and its rate limit headers are
+exercised as with the real API.
+"""
+
+
+import BaseHTTPServer
+import json
+import Queue
+import re
+import SocketServer
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+
+from swengmgmt import bulk
+from swengmgmt import profiling
+from swengmgmt import webhook
+
+
+class Synthetic(object):
+    """A synthetic class: students grouped in teams of team_size."""
+
+    STUDENT_COLUMNS = ["name", "e-mail", "gaspar", "sciper", "team",
+                       "githubid"]
+    TEAM_COLUMNS = ["team", "githubslug"]
+
+    def __init__(self, size, team_size=6, annotations=0):
+        self.students = []
+        self.teams = []
+        # Columns of notes kept by the staff next to the roster, which the
+        # tool does not read.
+        self.student_columns = self.STUDENT_COLUMNS + [
+            "notes%d" % (n + 1) for n in xrange(annotations)]
+        self.team_columns = list(self.TEAM_COLUMNS)
+
+        for i in xrange(0, size, team_size):
+            team_no = i / team_size
+            self.teams.append({
+                "team": "Team %04d" % team_no,
+                "githubslug": "team%04d" % team_no,
+            })
+        for i in xrange(size):
+            self.students.append({
+                "name": "Student %05d" % i,
+                "e-mail": "student.%05d@epfl.ch" % i,
+                "gaspar": "stud%05d" % i,
+                "sciper": str(200000 + i),
+                "team": self.teams[i / team_size]["team"],
+                "githubid": "gh-stud%05d" % i,
+            })
+            for n in xrange(annotations):
+                self.students[-1]["notes%d" % (n + 1)] = (
+                    "Note %d on student %05d. " % (n + 1, i)) * 8
+
+
+######################################################################
+# Google Sheets
+######################################################################
+
+
+class _Value(object):
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeListEntry(object):
+    def __init__(self, row):
+        self._row = dict(row)
+
+    def get_value(self, column):
+        return self._row.get(column)
+
+    def set_value(self, column, value):
+        self._row[column] = value
+
+
+class _Cell(object):
+    def __init__(self, row, col, text):
+        self.row = str(row)
+        self.col = str(col)
+        self.text = text
+        self.input_value = text
+
+
+class FakeCellEntry(object):
+    def __init__(self, row, col, text):
+        self.cell = _Cell(row, col, text)
+
+
+class _Entry(object):
+    def __init__(self, key, updated):
+        self._key = key
+        self.updated = _Value(updated)
+
+    def get_spreadsheet_key(self):
+        return self._key
+
+    def get_worksheet_id(self):
+        return self._key
+
+
+class _Feed(object):
+    def __init__(self, entries):
+        self.entry = entries
+
+
+class FakeSheetsClient(object):
+    """A gdata SpreadsheetsClient serving one spreadsheet from memory.
+
+    The worksheets are lists of rows (dicts keyed by column name), laid out
+    in the order of columns[worksheet], if given. Each call waits for latency
+    seconds and is recorded by the profiler, with the length of the cell
+    values it returns as its size.
+    """
+
+    def __init__(self, worksheets, latency=0.0, columns=None):
+        self.worksheets = worksheets
+        self.latency = latency
+        self.columns = columns or {}
+        self.updated = "2015-01-01T00:00:00.000Z"
+
+    def _call(self, endpoint, size=0):
+        if self.latency:
+            time.sleep(self.latency)
+        profiling.record("sheets", endpoint, time.time() - self.latency,
+                         self.latency, size)
+
+    def _columns(self, worksheet_id):
+        rows = self.worksheets[worksheet_id]
+        return self.columns.get(worksheet_id) or sorted(rows[0] if rows
+                                                        else [])
+
+    def _touch(self):
+        self.updated = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+    def get_spreadsheets(self, q=None, **kwargs):
+        self._call("GET /feeds/spreadsheets")
+        return _Feed([_Entry("spreadsheet", self.updated)])
+
+    def get_worksheets(self, key, q=None, **kwargs):
+        self._call("GET /feeds/worksheets")
+        return _Feed([_Entry(q.title if q else sorted(self.worksheets)[0],
+                             self.updated)])
+
+    def get_list_feed(self, key, worksheet_id, **kwargs):
+        rows = self.worksheets[worksheet_id]
+        # Like Sheets, the list feed stops at the first empty row.
+        for index, row in enumerate(rows):
+            if not any(row.itervalues()):
+                rows = rows[:index]
+                break
+        self._call("GET /feeds/list",
+                   sum(len(value or "") for row in rows
+                       for value in row.itervalues()))
+        return _Feed([FakeListEntry(row) for row in rows])
+
+    def update(self, entry, **kwargs):
+        self._call("PUT /feeds/list")
+        self._touch()
+        return entry
+
+    def get_cells(self, key, worksheet_id, q=None, **kwargs):
+        columns = self._columns(worksheet_id)
+        table = [columns] + [[row.get(column) for column in columns]
+                             for row in self.worksheets[worksheet_id]]
+
+        def bound(name, default):
+            value = getattr(q, name, None) if q else None
+            return int(value) if value is not None else default
+
+        min_row, max_row = bound("min_row", 1), bound("max_row", len(table))
+        min_col, max_col = bound("min_col", 1), bound("max_col", len(columns))
+        entries = [FakeCellEntry(r, c, table[r - 1][c - 1])
+                   for r in xrange(min_row, min(max_row, len(table)) + 1)
+                   for c in xrange(min_col, min(max_col, len(columns)) + 1)
+                   if table[r - 1][c - 1]]
+        self._call("GET /feeds/cells",
+                   sum(len(entry.cell.text) for entry in entries))
+        return _Feed(entries)
+
+    def batch(self, feed, force=False, **kwargs):
+        # The feed id ends with /<key>/<worksheet>/private/full.
+        worksheet_id = feed.id.text.split("/")[-3]
+        columns = self._columns(worksheet_id)
+        rows = self.worksheets[worksheet_id]
+        for entry in feed.entry:
+            rows[int(entry.cell.row) - 2][columns[int(entry.cell.col) - 1]] = (
+                entry.cell.input_value)
+        self._call("POST /feeds/cells/batch",
+                   sum(len(entry.cell.input_value) for entry in feed.entry))
+        self._touch()
+        return _Feed([])
+
+
+######################################################################
+# LDAP
+######################################################################
+
+
+class FakeLdapModule(object):
+    """The part of the ldap module used by the tool."""
+
+    SCOPE_SUBTREE = 2
+
+    def __init__(self, students, latency=0.0):
+        self.latency = latency
+        self._by_attr = {}
+        for row in students:
+            entry = ("uid=%s,o=epfl,c=ch" % row["gaspar"], {
+                "displayName": [row["name"].encode("utf8")],
+                "mail": [row["e-mail"].encode("utf8")],
+                "uid": [row["gaspar"].encode("utf8")],
+                "uniqueIdentifier": [row["sciper"].encode("utf8")],
+            })
+            for attr in ("mail", "uid", "uniqueIdentifier"):
+                self._by_attr[(attr, entry[1][attr][0])] = entry
+
+    def initialize(self, uri):
+        return _FakeLdapConnection(self)
+
+
+class _FakeLdapConnection(object):
+    _QUERY_RE = re.compile(r"^\((\w+)=(.*)\)$")
+
+    def __init__(self, module):
+        self._module = module
+
+    def search_s(self, base, scope, query, attrs=None):
+        if self._module.latency:
+            time.sleep(self._module.latency)
+        match = self._QUERY_RE.match(query)
+        entry = self._module._by_attr.get(match.groups()) if match else None
+        return [entry] if entry else []
+
+
+######################################################################
+# Github
+######################################################################
+
+
+class GithubState(object):
+    """The teams, repositories and memberships of a fake organization."""
+
+    def __init__(self, org_name):
+        self.org_name = org_name
+        self.lock = threading.Lock()
+        self._next_id = 1000
+        self.teams = {}   # id -> team dict
+        self.repos = {}   # name -> repo dict
+
+    def nextId(self):
+        self._next_id += 1
+        return self._next_id
+
+    def addTeam(self, name, permission="pull", id=None):
+        team = {"id": id or self.nextId(), "name": name,
+                "permission": permission, "members": set(), "repos": set()}
+        self.teams[team["id"]] = team
+        return team
+
+    def addRepo(self, name, private=True, created=None, template=False):
+        repo = {"id": self.nextId(), "name": name, "private": private,
+                "created": created or time.time(), "template": template}
+        self.repos[name] = repo
+        return repo
+
+
+class GithubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the Github API endpoints used by the tool, under /api/v3.
+
+    Each request waits for latency seconds. Once rate_limit requests are
+    served for a token, its others fail with 403, as with an exhausted
+    budget. With token_rate, each token is served that many requests per
+    second at most, as by the secondary rate limits of Github. The
+    repositories created less than search_lag seconds ago are not found by
+    the search, as if not indexed yet. With a webhook (URL, secret), the
+    changes are delivered to it as organization events, in order.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, state, latency=0.0, rate_limit=5000, per_page=30,
+                 search_lag=0.0, webhook=None, token_rate=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           _GithubHandler)
+        self.state = state
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.token_rate = token_rate
+        # By token.
+        self.remaining = {}
+        self._limiters = {}
+        self.per_page = per_page
+        self.search_lag = search_lag
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+        self.api_url = self.url + "/api/v3"
+        self.webhook = webhook
+        self._deliveries = Queue.Queue()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        if self.webhook:
+            thread = threading.Thread(target=self._deliver)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def emit(self, event, payload):
+        if self.webhook:
+            self._deliveries.put((event, payload))
+
+    def _deliver(self):
+        url, secret = self.webhook
+        count = 0
+        while True:
+            event, payload = self._deliveries.get()
+            count += 1
+            body = json.dumps(payload)
+            request = urllib2.Request(url, body, {
+                "Content-Type": "application/json",
+                "X-GitHub-Event": event,
+                "X-GitHub-Delivery": "fake-%d" % count,
+                "X-Hub-Signature-256": webhook.signature(secret, body)})
+            try:
+                urllib2.urlopen(request).read()
+            except (urllib2.URLError, IOError):
+                pass
+            self._deliveries.task_done()
+
+    def waitDeliveries(self):
+        """Wait until the events of the changes so far are delivered."""
+
+        self._deliveries.join()
+
+    def remainingFor(self, token):
+        return max(self.remaining.get(token, self.rate_limit), 0)
+
+    def throttle(self, token):
+        if not self.token_rate:
+            return
+        with self.state.lock:
+            limiter = self._limiters.setdefault(
+                token, bulk.RateLimiter(self.token_rate))
+        limiter.acquire()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _GithubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Send each response in one piece.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    # Routing
+
+    ROUTES = [
+        ("GET", r"/orgs/([^/]+)", "getOrg"),
+        ("GET", r"/orgs/[^/]+/teams", "listTeams"),
+        ("POST", r"/orgs/[^/]+/teams", "createTeam"),
+        ("GET", r"/orgs/[^/]+/repos", "listRepos"),
+        ("POST", r"/orgs/[^/]+/repos", "createRepo"),
+        ("GET", r"/teams/(\d+)", "getTeam"),
+        ("PATCH", r"/teams/(\d+)", "editTeam"),
+        ("DELETE", r"/teams/(\d+)", "deleteTeam"),
+        ("GET", r"/teams/(\d+)/repos", "listTeamRepos"),
+        ("GET", r"/teams/(\d+)/repos/[^/]+/([^/]+)", "hasTeamRepo"),
+        ("PUT", r"/teams/(\d+)/repos/[^/]+/([^/]+)", "addTeamRepo"),
+        ("DELETE", r"/teams/(\d+)/repos/[^/]+/([^/]+)", "removeTeamRepo"),
+        ("GET", r"/teams/(\d+)/members", "listMembers"),
+        ("GET", r"/teams/(\d+)/members/([^/]+)", "isMember"),
+        ("DELETE", r"/teams/(\d+)/(?:members|memberships)/([^/]+)",
+         "removeMember"),
+        ("PUT", r"/teams/(\d+)/memberships/([^/]+)", "addMember"),
+        ("GET", r"/repos/[^/]+/([^/]+)", "getRepo"),
+        ("DELETE", r"/repos/[^/]+/([^/]+)", "deleteRepo"),
+        ("GET", r"/repos/[^/]+/([^/]+)/teams", "listRepoTeams"),
+        ("POST", r"/repos/[^/]+/([^/]+)/generate", "generateRepo"),
+        ("GET", r"/search/repositories", "searchRepos"),
+        ("GET", r"/rate_limit", "getRateLimit"),
+    ]
+    ROUTES = [(method, re.compile("^/api/v3%s$" % path), name)
+              for method, path, name in ROUTES]
+
+    def _dispatch(self):
+        server = self.server
+        self._token = self.headers.get("Authorization", "")
+        server.throttle(self._token)
+        if server.latency:
+            time.sleep(server.latency)
+
+        url = urlparse.urlparse(self.path)
+        self._query = dict(urlparse.parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        self._body = json.loads(self.rfile.read(length)) if length else {}
+
+        with server.state.lock:
+            # As on Github, checking the rate limit is free.
+            if not url.path.endswith("/rate_limit"):
+                if server.remainingFor(self._token) <= 0:
+                    return self._reply(403,
+                                       {"message": "API rate limit exceeded"})
+                server.remaining[self._token] = (
+                    server.remainingFor(self._token) - 1)
+
+            for method, path_re, name in self.ROUTES:
+                match = path_re.match(url.path)
+                if method == self.command and match:
+                    return getattr(self, name)(*match.groups())
+            return self._reply(404, {"message": "Not Found"})
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body) if body is not None else ""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-RateLimit-Limit", str(self.server.rate_limit))
+        self.send_header("X-RateLimit-Remaining",
+                         str(self.server.remainingFor(self._token)))
+        for name, value in (headers or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _replyPage(self, items, wrap=None):
+        per_page = min(int(self._query.get("per_page", self.server.per_page)),
+                       100)
+        page = int(self._query.get("page", 1))
+        start = (page - 1) * per_page
+        headers = {}
+        if start + per_page < len(items):
+            path = urlparse.urlparse(self.path).path
+            query = dict(self._query, per_page=per_page, page=page + 1)
+            headers["Link"] = '<%s%s?%s>; rel="next"' % (
+                self.server.url, path, urllib.urlencode(sorted(query.items())))
+        body = items[start:start + per_page]
+        self._reply(200, wrap(body) if wrap else body, headers)
+
+    # JSON payloads
+
+    def _orgJson(self):
+        name = self.server.state.org_name
+        return {"login": name, "id": 1, "type": "Organization",
+                "url": "%s/orgs/%s" % (self.server.api_url, name)}
+
+    def _teamJson(self, team):
+        url = "%s/teams/%d" % (self.server.api_url, team["id"])
+        return {"id": team["id"], "name": team["name"],
+                "slug": team["name"].lower().replace(" ", "-"),
+                "permission": team["permission"], "url": url,
+                "members_url": url + "/members{/member}",
+                "repositories_url": url + "/repos"}
+
+    def _repoJson(self, repo):
+        org = self.server.state.org_name
+        full_name = "%s/%s" % (org, repo["name"])
+        url = "%s/repos/%s" % (self.server.api_url, full_name)
+        return {"id": repo["id"], "name": repo["name"], "full_name": full_name,
+                "private": repo["private"], "is_template": repo["template"],
+                "url": url,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                            time.gmtime(repo["created"])),
+                "teams_url": url + "/teams",
+                "ssh_url": "git@fake.github.com:%s.git" % full_name,
+                "clone_url": "https://fake.github.com/%s.git" % full_name,
+                "owner": self._orgJson()}
+
+    def _emit(self, event, action, team=None, repo=None, member=None):
+        payload = {"organization": self._orgJson()}
+        if action:
+            payload["action"] = action
+        if team:
+            payload["team"] = self._teamJson(team)
+        if repo:
+            payload["repository"] = self._repoJson(repo)
+        if member:
+            payload["member"] = self._userJson(member)
+            payload["scope"] = "team"
+        self.server.emit(event, payload)
+
+    def _userJson(self, login):
+        return {"login": login, "type": "User",
+                "url": "%s/users/%s" % (self.server.api_url, login)}
+
+    # Handlers
+
+    def getOrg(self, name):
+        if name != self.server.state.org_name:
+            return self._reply(404, {"message": "Not Found"})
+        self._reply(200, self._orgJson())
+
+    def listTeams(self):
+        state = self.server.state
+        self._replyPage([self._teamJson(state.teams[id])
+                         for id in sorted(state.teams)])
+
+    def createTeam(self):
+        team = self.server.state.addTeam(self._body["name"],
+                                         self._body.get("permission", "pull"))
+        self._reply(201, self._teamJson(team))
+        self._emit("team", "created", team=team)
+
+    def listRepos(self):
+        state = self.server.state
+        if self._query.get("sort") == "created":
+            key = lambda repo: (repo["created"], repo["id"])
+        else:
+            key = lambda repo: repo["id"]
+        self._replyPage([self._repoJson(repo) for repo in
+                         sorted(state.repos.values(), key=key,
+                                reverse=self._query.get("direction") == "desc")])
+
+    def createRepo(self):
+        state = self.server.state
+        if self._body["name"] in state.repos:
+            return self._reply(422, {"message": "Validation Failed"})
+        repo = state.addRepo(self._body["name"],
+                             self._body.get("private", False))
+        self._reply(201, self._repoJson(repo))
+        self._emit("repository", "created", repo=repo)
+
+    def _team(self, id):
+        return self.server.state.teams.get(int(id))
+
+    def getTeam(self, id):
+        team = self._team(id)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        self._reply(200, self._teamJson(team))
+
+    def editTeam(self, id):
+        team = self._team(id)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        team["name"] = self._body.get("name", team["name"])
+        team["permission"] = self._body.get("permission", team["permission"])
+        self._reply(200, self._teamJson(team))
+        self._emit("team", "edited", team=team)
+
+    def deleteTeam(self, id):
+        team = self.server.state.teams.pop(int(id), None)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        self._reply(204)
+        self._emit("team", "deleted", team=team)
+
+    def listTeamRepos(self, id):
+        team = self._team(id)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        repos = self.server.state.repos
+        self._replyPage([self._repoJson(repos[name])
+                         for name in sorted(team["repos"]) if name in repos])
+
+    def hasTeamRepo(self, id, name):
+        team = self._team(id)
+        self._reply(204 if team and name in team["repos"] else 404)
+
+    def addTeamRepo(self, id, name):
+        team = self._team(id)
+        if not team or name not in self.server.state.repos:
+            return self._reply(404, {"message": "Not Found"})
+        team["repos"].add(name)
+        self._reply(204)
+        self._emit("team_add", None, team=team,
+                   repo=self.server.state.repos[name])
+
+    def removeTeamRepo(self, id, name):
+        team = self._team(id)
+        if not team or name not in team["repos"]:
+            return self._reply(404, {"message": "Not Found"})
+        team["repos"].discard(name)
+        self._reply(204)
+        self._emit("team", "removed_from_repository", team=team,
+                   repo=self.server.state.repos.get(name))
+
+    def listMembers(self, id):
+        team = self._team(id)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        self._replyPage([self._userJson(login)
+                         for login in sorted(team["members"])])
+
+    def isMember(self, id, login):
+        team = self._team(id)
+        self._reply(204 if team and login in team["members"] else 404)
+
+    def addMember(self, id, login):
+        team = self._team(id)
+        if not team:
+            return self._reply(404, {"message": "Not Found"})
+        team["members"].add(login)
+        self._reply(200, {"state": "active", "url": "%s/teams/%s/memberships/%s"
+                          % (self.server.api_url, id, login)})
+        self._emit("membership", "added", team=team, member=login)
+
+    def removeMember(self, id, login):
+        team = self._team(id)
+        if not team or login not in team["members"]:
+            return self._reply(404, {"message": "Not Found"})
+        team["members"].discard(login)
+        self._reply(204)
+        self._emit("membership", "removed", team=team, member=login)
+
+    def getRepo(self, name):
+        repo = self.server.state.repos.get(name)
+        if not repo:
+            return self._reply(404, {"message": "Not Found"})
+        self._reply(200, self._repoJson(repo))
+
+    def deleteRepo(self, name):
+        state = self.server.state
+        repo = state.repos.pop(name, None)
+        if not repo:
+            return self._reply(404, {"message": "Not Found"})
+        for team in state.teams.itervalues():
+            team["repos"].discard(name)
+        self._reply(204)
+        self._emit("repository", "deleted", repo=repo)
+
+    def generateRepo(self, name):
+        state = self.server.state
+        template = state.repos.get(name)
+        if not (template and template["template"]):
+            return self._reply(404, {"message": "Not Found"})
+        if self._body["name"] in state.repos:
+            return self._reply(422, {"message": "Validation Failed"})
+        repo = state.addRepo(self._body["name"],
+                             self._body.get("private", False))
+        self._reply(201, self._repoJson(repo))
+        self._emit("repository", "created", repo=repo)
+
+    def listRepoTeams(self, name):
+        state = self.server.state
+        self._replyPage([self._teamJson(state.teams[id])
+                         for id in sorted(state.teams)
+                         if name in state.teams[id]["repos"]])
+
+    def searchRepos(self):
+        # Only the words of the query are matched, against the names.
+        words = [word for word in self._query.get("q", "").split()
+                 if ":" not in word]
+        indexed = time.time() - self.server.search_lag
+        found = [self._repoJson(repo) for repo in
+                 sorted(self.server.state.repos.values(),
+                        key=lambda r: r["id"])
+                 if repo["created"] <= indexed
+                 and all(word in repo["name"] for word in words)]
+        # As on Github, only the first 1000 results can be reached.
+        self._replyPage(found[:1000], lambda items: {
+            "total_count": len(found), "incomplete_results": False,
+            "items": items})
+
+    def getRateLimit(self):
+        core = {"limit": self.server.rate_limit,
+                "remaining": self.server.remainingFor(self._token),
+                "reset": int(time.time()) + 3600}
+        self._reply(200, {"resources": {"core": core}, "rate": core})
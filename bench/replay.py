@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Replay the webhook deliveries saved by webhook-listen to a listener.
+
+The deliveries are sent in the order they were received, signed again with
+the given secret, and the reply to each one is printed.
+"""
+
+
+import argparse
+import json
+import os
+import sys
+import time
+import urllib2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from swengmgmt import webhook
+
+
+def deliveryFiles(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name)
+                         for name in os.listdir(path) if name.endswith(".json"))
+        else:
+            files.append(path)
+    # Named after the time they were received.
+    return sorted(files, key=os.path.basename)
+
+
+def send(url, secret, delivery):
+    body = delivery["body"].encode("utf-8")
+    request = urllib2.Request(url, body, {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": delivery["event"],
+        "X-GitHub-Delivery": delivery["delivery"],
+        "X-Hub-Signature-256": webhook.signature(secret, body)})
+    try:
+        response = urllib2.urlopen(request)
+        return response.getcode(), response.read().strip()
+    except urllib2.HTTPError, e:
+        return e.code, e.read().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8042/",
+                        help="The URL of the listener.")
+    parser.add_argument("--secret", required=True,
+                        help="The webhook secret of the listener.")
+    parser.add_argument("paths", nargs="+",
+                        help="The saved deliveries, or directories of them.")
+    args = parser.parse_args()
+
+    failed = 0
+    start = time.time()
+    files = deliveryFiles(args.paths)
+    for path in files:
+        with open(path, "r") as f:
+            delivery = json.load(f)
+        code, reply = send(args.url, str(args.secret), delivery)
+        print "%3d %-12s %-40s %s" % (code, delivery["event"],
+                                      delivery["delivery"], reply)
+        failed += code != 200
+
+    print "%d deliveries in %.3f s, %d failed." % (len(files),
+                                                  time.time() - start, failed)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
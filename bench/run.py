@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark the tool offline, on synthetic classes.
+
+For each class size, a fake organization is served locally and the roster is
+loaded, the Github data listed and every bulk command run against it, in
+order, on one session. Each operation is timed and its calls are counted per
+backend.
+"""
+
+
+import __builtin__
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+
+from bench import fakes
+from swengmgmt import commands
+from swengmgmt import profiling
+from swengmgmt import session
+from swengmgmt import store
+from swengmgmt import students
+from swengmgmt import webhook
+
+
+STAFF_TEAM_ID = 1
+CLASS_TEAM_ID = 2
+
+WEBHOOK_SECRET = "bench"
+
+BACKENDS = ["sheets", "github", "ldap"]
+
+# The commands run on each class, in order. The operations named in
+# parentheses are run directly on the session or the class.
+OPERATIONS = [
+    "(populateFromSpreadsheet)",
+    "(updateGithubData empty)",
+    "teams-create",
+    "students-create",
+    "(updateGithubData populated)",
+    "(findStudents all)",
+    "(findStudents 10 terms)",
+    "students-list -f jsonl",
+    "teams-list -f jsonl",
+    "students-perm pull",
+    "teams-perm pull",
+    "staff-perm pull",
+    "class-create",
+    "audit",
+    "class-open",
+    "class-close",
+    "students-hide",
+    "repair",
+    "teams-delete --report {directory}/teams-delete.json",
+    "students-delete --erase --report {directory}/students-delete.json",
+]
+
+
+def makeConfig(github_url, repo_listing="full", sheets_loader="list",
+               webhook=False):
+    config = {
+        "spreadsheet": {
+            "title": "SwEng Benchmark",
+            "students_worksheet": "Students",
+            "teams_worksheet": "Teams",
+            "loader": sheets_loader,
+        },
+        "organization": {
+            "name": "sweng-bench",
+            "staff-team-id": STAFF_TEAM_ID,
+            "class-team-id": CLASS_TEAM_ID,
+            "homework-team-prefix": "SwEng Team - ",
+            "homework-repo-prefix": "sweng-team-",
+            "exam-team-prefix": "SwEng Student - ",
+            "exam-repo-prefix": "sweng-student-",
+            "repo-listing": repo_listing,
+        },
+        "github_auth": {
+            "note": "SwEng benchmark",
+            "url": "http://localhost",
+            "api_url": github_url,
+        },
+    }
+    if webhook:
+        config["webhook"] = {"secret": WEBHOOK_SECRET}
+    return config
+
+
+class Benchmark(object):
+    def __init__(self, size, args):
+        self.size = size
+        self.synthetic = fakes.Synthetic(size, annotations=args.annotations)
+
+        state = fakes.GithubState("sweng-bench")
+        state.addTeam("Staff", "admin", id=STAFF_TEAM_ID)
+        state.addTeam("Class", "pull", id=CLASS_TEAM_ID)
+        for i in xrange(args.noise):
+            state.addRepo("other-repo-%04d" % i, created=time.time() - 86400)
+        self.directory = tempfile.mkdtemp(prefix="sweng-bench-")
+        config_path = os.path.join(self.directory, "config.yaml")
+        auth_path = os.path.join(self.directory, "auth.yaml")
+
+        # The snapshot kept by the webhook listener is attached instead of
+        # listing the organization.
+        self.listener = None
+        hook = None
+        if args.webhook:
+            self.listener = webhook.WebhookListener(
+                webhook.OrgSnapshot(
+                    store.StateCache(os.path.join(self.directory,
+                                                  session.DEFAULT_STATE_CACHE)),
+                    makeConfig(None)["organization"]),
+                WEBHOOK_SECRET, ("127.0.0.1", 0)).start()
+            hook = ("http://127.0.0.1:%d/" % self.listener.address[1],
+                    WEBHOOK_SECRET)
+
+        self.server = fakes.GithubServer(state, latency=args.latency / 1000.0,
+                                         rate_limit=args.rate_limit,
+                                         search_lag=args.search_lag,
+                                         webhook=hook).start()
+
+        self.sheets = fakes.FakeSheetsClient(
+            {"Students": self.synthetic.students,
+             "Teams": self.synthetic.teams},
+            latency=args.sheets_latency / 1000.0,
+            columns={"Students": self.synthetic.student_columns,
+                     "Teams": self.synthetic.team_columns})
+        sys.modules["ldap"] = fakes.FakeLdapModule(
+            self.synthetic.students, latency=args.ldap_latency / 1000.0)
+
+        config = makeConfig(self.server.url, args.repo_listing,
+                            args.sheets_loader, args.webhook)
+        with open(config_path, "w") as f:
+            yaml.dump(config, f)
+        with open(auth_path, "w") as f:
+            yaml.dump({"github": {"token": "bench"}}, f)
+
+        self.session = session.Session(config_path, auth_path,
+                                       non_interactive=True,
+                                       google_client=self.sheets)
+
+        self.parser = argparse.ArgumentParser(prog="")
+        commands.registerCommands(self.parser, commands.ALL_COMMANDS)
+
+        if self.listener:
+            # On a client of its own, as the one of the session is only
+            # profiled if created while profiling.
+            github_org = session.Session(config_path, auth_path,
+                                         non_interactive=True).githubOrg()
+            self.listener.seed(github_org, students.SwEngClass(
+                config).iterGithubRepos(github_org))
+
+    def close(self):
+        if self.listener:
+            self.listener.stop()
+        self.server.stop()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _runDirect(self, operation):
+        if operation == "(populateFromSpreadsheet)":
+            self.session.loadClass()
+        elif operation == "(updateGithubData empty)":
+            self.session.loadGithub()
+        elif operation == "(updateGithubData populated)":
+            self.session.invalidate(["github"])
+            self.session.loadGithub()
+        elif operation == "(findStudents all)":
+            self.session.sweng_class.findStudents(students.StudentQuery())
+        elif operation == "(findStudents 10 terms)":
+            terms = [row["gaspar"] for row in self.synthetic.students[::-1][:10]]
+            self.session.sweng_class.findStudents(students.StudentQuery(terms))
+        return 0
+
+    def _runCommand(self, operation):
+        saved = sys.stdout, __builtin__.raw_input
+        with open(os.devnull, "w") as devnull:
+            sys.stdout = devnull
+            __builtin__.raw_input = lambda prompt="": "yes"
+            try:
+                argv = operation.format(directory=self.directory).split()
+                return commands.runCommandLine(self.parser, self.session, argv)
+            finally:
+                sys.stdout, __builtin__.raw_input = saved
+
+    def run(self, operation):
+        profiler = profiling.start()
+        start = time.time()
+        if operation.startswith("("):
+            status = self._runDirect(operation)
+        else:
+            status = self._runCommand(operation)
+        duration = time.time() - start
+        # The snapshot is up to date before the next operation.
+        self.server.waitDeliveries()
+
+        result = {"size": self.size,
+                  "operation": operation.split(" --report")[0].strip("()"),
+                  "seconds": duration, "status": status, "calls": {},
+                  "bytes": {}, "errors": 0}
+        for (backend, _), stats in profiler.stats.iteritems():
+            result["calls"][backend] = (result["calls"].get(backend, 0) +
+                                        stats.calls)
+            result["bytes"][backend] = (result["bytes"].get(backend, 0) +
+                                        stats.bytes)
+            result["errors"] += stats.errors
+        return result
+
+
+def printResult(result):
+    print " %6d %-28s %9.3f %7s %s %6d %9d" % (
+        result["size"], result["operation"], result["seconds"],
+        "ok" if result["status"] == 0 else "failed",
+        " ".join("%7d" % result["calls"].get(backend, 0)
+                 for backend in BACKENDS),
+        result["errors"], result["bytes"].get("sheets", 0) / 1024)
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100, 1000, 10000],
+                        help="The numbers of students of the synthetic "
+                        "classes.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="The latency of each Github call, in ms.")
+    parser.add_argument("--sheets-latency", type=float, default=0.0,
+                        help="The latency of each Sheets call, in ms.")
+    parser.add_argument("--ldap-latency", type=float, default=0.0,
+                        help="The latency of each LDAP search, in ms.")
+    parser.add_argument("--rate-limit", type=int, default=10 ** 9,
+                        help="The Github rate limit of each run. "
+                        "Unlimited by default.")
+    parser.add_argument("--noise", type=int, default=100,
+                        help="The number of unrelated repositories in the "
+                        "organization.")
+    parser.add_argument("--repo-listing", choices=["full", "search"],
+                        default="full",
+                        help="How the repositories of the class are listed.")
+    parser.add_argument("--search-lag", type=float, default=0.0,
+                        help="The time before the new repositories are "
+                        "found by the search, in s.")
+    parser.add_argument("--sheets-loader", choices=["list", "cells"],
+                        default="list",
+                        help="How the roster worksheets are downloaded.")
+    parser.add_argument("--annotations", type=int, default=0,
+                        help="The number of columns of notes in the "
+                        "students worksheet, not read by the tool.")
+    parser.add_argument("--webhook", action="store_true", default=False,
+                        help="Keep a snapshot of the class up to date with "
+                        "a webhook listener, instead of listing the "
+                        "organization.")
+    parser.add_argument("--json", metavar="FILE",
+                        help="Also write the results to FILE, as JSON.")
+    parser.add_argument("-d", "--debug", action="store_true", default=False,
+                        help="Show the logs of the commands.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.debug else logging.WARNING,
+                        format='-- [%(asctime)s] %(message)s')
+    for name in ("requests", "github3"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    print " %6s %-28s %9s %7s %s %6s %9s" % (
+        "Size", "Operation", "Time (s)", "Status",
+        " ".join("%7s" % backend.capitalize() for backend in BACKENDS),
+        "Errors", "Sheets kB")
+
+    results = []
+    for size in args.sizes:
+        benchmark = Benchmark(size, args)
+        try:
+            for operation in OPERATIONS:
+                result = benchmark.run(operation)
+                printResult(result)
+                results.append(result)
+        finally:
+            benchmark.close()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
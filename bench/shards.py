@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Benchmark a bulk command split into shards, on a synthetic class.
+
+For each number of shards, a fake organization is served locally, limiting
+the requests of each token per second, and the command is run by manage.py
+with --shards, each shard with a token of its own (or all with the same one,
+with --shared-token). The roster is read from CSV files.
+"""
+
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+
+from bench import fakes
+from bench import run
+
+
+MANAGE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "manage.py")
+
+
+def writeTable(path, columns, rows):
+    with open(path, "wb") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow([row.get(column, "") for column in columns])
+
+
+def runShards(synthetic, shards, args):
+    state = fakes.GithubState("sweng-bench")
+    state.addTeam("Staff", "admin", id=run.STAFF_TEAM_ID)
+    state.addTeam("Class", "pull", id=run.CLASS_TEAM_ID)
+    server = fakes.GithubServer(state, latency=args.latency / 1000.0,
+                                token_rate=args.token_rate).start()
+    directory = tempfile.mkdtemp(prefix="sweng-shards-")
+    try:
+        writeTable(os.path.join(directory, "students.csv"),
+                   synthetic.student_columns, synthetic.students)
+        writeTable(os.path.join(directory, "teams.csv"),
+                   synthetic.team_columns, synthetic.teams)
+
+        config = run.makeConfig(server.url)
+        config["roster"] = {"backend": "csv", "students": "students.csv",
+                            "teams": "teams.csv"}
+        config_path = os.path.join(directory, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump(config, f)
+
+        tokens = ["bench" if args.shared_token else "bench-%d" % index
+                  for index in xrange(shards)]
+        auth_path = os.path.join(directory, "auth.yaml")
+        with open(auth_path, "w") as f:
+            yaml.safe_dump({"github": {"token": "bench",
+                                       "shard_tokens": tokens}}, f)
+
+        argv = [sys.executable, MANAGE, "-c", config_path, "-a", auth_path,
+                "-n", "-y", "--shards", str(shards)] + args.command.split()
+        start = time.time()
+        with open(os.devnull, "w") as devnull:
+            status = subprocess.call(argv, cwd=directory, stdout=devnull,
+                                     stderr=None if args.debug else devnull)
+        duration = time.time() - start
+
+        calls = sum(server.rate_limit - server.remainingFor(token)
+                    for token in server.remaining)
+        return {"shards": shards, "seconds": duration, "status": status,
+                "calls": calls, "repos": len(state.repos)}
+    finally:
+        server.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=200,
+                        help="The number of students of the synthetic class.")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4],
+                        help="The numbers of shards to run the command with.")
+    parser.add_argument("--command", default="students-create",
+                        help="The bulk command line to run.")
+    parser.add_argument("--token-rate", type=float, default=100,
+                        help="The Github requests per second served to each "
+                        "token.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="The latency of each Github call, in ms.")
+    parser.add_argument("--shared-token", action="store_true", default=False,
+                        help="Give the same token to every shard.")
+    parser.add_argument("-d", "--debug", action="store_true", default=False,
+                        help="Show the logs of the command.")
+    args = parser.parse_args()
+
+    synthetic = fakes.Synthetic(args.size)
+    print " %6s %9s %7s %7s %9s %6s" % ("Shards", "Time (s)", "Status",
+                                        "Github", "Per sec.", "Repos")
+    for shards in args.shards:
+        result = runShards(synthetic, shards, args)
+        print " %6d %9.3f %7s %7d %9.1f %6d" % (
+            result["shards"], result["seconds"],
+            "ok" if result["status"] == 0 else "failed", result["calls"],
+            args.size / result["seconds"], result["repos"])
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -23,22 +23,38 @@ __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 import argparse
 import logging
 import os
+import sys
 
 from swengmgmt import commands
+from swengmgmt import metrics
+from swengmgmt import profiling
+
+
+# The long-running modes, bound to one configuration.
+SINGLE_CONFIG_COMMANDS = [commands.ServeCommand, commands.ShellCommand,
+                          commands.WebhookListenCommand]
 
 
 def main():
     # Parsing the program arguments
     parser = argparse.ArgumentParser(description="Student repository management.")
     commands.registerGlobalArguments(parser)
-    commands.registerCommands(parser, commands.ALL_COMMANDS)
+    commands.registerCommands(parser, commands.ALL_COMMANDS +
+                              commands.SESSION_COMMANDS +
+                              [commands.ServeCommand, commands.ShellCommand,
+                               commands.RunCommand,
+                               commands.WebhookListenCommand])
 
     args = parser.parse_args()
 
-    if not os.path.isabs(args.config):
-        args.config = os.path.join(os.path.dirname(__file__), args.config)
+    configs = [config if os.path.isabs(config)
+               else os.path.join(os.path.dirname(__file__), config)
+               for config in args.config or ["config.yaml"]]
+    args.config = configs[0]
     if not os.path.isabs(args.auth):
         args.auth = os.path.join(os.path.dirname(__file__), args.auth)
+    if not os.path.isabs(args.socket):
+        args.socket = os.path.join(os.path.dirname(__file__), args.socket)
 
     # Configure logging
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO,
@@ -49,10 +65,81 @@ def main():
         github3_logger = logging.getLogger("github3")
         github3_logger.setLevel(logging.WARNING)
 
+    if len(configs) > 1:
+        from swengmgmt import multi
+
+        if args.remote or args.command in SINGLE_CONFIG_COMMANDS:
+            parser.error("%s cannot run on several configurations"
+                         % ("--remote" if args.remote
+                            else args.command.arg_name))
+        if getattr(args, "on_key", False):
+            parser.error("--on-key cannot run on several configurations; "
+                         "use --at")
+        sys.exit(multi.run(args, sys.argv[1:], configs,
+                           os.path.abspath(__file__)))
+
+    if args.shards and not args.shard:
+        from swengmgmt import shard
+
+        if args.remote or not args.command.shardable:
+            parser.error("%s cannot be split into shards"
+                         % ("--remote" if args.remote
+                            else args.command.arg_name))
+        sys.exit(shard.coordinate(args, sys.argv[1:],
+                                  os.path.abspath(__file__)))
+
+    if args.remote:
+        from swengmgmt import daemon
+
+        # Forward the command line from the command name on.
+        argv = sys.argv[1:]
+        argv = argv[argv.index(args.command.arg_name):]
+        try:
+            sys.exit(daemon.sendCommand(args.socket, argv))
+        except daemon.ServerError, e:
+            logging.error(str(e))
+            sys.exit(1)
+
+    # The metrics include the call counts of the profiler.
+    if args.profile or args.profile_trace or args.metrics:
+        profiling.start(trace=bool(args.profile_trace))
+    if args.metrics:
+        metrics.start()
+
+    args.cassette = None
+    if args.record or args.replay:
+        from swengmgmt import cassette
+
+        if args.record and args.replay:
+            parser.error("--record and --replay are exclusive")
+        if args.record:
+            args.cassette = cassette.Cassette(args.record, "record")
+        else:
+            args.cassette = cassette.Cassette(
+                args.replay, "replay",
+                latency=args.replay_latency == "recorded")
+
+    command = args.command()
+    success = False
     try:
-        args.command.execute(args)
+        command.execute(args)
+        success = True
+    except SystemExit, e:
+        success = not e.code
+        raise
     finally:
-        args.command.finalize()
+        command.finalize()
+        if args.cassette:
+            args.cassette.save()
+
+        profiler = profiling.active()
+        if args.profile or args.profile_trace:
+            profiler.printSummary()
+            if args.profile_trace:
+                profiler.writeTrace(args.profile_trace)
+        if args.metrics:
+            metrics.active().write(args.metrics, args.command.arg_name,
+                                   success, profiler)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Audit of the drift between the roster, the directory and Github.
+
+The Github teams, repositories and team members are listed in the background
+while the roster is loaded, and the students are then looked up in the
+directory concurrently. The three sources are indexed by gaspar, team name
+and Github slug, and joined to report every difference found, by category.
+Nothing is changed.
+"""
+
+
+import collections
+import sys
+import threading
+
+from swengmgmt import bulk
+from swengmgmt import epfl
+
+
+# The drift categories, in the order they are reported.
+CATEGORIES = [
+    ("duplicate-student",
+     "A gaspar on several rows of the students worksheet."),
+    ("duplicate-team",
+     "A team name or Github slug on several rows of the teams worksheet."),
+    ("unknown-team",
+     "A student in a team missing from the teams worksheet."),
+    ("no-github-id",
+     "A student without a Github ID."),
+    ("ldap-not-found",
+     "A student not found in the directory."),
+    ("ldap-mismatch",
+     "A student whose name, e-mail, gaspar or SCIPER differ from the "
+     "directory."),
+    ("orphan-team",
+     "A Github team named like the class ones, of no one on the roster."),
+    ("orphan-repo",
+     "A repository named like the class ones, of no one on the roster."),
+    ("extra-team",
+     "Another Github team of a student or team that already has one."),
+    ("missing-team",
+     "A student or team without a Github team, while others have one."),
+    ("missing-repo",
+     "A student or team without a repository, while others have one."),
+    ("wrong-access",
+     "A Github team with another permission than expected."),
+    ("extra-member",
+     "A member of the class team, or of the Github team of a student or "
+     "team, who should not be."),
+    ("missing-member",
+     "A student not in their Github team, or whose invitation is pending."),
+]
+
+FIELDS = [
+    ("category", "Category"),
+    ("subject", "Subject"),
+    ("detail", "Detail"),
+]
+
+# The roster fields compared with the directory, as (attribute, title).
+LDAP_FIELDS = [("name", "name"), ("email", "e-mail"), ("gaspar", "gaspar"),
+               ("sciper", "SCIPER")]
+
+
+class Background(object):
+    """Runs calls in threads, while the caller does something else."""
+
+    def __init__(self, calls):
+        self._calls = calls
+        self._results = [None] * len(calls)
+        self._error = None
+        self._threads = []
+
+    def _run(self, index):
+        try:
+            self._results[index] = self._calls[index]()
+        except Exception:
+            self._error = self._error or sys.exc_info()
+
+    def start(self):
+        for index in xrange(len(self._calls)):
+            thread = threading.Thread(target=self._run, args=(index,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def results(self):
+        """Wait for the calls, and return their results in order."""
+
+        for thread in self._threads:
+            # With a timeout, so that Ctrl-C reaches the main thread.
+            while thread.is_alive():
+                thread.join(0.5)
+        if self._error:
+            raise self._error[0], self._error[1], self._error[2]
+        return self._results
+
+
+def _lower(logins):
+    return set(login.lower() for login in logins)
+
+
+class ClassAudit(object):
+    """Collects the drifts of a class, as records of FIELDS."""
+
+    def __init__(self, sweng_class, workers=8):
+        self._class = sweng_class
+        self._workers = workers
+        self._teams_by_slug = dict((team.github_slug, team)
+                                   for team in sweng_class.teams.itervalues())
+        self._lock = threading.Lock()
+        self.drifts = []
+
+        # The Github team of each student and team, as JSON, by entity id.
+        self._gh_teams = {}
+
+    def _report(self, category, subject, detail):
+        with self._lock:
+            self.drifts.append({"category": category, "subject": subject,
+                                "detail": detail})
+
+    def _entities(self, kind):
+        if kind == "student":
+            return self._class.students.values()
+        return self._class.teams.values()
+
+    def _owner(self, kind, key, by_slug=False):
+        if kind == "student":
+            return self._class.students.get(key)
+        if by_slug:
+            return self._teams_by_slug.get(key)
+        return self._class.teams.get(key)
+
+    def _subject(self, entity):
+        if isinstance(entity, epfl.EPFLStudentData):
+            return entity.gaspar
+        return entity.name
+
+    def checkRoster(self):
+        for category, subject, detail in self._class.roster_problems:
+            self._report(category, subject, detail)
+        for student in self._class.students.itervalues():
+            if not student.github_id:
+                self._report("no-github-id", student.gaspar,
+                             "no Github ID in the students worksheet")
+
+    def checkLdap(self, make_ldap):
+        """Look the students up concurrently, each thread on an LDAP object
+        made by make_ldap()."""
+
+        local = threading.local()
+
+        def check(student):
+            if not hasattr(local, "ldap"):
+                local.ldap = make_ldap()
+            entry = epfl.EPFLStudentData(name=student.name,
+                                         email=student.email,
+                                         gaspar=student.gaspar,
+                                         sciper=student.sciper)
+            try:
+                local.ldap.lookup(entry)
+            except epfl.StudentNotFoundError:
+                self._report("ldap-not-found", student.gaspar,
+                             "not found in the directory")
+                return True
+
+            differences = []
+            for attribute, title in LDAP_FIELDS:
+                listed = unicode(getattr(student, attribute) or u"").strip()
+                found = unicode(getattr(entry, attribute) or u"")
+                if listed != found:
+                    differences.append(u"%s '%s' in the roster, '%s' in the "
+                                       u"directory" % (title, listed, found))
+            if differences:
+                self._report("ldap-mismatch", student.gaspar,
+                             u"; ".join(differences))
+            return True
+
+        runner = bulk.BulkRunner(bulk.BulkReport(None, "audit-ldap"),
+                                 key=lambda student: student.gaspar,
+                                 workers=self._workers)
+        counts = runner.run(self._class.students.values(), check)
+        return counts.get("failed", 0) == 0
+
+    def checkGithub(self, team_list, repo_list, class_members, staff_members,
+                    access=None):
+        """Join the listed teams and repositories of the organization, as
+        JSON, with the roster.
+
+        The permission of the Github teams of each kind, "student" or
+        "team", is expected to be the one in access, or else the one of most
+        of them.
+        """
+
+        access = access or {}
+        gh_teams = {}
+        for team_json in team_list:
+            match = self._class.classifyTeam(team_json["name"])
+            if not match:
+                continue
+            owner = self._owner(*match)
+            if not owner:
+                self._report("orphan-team", team_json["name"],
+                             "of no %s on the roster" % match[0])
+            elif id(owner) in gh_teams:
+                self._report("extra-team", self._subject(owner),
+                             "both '%s' and '%s'"
+                             % (gh_teams[id(owner)]["name"],
+                                team_json["name"]))
+            else:
+                gh_teams[id(owner)] = team_json
+
+        gh_repos = {}
+        for repo_json in repo_list:
+            match = self._class.classifyRepo(repo_json["name"])
+            if not match:
+                continue
+            owner = self._owner(*match, by_slug=True)
+            if not owner:
+                self._report("orphan-repo", repo_json["full_name"],
+                             "of no %s on the roster" % match[0])
+            else:
+                gh_repos[id(owner)] = repo_json
+
+        for kind in ("student", "team"):
+            entities = self._entities(kind)
+            # Nothing is missing before the first ones are created.
+            for category, found, what in (
+                    ("missing-team", gh_teams, "Github team"),
+                    ("missing-repo", gh_repos, "repository")):
+                if not any(id(entity) in found for entity in entities):
+                    continue
+                for entity in entities:
+                    if id(entity) not in found:
+                        self._report(category, self._subject(entity),
+                                     "no %s %s" % (kind, what))
+
+            permissions = collections.Counter(
+                gh_teams[id(entity)]["permission"] for entity in entities
+                if id(entity) in gh_teams)
+            expected = access.get(kind)
+            if not expected and permissions:
+                expected = permissions.most_common(1)[0][0]
+            for entity in entities:
+                team_json = gh_teams.get(id(entity))
+                if team_json and team_json["permission"] != expected:
+                    self._report("wrong-access", self._subject(entity),
+                                 "%s access to the %s repository instead "
+                                 "of %s" % (team_json["permission"], kind,
+                                            expected))
+
+        expected_members = _lower(student.github_id for student
+                                  in self._class.students.itervalues()
+                                  if student.github_id)
+        for login in sorted(_lower(class_members) - expected_members
+                            - _lower(staff_members)):
+            self._report("extra-member", login,
+                         "in the class team, but not a student")
+
+        self._gh_teams = gh_teams
+
+    def checkMembers(self, list_members):
+        """List the members of the Github team of each student and team
+        concurrently, with list_members(team_id)."""
+
+        def expected(entity):
+            if isinstance(entity, epfl.EPFLStudentData):
+                students = [entity]
+            else:
+                students = entity.students
+            return dict((student.github_id.lower(), student)
+                        for student in students if student.github_id)
+
+        def check(entity):
+            team_json = self._gh_teams[id(entity)]
+            members = _lower(member["login"]
+                             for member in list_members(team_json["id"]))
+            students = expected(entity)
+            for login in sorted(members - set(students)):
+                self._report("extra-member", login,
+                             "in '%s'" % team_json["name"])
+            for login in sorted(set(students) - members):
+                self._report("missing-member", students[login].gaspar,
+                             "%s not in '%s', or invited"
+                             % (login, team_json["name"]))
+            return True
+
+        entities = [entity for kind in ("student", "team")
+                    for entity in self._entities(kind)
+                    if id(entity) in self._gh_teams]
+        runner = bulk.BulkRunner(bulk.BulkReport(None, "audit-members"),
+                                 key=lambda entity: self._subject(entity),
+                                 workers=self._workers)
+        counts = runner.run(entities, check)
+        return counts.get("failed", 0) == 0
+
+    def sortedDrifts(self):
+        order = dict((category, index)
+                     for index, (category, _) in enumerate(CATEGORIES))
+        return sorted(self.drifts, key=lambda drift: (
+            order[drift["category"]], drift["subject"]))
+
+    def counts(self):
+        """Return the number of drifts of each category, in order."""
+
+        counts = collections.Counter(drift["category"]
+                                     for drift in self.drifts)
+        return [(category, counts[category]) for category, _ in CATEGORIES
+                if counts[category]]
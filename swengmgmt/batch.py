@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Batch execution of command scripts.
+
+A script has one command per line, written as on the command line without
+the "./manage.py" prefix. Comments start with '#'. Consecutive lines ending
+with '&' run concurrently; the next line without '&' waits for all of them.
+"""
+
+
+import logging
+import shlex
+import StringIO
+import sys
+import threading
+import time
+
+from swengmgmt import commands
+from swengmgmt import util
+
+
+class ScriptError(Exception):
+    pass
+
+
+class Step(object):
+    """One command line of a script."""
+
+    def __init__(self, line_no, argv, background, class_operation=False):
+        self.line_no = line_no
+        self.argv = argv
+        self.background = background
+        # Affects the entire class, and asks for a confirmation.
+        self.class_operation = class_operation
+        self.confirmed = False
+
+        self.status = None
+        self.duration = None
+        self.output = None
+
+    def __unicode__(self):
+        return " ".join(self.argv)
+
+    def __str__(self):
+        return unicode(self).encode("utf-8")
+
+
+def parseScript(script_file, parser):
+    """Read and validate all the steps of a script, before running any."""
+
+    steps = []
+    for line_no, line in enumerate(script_file, 1):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError, e:
+            raise ScriptError("Line %d: %s" % (line_no, e))
+        if not argv:
+            continue
+
+        background = argv[-1].endswith("&")
+        if background:
+            argv[-1] = argv[-1][:-1]
+            if not argv[-1]:
+                argv.pop()
+
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit:
+            raise ScriptError("Line %d: invalid command '%s'"
+                              % (line_no, " ".join(argv)))
+
+        class_operation = (
+            getattr(args.command, "class_operation", False) and
+            not (getattr(args, "students", None) or
+                 getattr(args, "teams", None)))
+        steps.append(Step(line_no, argv, background, class_operation))
+    return steps
+
+
+def confirmBackgroundSteps(steps, args):
+    """Ask once for the confirmation of the steps run in the background which
+    affect the entire class, as they cannot ask for it themselves, and return
+    False if refused."""
+
+    background = [step for step in steps
+                  if step.background and step.class_operation]
+    if not background:
+        return True
+    for step in background:
+        logging.info("Line %d runs in the background on the entire class: %s"
+                     % (step.line_no, step))
+    if not commands.SwengClassCommand.confirmClassOperation(args):
+        return False
+    for step in background:
+        step.confirmed = True
+    return True
+
+
+def _groupSteps(steps, serial):
+    groups = []
+    for step in steps:
+        if (step.background and not serial and groups
+                and groups[-1][-1].background):
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+    return groups
+
+
+class ScriptRunner(object):
+    """Runs the steps of a script on a single session."""
+
+    def __init__(self, parser, shared_session):
+        self._parser = parser
+        self._session = shared_session
+
+    def _runStep(self, step, exclusive):
+        logging.info("Step %d: %s" % (step.line_no, step))
+        start = time.time()
+        step.status = commands.runCommandLine(self._parser, self._session,
+                                              step.argv, exclusive=exclusive,
+                                              confirmed=step.confirmed)
+        step.duration = time.time() - start
+
+    def _runConcurrently(self, group, output):
+        def run(step):
+            buf = StringIO.StringIO()
+            output.redirect(buf)
+            try:
+                self._runStep(step, exclusive=False)
+            finally:
+                output.restore()
+                step.output = buf.getvalue()
+
+        threads = [threading.Thread(target=run, args=(step,))
+                   for step in group]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Keep the output of each step in one piece.
+        for step in group:
+            if step.output:
+                print util.bold("== Line %d: %s" % (step.line_no, step))
+                sys.stdout.write(step.output)
+
+    def run(self, steps, serial=False, keep_going=False):
+        """Run the steps and return True if they all succeeded."""
+
+        output = util.ThreadOutput(sys.stdout)
+        sys.stdout = output
+        try:
+            for group in _groupSteps(steps, serial):
+                if len(group) == 1:
+                    self._runStep(group[0], exclusive=True)
+                else:
+                    self._runConcurrently(group, output)
+
+                if any(step.status for step in group) and not keep_going:
+                    logging.error("Step failed. Stopping the script.")
+                    break
+        finally:
+            sys.stdout = output._default
+
+        return all(step.status == 0 for step in steps)
+
+    def printSummary(self, steps, total):
+        print
+        print util.bold(" Line  Status   Time (s)  Command")
+        for step in steps:
+            if step.status is None:
+                status, duration = "skipped", "-"
+            else:
+                status = "ok" if step.status == 0 else "failed"
+                duration = "%.3f" % step.duration
+            print " %-5d %-8s %-9s %s%s" % (step.line_no, status, duration,
+                                            step,
+                                            " &" if step.background else "")
+        print " Total: %.3f s" % total
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Concurrent bulk operations on the students or teams of the class.
+
+The operation is applied to each entity by a pool of worker threads, under
+a limit of API calls per second. The outcome for each entity is saved to a
+JSON report as soon as it is known, so that an interrupted run can be
+resumed: the entities already done are skipped.
+"""
+
+
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+
+from swengmgmt import metrics
+
+
+class ReportError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """Token bucket allowing rate calls per second, in bursts of up to burst."""
+
+    def __init__(self, rate, burst=None):
+        self._rate = float(rate)
+        self._capacity = float(burst or max(rate, 1))
+        self._tokens = self._capacity
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self, calls=1):
+        # More than the bucket holds would never be granted.
+        if calls > self._capacity:
+            raise ValueError("%d calls at once, in bursts of up to %d"
+                             % (calls, self._capacity))
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self._capacity,
+                                   self._tokens + (now - self._last) * self._rate)
+                self._last = now
+                if self._tokens >= calls:
+                    self._tokens -= calls
+                    return
+                wait = (calls - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+class BulkReport(object):
+    """The outcome of a bulk operation for each entity, kept in a JSON file."""
+
+    def __init__(self, path, operation):
+        self.path = path
+        self.operation = operation
+        self.entries = {}
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("operation") != operation:
+                raise ReportError("%s is a report of '%s', not '%s'. Remove "
+                                  "it, or pass another --report."
+                                  % (path, data.get("operation"), operation))
+            self.entries = data["entries"]
+
+    def isDone(self, key):
+        return self.entries.get(key, {}).get("status") == "done"
+
+    def update(self, key, status, error=None):
+        with self._lock:
+            self.entries[key] = {"status": status, "time": time.time()}
+            if error:
+                self.entries[key]["error"] = error
+            self._save()
+
+    def merge(self, entries):
+        """Add the outcomes of another report, e.g., of a shard."""
+
+        with self._lock:
+            self.entries.update(entries)
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = "%s.tmp" % self.path
+        with open(tmp_path, "w") as f:
+            json.dump({"operation": self.operation, "entries": self.entries},
+                      f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def complete(self):
+        """Return whether every entity in the report is done, i.e., nothing
+        is left to resume."""
+
+        return all(entry["status"] == "done"
+                   for entry in self.entries.itervalues())
+
+    def remove(self):
+        """Remove the file, so that the next run does not skip anything, and
+        return whether there was one."""
+
+        if not (self.path and os.path.exists(self.path)):
+            return False
+        os.remove(self.path)
+        return True
+
+    def counts(self):
+        result = {}
+        for entry in self.entries.itervalues():
+            result[entry["status"]] = result.get(entry["status"], 0) + 1
+        return result
+
+
+
+class BulkRunner(object):
+    """Applies an operation to entities concurrently.
+
+    The entities are identified in the report by key(entity). The operation
+    returns True if it succeeded for the entity. It is assumed to make up to
+    calls_per_entity API calls, which are drawn from the rate limiter before
+    it starts.
+    """
+
+    def __init__(self, report, key, workers=8, rate=None, calls_per_entity=1):
+        self._report = report
+        self._key = key
+        self._workers = max(workers, 1)
+        # A burst holds the calls of at least one entity.
+        self._limiter = (RateLimiter(rate, max(rate, calls_per_entity))
+                         if rate else None)
+        self._calls_per_entity = calls_per_entity
+
+    def pending(self, entities):
+        """Return the entities not done yet, according to the report."""
+
+        return [entity for entity in entities
+                if not self._report.isDone(self._key(entity))]
+
+    def _process(self, entity):
+        key = self._key(entity)
+        if self._limiter:
+            self._limiter.acquire(self._calls_per_entity)
+        try:
+            with metrics.entity():
+                success = self._operation(entity)
+        except Exception, e:
+            logging.exception("Failed on %s." % entity)
+            self._report.update(key, "failed", str(e))
+            return
+        self._report.update(key, "done" if success else "failed")
+
+    def _work(self):
+        while not self._stopped:
+            try:
+                entity = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            self._process(entity)
+
+    def run(self, entities, operation):
+        self._operation = operation
+        self._stopped = False
+        self._queue = Queue.Queue()
+        for entity in entities:
+            self._queue.put(entity)
+
+        threads = [threading.Thread(target=self._work)
+                   for _ in xrange(min(self._workers, len(entities)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            # Join with a timeout, so that Ctrl-C reaches the main thread.
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self._stopped = True
+            logging.warning("Interrupted. Waiting for the operations in "
+                            "progress; run again to resume.")
+            for thread in threads:
+                thread.join()
+            raise
+
+        return self._report.counts()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Recording and replay of the HTTP traffic of the Sheets and Github clients.
+
+A cassette is a JSON file with the responses received by a run, in order.
+The requests are identified by their backend, method, path and query, so
+the host and the credentials do not matter on replay. The credentials are
+never recorded: the request headers and bodies are left out, and the tokens
+found in the query strings and the response bodies are scrubbed.
+
+On replay, the responses recorded for each request are returned in order;
+once they are used up, the last one is returned again.
+"""
+
+
+import base64
+import json
+import logging
+import re
+import threading
+import time
+import urllib
+import urlparse
+
+
+SCRUBBED = "SCRUBBED"
+
+_SECRET_PARAMS = set(["access_token", "client_secret", "refresh_token",
+                      "token", "code"])
+_SECRET_BODY_RE = re.compile(
+    r'("(?:access_token|refresh_token|token|hashed_token)"\s*:\s*)"[^"]*"')
+_SKIPPED_HEADERS = set(["set-cookie", "content-encoding",
+                        "transfer-encoding", "content-length"])
+
+
+class CassetteError(Exception):
+    pass
+
+
+def requestKey(backend, method, url):
+    """Identify a request by its backend, method, path and sorted query."""
+
+    parsed = urlparse.urlparse(url)
+    query = sorted((name, value if name not in _SECRET_PARAMS else SCRUBBED)
+                   for name, value in urlparse.parse_qsl(parsed.query, True))
+    path = parsed.path
+    if query:
+        path += "?" + urllib.urlencode(query)
+    return "%s %s %s" % (backend, method, path)
+
+
+def _encodeBody(body):
+    try:
+        return {"body": _SECRET_BODY_RE.sub(r'\1"%s"' % SCRUBBED,
+                                            body.decode("utf-8"))}
+    except UnicodeDecodeError:
+        return {"body_base64": base64.b64encode(body)}
+
+
+def _decodeBody(interaction):
+    if "body_base64" in interaction:
+        return base64.b64decode(interaction["body_base64"])
+    return interaction["body"].encode("utf-8")
+
+
+class Cassette(object):
+    """The recorded interactions of a run, in "record" or "replay" mode."""
+
+    def __init__(self, path, mode, latency=True):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions = []
+
+        self._lock = threading.Lock()
+        self._by_key = {}
+
+        if mode == "replay":
+            with open(path, "r") as f:
+                self.interactions = json.load(f)["interactions"]
+            for interaction in self.interactions:
+                self._by_key.setdefault(interaction["key"],
+                                        []).append(interaction)
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def record(self, backend, method, url, status, reason, headers, body,
+               elapsed):
+        interaction = {
+            "key": requestKey(backend, method, url),
+            "status": status,
+            "reason": reason,
+            "headers": dict((name, value)
+                            for name, value in dict(headers).iteritems()
+                            if name.lower() not in _SKIPPED_HEADERS),
+            "elapsed": elapsed,
+        }
+        interaction.update(_encodeBody(body))
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def play(self, backend, method, url):
+        """Return the status, reason, headers and body of the next response."""
+
+        key = requestKey(backend, method, url)
+        with self._lock:
+            recorded = self._by_key.get(key)
+            if not recorded:
+                raise CassetteError("No recorded response for %s" % key)
+            interaction = recorded.pop(0) if len(recorded) > 1 else recorded[0]
+
+        if self.latency:
+            time.sleep(interaction["elapsed"])
+        return (interaction["status"], interaction["reason"],
+                interaction["headers"], _decodeBody(interaction))
+
+    def save(self):
+        if self.mode != "record":
+            return
+        with self._lock:
+            with open(self.path, "w") as f:
+                json.dump({"version": 1, "interactions": self.interactions},
+                          f, indent=1, sort_keys=True)
+        logging.info("Recorded %d HTTP interactions to %s."
+                     % (len(self.interactions), self.path))
+
+    # Github (github3, on top of requests)
+
+    def attachGithub(self, client):
+        """Record the responses of a github3 client, or replay them to it."""
+
+        session = getattr(client, "_session", None) or client.session
+        if self.replaying:
+            adapter = _createReplayAdapter(self)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            return
+
+        def onResponse(response, *args, **kwargs):
+            request = response.request
+            self.record("github", request.method, request.url,
+                        response.status_code, response.reason,
+                        response.headers.items(), response.content or "",
+                        response.elapsed.total_seconds())
+
+        session.hooks.setdefault("response", []).append(onResponse)
+
+    # Google Sheets (gdata)
+
+    def attachGData(self, client):
+        """Record the responses of a gdata client, or replay them to it."""
+
+        http_client = client.http_client
+        request = http_client.request
+
+        def replayed(http_request, *args, **kwargs):
+            import atom.http_core
+
+            status, reason, headers, body = self.play(
+                "sheets", http_request.method,
+                http_request.uri._get_relative_path())
+            return atom.http_core.HttpResponse(status, reason, headers, body)
+
+        def recorded(http_request, *args, **kwargs):
+            start = time.time()
+            response = request(http_request, *args, **kwargs)
+            body = response.read()
+            response.read = lambda *args: body
+            self.record("sheets", http_request.method,
+                        http_request.uri._get_relative_path(),
+                        response.status, response.reason,
+                        response.getheaders(), body, time.time() - start)
+            return response
+
+        http_client.request = replayed if self.replaying else recorded
+
+
+def _createReplayAdapter(cassette):
+    # Defined here, as the requests library is only needed for Github.
+    import requests.adapters
+    import requests.models
+    import requests.structures
+
+    class GithubReplayAdapter(requests.adapters.BaseAdapter):
+        def send(self, request, **kwargs):
+            status, reason, headers, body = cassette.play(
+                "github", request.method, request.url)
+            response = requests.models.Response()
+            response.status_code = status
+            response.reason = reason
+            response.headers = requests.structures.CaseInsensitiveDict(headers)
+            response._content = body
+            response.url = request.url
+            response.request = request
+            response.connection = self
+            return response
+
+        def close(self):
+            pass
+
+    return GithubReplayAdapter()
@@ -20,44 +20,88 @@
 __author__ = "stefan.bucur@epfl.ch (Stefan Bucur)"
 
 
+import argparse
+import logging
+import multiprocessing
 import shutil
 import os
 import shlex
 import subprocess
+import sys
 import tempfile
-import yaml
-
-from swengmgmt import epfl
-from swengmgmt import github
-from swengmgmt import spreadsheets
+import time
+
+# The backend modules (and the gdata, github3, ldap and yaml libraries behind
+# them) are imported when a command first needs them, so that building the
+# argument parser, printing the help and failing on bad arguments stay cheap.
+from swengmgmt import metrics
+from swengmgmt import output
+from swengmgmt import profiling
+from swengmgmt import session
+from swengmgmt import shard
 from swengmgmt import students
 from swengmgmt import util
 
 
+def arg(*flags, **options):
+    """Declare a command argument, as passed to ArgumentParser.add_argument."""
+    return flags, options
+
+
+EXCLUDE_STUDENTS = arg("--exclude", nargs="*",
+                       help="A list of students to exclude.")
+STUDENTS = arg("students", nargs="*",
+               help="A list of students to consider. "
+               "Leave empty to include everyone.")
+EXCLUDE_TEAMS = arg("--exclude", nargs="*",
+                    help="A list of teams to exclude.")
+TEAMS = arg("teams", nargs="*",
+            help="A list of teams to consider. "
+            "Leave empty to include everyone.")
+PERMISSION = arg("permission", choices=["push", "pull"],
+                 help="The permission to set.")
+
+
 class Command(object):
     """A generic SwEng command."""
 
+    arguments = []
+
+    # Set by the bulk commands that can be split into shards.
+    shardable = False
+
+    @classmethod
+    def reportOperation(cls, args):
+        """Return the operation of the bulk report of a run: a report only
+        resumes runs of the same operation."""
+        return cls.arg_name
+
     def __init__(self):
         self.args = None
+        self.session = None
         self.config = {}
         self.auth_config = {}
 
     def execute(self, args):
         self.args = args
 
-        if os.path.exists(args.config):
-            with open(args.config, "r") as f:
-                self.config = yaml.load(f)
+        # The long-running modes pass in the session shared by their commands.
+        self.session = getattr(args, "session", None)
+        if not self.session:
+            self.session = session.Session(
+                args.config, args.auth, args.non_interactive,
+                cassette=getattr(args, "cassette", None),
+                refresh_roster=getattr(args, "refresh_roster", False),
+                shard=getattr(args, "shard", None))
+            self.session.global_args = args
 
-        if os.path.exists(args.auth):
-            with open(args.auth, "r") as f:
-                self.auth_config = yaml.load(f)
+        self.config = self.session.loadConfig()
+        self.auth_config = self.session.auth_config
 
     def finalize(self):
-        if not self.args:
+        if not self.session:
             return
-        with open(self.args.auth, "w") as f:
-            yaml.dump(self.auth_config, stream=f, default_flow_style=False)
+        self.session.save()
 
 
 class SwengClassCommand(Command):
@@ -70,30 +114,27 @@ class SwengClassCommand(Command):
         self.team_sheet = None
         self.sweng_class = None
 
+    # Set by the commands asking for confirmation when no student or team is
+    # given.
+    class_operation = False
+
     def execute(self, args):
         super(SwengClassCommand, self).execute(args)
 
-        gdata_auth = spreadsheets.GDataOAuthProvider(self.config,
-                                                     self.auth_config)
-        gdata_auth.authenticate(args.non_interactive)
-        google_client = gdata_auth.getClient()
-
-        self.student_sheet = spreadsheets.SwEngStudentSpreadsheet(
-            google_client,
-            self.config["spreadsheet"]["title"],
-            self.config["spreadsheet"]["students_worksheet"])
-
-        self.team_sheet = spreadsheets.SwEngTeamSpreadsheet(
-            google_client,
-            self.config["spreadsheet"]["title"],
-            self.config["spreadsheet"]["teams_worksheet"])
-
-        self.sweng_class = students.SwEngClass(self.config)
-        self.sweng_class.populateFromSpreadsheet(self.student_sheet,
-                                                 self.team_sheet)
+        self.sweng_class = self.session.loadClass()
+        self.student_sheet = self.session.student_sheet
+        self.team_sheet = self.session.team_sheet
         
     @classmethod
-    def confirmClassOperation(cls):
+    def confirmClassOperation(cls, args=None):
+        # Confirmed on the command line, e.g., once for several
+        # configurations.
+        if getattr(args, "yes", False):
+            return True
+        if getattr(args, "non_interactive", False):
+            logging.error("This operation affects most or the entire class. "
+                          "Pass -y to proceed in non-interactive mode.")
+            return False
         answer = None
         while answer not in ["yes", "no"]:
             answer = raw_input("This operation affects most or the entire class. "
@@ -105,147 +146,277 @@ class SwengClassCommand(Command):
 class GithubCommand(SwengClassCommand):
     """A command that requires access to Github."""
 
+    # Set by the commands that consume the Github data as it is listed,
+    # through session.iterGithub(), instead of waiting for all of it.
+    streaming = False
+
     def execute(self, args):
         super(GithubCommand, self).execute(args)
 
-        github_auth = github.GithubAuthProvider(self.config,
-                                                self.auth_config)
-        github_auth.authenticate(args.non_interactive)
-        github_client = github_auth.getClient()
+        if self.streaming:
+            self.github_org = self.session.githubOrg()
+        else:
+            self.github_org = self.session.loadGithub()
 
-        # TODO: Let the class object figure this out
-        self.github_org = github_client.organization(
-            self.config["organization"]["name"])
-        self.sweng_class.updateGithubData(self.github_org)
+    def _runEach(self, entities, key, operation, workers=1):
+        """Apply the operation to each entity, and exit if it failed for any.
 
+        In a shard, the outcome for each entity is saved to its report.
+        """
 
-class StudentsListCommand(GithubCommand):
-    """List registered students."""
+        from swengmgmt import bulk
 
-    arg_name = "students-list"
+        def run(entity):
+            operation(entity)
+            return True
 
-    def register(self, parser):
-        parser.add_argument("-f", "--format", choices=["items", "tabular"],
-                            default="items")
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                            "Leave empty to include everyone.")
+        runner = bulk.BulkRunner(
+            bulk.BulkReport(getattr(self.args, "shard_report", None),
+                            self.reportOperation(self.args)),
+            key=key, workers=workers)
+        counts = runner.run(entities, run)
+        if counts.get("failed"):
+            logging.error("Failed on %d of %d." % (counts["failed"],
+                                                   len(entities)))
+            sys.exit(1)
 
-    def _printItemized(self, student_list):
-        for student in student_list:
-            print util.bold(str(student))
-            print "  Team: %s" % util.red_if_none(student.team_name)
-            print "  Github ID: %s" % util.red_if_none(student.github_id)
-            if student.team:
-                print "  Team Clone URL: %s" % util.red_if_none(student.team.repo_ssh_url)
-            print "  Exam Clone URL: %s" % util.red_if_none(student.repo_ssh_url)
-            print "  Exam access: %s" % util.red_if_none(util.red_green(
-                student.repo_access, "pull", "push"))
-            print
-
-    def _printTabular(self, student_list):
-        data = []
-        column_widths = {}
-
-        header = [
-            ("name", "Name"),
-            ("gaspar", "Gaspar"),
-            ("sciper", "SCIPER"),
-            ("team", "Team"),
-            ("exam-access", "Exam Access"),
-        ]
-        header_dict = dict(header)
 
-        for student in student_list:
-            entry = {
-              "name": student.name,
-              "gaspar": student.gaspar,
-              "sciper": student.sciper,
-              "team": student.team_name,
-              "exam-access": student.repo_access,
-            }
-            data.append(entry)
-
-            for key, value in entry.iteritems():
-                column_widths[key] = max(column_widths.get(key,
-                                                           len(header_dict[key])),
-                                         len(value or "N/A"))
-
-        for key, title in header:
-            print " %s" % title.ljust(column_widths[key]),
-        print
-        for key, title in header:
-            print " %s" % ("=" * column_widths[key]),
+FORMAT = arg("-f", "--format", choices=["items"] + sorted(output.FORMATS),
+             default="items",
+             help="The output format. Except for 'tabular', each entry is "
+             "printed as soon as its Github data is listed.")
+WIDTH = arg("-w", "--width", type=int,
+            help="With the tabular format, cut the columns to this width, "
+            "so that each entry can be printed as soon as it is listed.")
+
+
+class ListCommand(GithubCommand):
+    """A command printing entries of the class as they get listed."""
+
+    streaming = True
+
+    # The (key, title) of the record fields shown in tabular format and in
+    # the other formats.
+    tabular_fields = []
+    record_fields = []
+
+    def _record(self, entity):
+        raise NotImplementedError()
+
+    def _printItemized(self, entity):
+        raise NotImplementedError()
+
+    def _list(self, args, entity_class, query):
+        if args.format == "items":
+            writer = None
+        else:
+            fields = (self.tabular_fields if args.format == "tabular"
+                      else self.record_fields)
+            writer = output.createWriter(args.format, fields, args.width)
+            writer.begin()
+
+        for entity in self.session.iterGithub():
+            if not (isinstance(entity, entity_class) and query.match(entity)):
+                continue
+            with metrics.entity():
+                if writer:
+                    writer.write(self._record(entity))
+                else:
+                    self._printItemized(entity)
+                    sys.stdout.flush()
+
+        if writer:
+            writer.end()
+
+
+class StudentsListCommand(ListCommand):
+    """List registered students."""
+
+    arg_name = "students-list"
+    arguments = [FORMAT, WIDTH, EXCLUDE_STUDENTS, STUDENTS]
+
+    tabular_fields = [
+        ("name", "Name"),
+        ("gaspar", "Gaspar"),
+        ("sciper", "SCIPER"),
+        ("team", "Team"),
+        ("exam-access", "Exam Access"),
+    ]
+    record_fields = [
+        ("name", "Name"),
+        ("gaspar", "Gaspar"),
+        ("sciper", "SCIPER"),
+        ("email", "E-mail"),
+        ("github-id", "Github ID"),
+        ("team", "Team"),
+        ("team-clone-url", "Team Clone URL"),
+        ("exam-clone-url", "Exam Clone URL"),
+        ("exam-access", "Exam Access"),
+    ]
+
+    def _record(self, student):
+        return {
+            "name": student.name,
+            "gaspar": student.gaspar,
+            "sciper": student.sciper,
+            "email": student.email,
+            "github-id": student.github_id,
+            "team": student.team_name,
+            "team-clone-url": (student.team.repo_ssh_url
+                               if student.team else None),
+            "exam-clone-url": student.repo_ssh_url,
+            "exam-access": student.repo_access,
+        }
+
+    def _printItemized(self, student):
+        print util.bold(str(student))
+        print "  Team: %s" % util.red_if_none(student.team_name)
+        print "  Github ID: %s" % util.red_if_none(student.github_id)
+        if student.team:
+            print "  Team Clone URL: %s" % util.red_if_none(student.team.repo_ssh_url)
+        print "  Exam Clone URL: %s" % util.red_if_none(student.repo_ssh_url)
+        print "  Exam access: %s" % util.red_if_none(util.red_green(
+            student.repo_access, "pull", "push"))
         print
-        for entry in data:
-            for key, _ in header:
-                print " %s" % (entry[key] or "N/A").ljust(column_widths[key]).encode("utf-8"),
-            print
 
     def execute(self, args):
         super(StudentsListCommand, self).execute(args)
 
         query = students.StudentQuery(args.students, args.exclude)
-        student_list = self.sweng_class.findStudents(query)
-        if args.format == "items":
-            self._printItemized(student_list)
-        elif args.format == "tabular":
-            self._printTabular(student_list)
+        self._list(args, students.SwEngStudent, query)
 
 class StaffPermCommand(GithubCommand):
+    """Update the staff team permissions."""
+
     arg_name = "staff-perm"
 
-    def register(self, parser):
-        parser.add_argument("permission", choices=["push", "pull"],
-                            help="The permission to set.")
+    arguments = [PERMISSION]
 
     def execute(self, args):
         super(StaffPermCommand, self).execute(args)
         self.sweng_class.changeStaffPermissions(
             github_org=self.github_org, permission=args.permission)
 
+FLIP = [
+    arg("--at", type=util.parseTime, metavar="HH:MM[:SS]",
+        help="Change all the permissions at once, at the given time today. "
+        "The teams are checked and the connections opened beforehand."),
+    arg("--on-key", action="store_true", default=False,
+        help="Change all the permissions at once, when Enter is pressed."),
+    arg("--flip-jobs", type=int, default=20,
+        help="With --at or --on-key, the number of concurrent requests."),
+    arg("--flip-format", choices=sorted(output.FORMATS), default="tabular",
+        help="With --at or --on-key, the format of the timing report."),
+]
+
+
 class StudentsPermCommand(GithubCommand):
     """Update student permissions."""
 
     arg_name = "students-perm"
+    class_operation = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("permission", choices=["push", "pull"],
-                            help="The permission to set.")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                            "Leave empty to include everyone.")
+    arguments = FLIP + [EXCLUDE_STUDENTS, PERMISSION, STUDENTS]
+
+    report_fields = [
+        ("student", "Student"),
+        ("completed", "Completed"),
+        ("offset-ms", "Offset (ms)"),
+        ("status", "Status"),
+    ]
 
     def execute(self, args):
-        if not (args.students or self.confirmClassOperation()):
+        if args.at and args.on_key:
+            logging.error("--at and --on-key are exclusive.")
+            sys.exit(2)
+        if args.at and args.at <= time.time():
+            logging.error("%s is already past."
+                          % time.strftime("%H:%M:%S", time.localtime(args.at)))
+            sys.exit(2)
+
+        if not (args.students or self.confirmClassOperation(args)):
             return
         
         super(StudentsPermCommand, self).execute(args)
         
         query = students.StudentQuery(args.students, args.exclude)
         student_list = self.sweng_class.findStudents(query)
+
+        if args.at or args.on_key:
+            self._flip(args, student_list)
+            return
         
         for student in student_list:
-            student.updateTeamPermission(args.permission)
+            with metrics.entity():
+                student.updateTeamPermission(args.permission)
+
+    def _flip(self, args, student_list):
+        from swengmgmt import flip
+
+        permission_flip = flip.PermissionFlip(self.session.githubClient(),
+                                              student_list, args.permission,
+                                              args.flip_jobs)
+        problems = permission_flip.prepare()
+        if problems:
+            for problem in problems:
+                logging.error(problem)
+            logging.error("Not changing any permission. Exclude the students "
+                          "above to go ahead.")
+            sys.exit(1)
+        if not permission_flip.results:
+            return
+
+        if args.at:
+            permission_flip.waitUntil(args.at - flip.WARM_AHEAD)
+        permission_flip.arm()
+        fired = False
+        try:
+            if args.at:
+                permission_flip.waitUntil(args.at)
+            else:
+                raw_input("Ready to give %s access to %d students. "
+                          "Press Enter to go ahead." %
+                          (args.permission, len(permission_flip.results)))
+            fired_at = permission_flip.fire()
+            fired = True
+        finally:
+            if not fired:
+                permission_flip.abort()
+
+        writer = output.createWriter(args.flip_format, self.report_fields)
+        writer.begin()
+        for result in sorted(permission_flip.results,
+                             key=lambda result: result.end):
+            writer.write({
+                "student": result.entity.gaspar,
+                "completed": time.strftime(
+                    "%H:%M:%S", time.localtime(result.end)) +
+                    ("%.3f" % (result.end % 1))[1:],
+                "offset-ms": "%.0f" % ((result.end - fired_at) * 1000),
+                "status": result.error or "ok",
+            })
+        writer.end()
+
+        first, last = permission_flip.spread()
+        if first is not None:
+            logging.info("Completed in %.0f ms after firing, spread over "
+                         "%.0f ms." % ((last - fired_at) * 1000,
+                                       (last - first) * 1000))
+        failed = permission_flip.failed()
+        if failed:
+            logging.error("%d permission changes failed." % len(failed))
+            sys.exit(1)
 
 class StudentsHideCommand(GithubCommand):
     """Hide the student's repository, if it exists, by removing them as a collaborator."""
 
     arg_name = "students-hide"
+    class_operation = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                    help="A list of students to exclude.")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                            "Leave empty to include everyone.")
+    arguments = [EXCLUDE_STUDENTS, STUDENTS]
 
     def execute(self, args):
-        if not (args.students or self.confirmClassOperation()):
+        if not (args.students or self.confirmClassOperation(args)):
             return
 
         super(StudentsHideCommand, self).execute(args)
@@ -254,119 +425,278 @@ class StudentsHideCommand(GithubCommand):
         student_list = self.sweng_class.findStudents(query)
 
         for student in student_list:
-            self.sweng_class.hideExamRepo(student, self.github_org)
+            with metrics.entity():
+                self.sweng_class.hideExamRepo(student, self.github_org)
 
 class StudentsCreateCommand(GithubCommand):
     """Create exam repos for students."""
 
     arg_name = "students-create"
+    shardable = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("--read-only", default=False, action='store_true',
-                            help="Make this repo read-only for students")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                            "Leave empty to include everyone.")
+    arguments = [
+        EXCLUDE_STUDENTS,
+        arg("--read-only", default=False, action='store_true',
+            help="Make this repo read-only for students"),
+        STUDENTS,
+    ]
 
     def execute(self, args):
         super(StudentsCreateCommand, self).execute(args)
         
         query = students.StudentQuery(args.students, args.exclude)
         student_list = self.sweng_class.findStudents(query)
-        
-        for student in student_list:
-            self.sweng_class.createExamRepo(student, self.github_org, read_only=args.read_only)
+
+        self._runEach(student_list, lambda student: student.gaspar,
+                      lambda student: self.sweng_class.createExamRepo(
+                          student, self.github_org, read_only=args.read_only))
 
 class StudentsPopulateCommand(GithubCommand):
     """Force push a given repository to students' exam repositories"""
 
     arg_name = "students-populate"
-
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("--clone", required=True,
-                            help="The repo repository to clone into all student repositories.")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                            "Leave empty to include everyone.")
+    shardable = True
+
+    arguments = [
+        EXCLUDE_STUDENTS,
+        arg("--clone",
+            help="The repo repository to clone into all student repositories."),
+        arg("--template", metavar="OWNER/NAME",
+            help="Instead of --clone, the Github template repository to "
+            "create the missing student repositories from, on Github's side."),
+        arg("--all-branches", default=False, action="store_true",
+            help="With --template, copy all the branches, not only the "
+            "default one."),
+        arg("-j", "--jobs", type=int, default=8,
+            help="With --template, the number of repositories created "
+            "concurrently."),
+        STUDENTS,
+    ]
 
     def clone_repo(self, clone_url, local_dir):
-        with util.cd(local_dir):
+        with util.cd(local_dir), profiling.span("git", "clone"):
             subprocess.check_call(shlex.split("git clone {url} clone_source".format(
                 local_dir=local_dir, url=clone_url
             )))
         return "{dir}/clone_source".format(dir=local_dir)
 
     def execute(self, args):
+        if bool(args.clone) == bool(args.template):
+            logging.error("Either --clone or --template is required.")
+            sys.exit(2)
+
         super(StudentsPopulateCommand, self).execute(args)
         query = students.StudentQuery(args.students, args.exclude)
         student_list = self.sweng_class.findStudents(query)
 
+        if args.template:
+            self._generate(args, student_list)
+            return
+
         clone_dir = tempfile.mkdtemp()
         try:
             repo_path = self.clone_repo(clone_url=args.clone, local_dir=clone_dir)
-            for student in student_list:
-                self.sweng_class.cloneRepo(repo_path=repo_path,
-                                           student=student, github_org=self.github_org)
+            # One at a time, through the remote of the clone.
+            self._runEach(student_list, lambda student: student.gaspar,
+                          lambda student: self.sweng_class.cloneRepo(
+                              repo_path=repo_path, student=student,
+                              github_org=self.github_org))
         finally:
             shutil.rmtree(clone_dir, ignore_errors=True)
 
+    def _generate(self, args, student_list):
+        from swengmgmt import github
 
-class StudentsDeleteCommand(GithubCommand):
+        try:
+            github.templateRepository(self.github_org, args.template)
+        except github.TemplateError, e:
+            logging.error(e)
+            sys.exit(2)
+
+        github.widenConnectionPool(self.session.githubClient(), args.jobs)
+        self._runEach(student_list, lambda student: student.gaspar,
+                      lambda student: self.sweng_class.generateRepo(
+                          student, self.github_org, args.template,
+                          args.all_branches),
+                      workers=args.jobs)
+
+
+JOBS = arg("-j", "--jobs", type=int, default=8,
+           help="The number of students or teams handled concurrently.")
+BULK = [
+    JOBS,
+    arg("--rate", type=float, default=10,
+        help="The maximum number of Github API calls per second."),
+    arg("--report",
+        help="The report of the deletions, used to resume them if "
+        "interrupted. Defaults to <command>-report.json in the current "
+        "directory."),
+]
+
+
+class BulkDeleteCommand(GithubCommand):
+    """A command deleting the Github data of many entities concurrently."""
+
+    shardable = True
+
+    # The Github API calls made to delete one entity, at most.
+    calls_per_entity = 1
+
+    def _key(self, entity):
+        raise NotImplementedError()
+
+    def _delete(self, entity):
+        """Delete the data of the entity, and return True if it is gone."""
+        raise NotImplementedError()
+
+    def _bulkDelete(self, args, entities):
+        from swengmgmt import bulk
+        from swengmgmt import github
+
+        # A shard keeps a report of its own.
+        default_report = not (getattr(args, "shard_report", None) or
+                              args.report)
+        try:
+            report = bulk.BulkReport(getattr(args, "shard_report", None) or
+                                     args.report or
+                                     "%s-report.json" % self.arg_name,
+                                     self.reportOperation(args))
+        except bulk.ReportError, e:
+            logging.error(str(e))
+            sys.exit(2)
+
+        runner = bulk.BulkRunner(report, self._key, workers=args.jobs,
+                                 rate=args.rate,
+                                 calls_per_entity=self.calls_per_entity)
+        pending = runner.pending(entities)
+        if len(pending) < len(entities):
+            logging.info("Resuming: %d of %d already done according to %s."
+                         % (len(entities) - len(pending), len(entities),
+                            report.path))
+
+        # Shared with the runs on the other configurations, if any.
+        budget = (github.rateLimitRemaining(self.session.githubClient())
+                  / getattr(args, "rate_limit_share", 1)
+                  / self.calls_per_entity)
+        if budget < len(pending):
+            logging.warning("The Github rate limit leaves room for %d of the "
+                            "%d deletions. Run again once it is reset."
+                            % (budget, len(pending)))
+            # Left pending, so that the report is not taken as complete.
+            report.merge(dict((self._key(entity),
+                               {"status": "pending", "time": time.time()})
+                              for entity in pending[budget:]))
+            pending = pending[:budget]
+
+        counts = runner.run(pending, self._delete)
+        logging.info("%d done, %d failed in total. See %s."
+                     % (counts.get("done", 0), counts.get("failed", 0),
+                        report.path))
+        if counts.get("failed"):
+            sys.exit(1)
+        # Nothing left to resume: the next run starts over.
+        if default_report and report.complete() and report.remove():
+            logging.info("All done; removed %s." % report.path)
+
+
+class StudentsDeleteCommand(BulkDeleteCommand):
     """[DANGEROUS] Delete the exam repos of students."""
 
     arg_name = "students-delete"
+    class_operation = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("students", nargs="*",
-                            help="A list of students to consider. "
-                                 "Leave empty to include everyone.")
+    arguments = BULK + [
+        EXCLUDE_STUDENTS,
+        arg("--erase", action="store_true", default=False,
+            help="Also delete the exam teams, for the end-of-year cleanup."),
+        STUDENTS,
+    ]
+
+    @classmethod
+    def reportOperation(cls, args):
+        # The repositories deleted do not tell that the teams are.
+        if args.erase:
+            return "%s --erase" % cls.arg_name
+        return cls.arg_name
+
+    def _key(self, student):
+        return student.gaspar
+
+    def _delete(self, student):
+        if self.args.erase:
+            student.eraseGithubData()
+            return not (student.gh_team or student.gh_repo)
+        self.sweng_class.deleteExamRepo(student, self.github_org)
+        return not student.gh_repo
 
     def execute(self, args):
-        if not (args.students or self.confirmClassOperation()):
+        if not (args.students or self.confirmClassOperation(args)):
             return
         super(StudentsDeleteCommand, self).execute(args)
 
-        query = students.StudentQuery(args.students, args.exclude)
-        student_list = self.sweng_class.findStudents(query)
+        if args.erase:
+            self.calls_per_entity = 2
 
-        for student in student_list:
-            self.sweng_class.deleteExamRepo(student, self.github_org)
+        query = students.StudentQuery(args.students, args.exclude)
+        self._bulkDelete(args, self.sweng_class.findStudents(query))
 
 
-class TeamsListCommand(GithubCommand):
+class TeamsListCommand(ListCommand):
     """List registered teams."""
 
     arg_name = "teams-list"
-
-    def register(self, parser):
-        pass
+    arguments = [FORMAT, WIDTH, EXCLUDE_TEAMS, TEAMS]
+
+    tabular_fields = [
+        ("name", "Name"),
+        ("github-slug", "Github Slug"),
+        ("members", "Members"),
+        ("access", "Access"),
+    ]
+    record_fields = [
+        ("name", "Name"),
+        ("github-slug", "Github Slug"),
+        ("members", "Members"),
+        ("clone-url", "Clone URL"),
+        ("access", "Access"),
+    ]
+
+    def _record(self, team):
+        return {
+            "name": team.name,
+            "github-slug": team.github_slug,
+            "members": " ".join(student.gaspar for student in team.students),
+            "clone-url": team.repo_ssh_url,
+            "access": team.repo_access,
+        }
+
+    def _printItemized(self, team):
+        print util.bold(str(team))
+        print "  Github slug: %s" % util.red_if_none(team.github_slug)
+        print "  Members: %s" % ", ".join(str(student)
+                                          for student in team.students)
+        print "  Clone URL: %s" % util.red_if_none(team.repo_ssh_url)
+        print "  Access: %s" % util.red_if_none(util.red_green(
+            team.repo_access, "pull", "push"))
+        print
 
     def execute(self, args):
-        pass
+        super(TeamsListCommand, self).execute(args)
+
+        query = students.TeamQuery(args.teams, args.exclude)
+        self._list(args, students.SwEngTeam, query)
 
 
 class TeamsPermCommand(GithubCommand):
     """Update teams permissions."""
 
     arg_name = "teams-perm"
+    class_operation = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of teams to exclude.")
-        parser.add_argument("permission", choices=["push", "pull"],
-                            help="The permission to set.")
-        parser.add_argument("teams", nargs="*",
-                            help="A list of teams to consider. "
-                            "Leave empty to include everyone.")
+    arguments = [EXCLUDE_TEAMS, PERMISSION, TEAMS]
 
     def execute(self, args):
-        if not (args.teams or self.confirmClassOperation()):
+        if not (args.teams or self.confirmClassOperation(args)):
             return
         
         super(TeamsPermCommand, self).execute(args)
@@ -375,41 +705,53 @@ class TeamsPermCommand(GithubCommand):
         team_list = self.sweng_class.findTeams(query)
         
         for team in team_list:
-            team.updateTeamPermission(args.permission)
+            with metrics.entity():
+                team.updateTeamPermission(args.permission)
 
 
 class TeamsCreateCommand(GithubCommand):
     """Create homework repos for teams."""
 
     arg_name = "teams-create"
+    shardable = True
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of teams to exclude.")
-        parser.add_argument("teams", nargs="*",
-                            help="A list of teams to consider. "
-                            "Leave empty to include everyone.")
+    arguments = [EXCLUDE_TEAMS, TEAMS]
 
     def execute(self, args):
         super(TeamsCreateCommand, self).execute(args)
         
         query = students.TeamQuery(args.teams, args.exclude)
         team_list = self.sweng_class.findTeams(query)
-        
-        for team in team_list:
-            self.sweng_class.createTeamRepo(team, self.github_org)
+
+        self._runEach(team_list, lambda team: team.name,
+                      lambda team: self.sweng_class.createTeamRepo(
+                          team, self.github_org))
 
 
-class TeamsDeleteCommand(GithubCommand):
+class TeamsDeleteCommand(BulkDeleteCommand):
     """[DANGEROUS] Delete the homework repos of teams."""
 
     arg_name = "teams-delete"
+    class_operation = True
+
+    arguments = BULK + [EXCLUDE_TEAMS, TEAMS]
+
+    calls_per_entity = 2
 
-    def register(self, parser):
-        pass
+    def _key(self, team):
+        return team.name
+
+    def _delete(self, team):
+        team.eraseGithubData()
+        return not (team.gh_team or team.gh_repo)
 
     def execute(self, args):
-        pass
+        if not (args.teams or self.confirmClassOperation(args)):
+            return
+        super(TeamsDeleteCommand, self).execute(args)
+
+        query = students.TeamQuery(args.teams, args.exclude)
+        self._bulkDelete(args, self.sweng_class.findTeams(query))
 
 
 class RepairCommand(SwengClassCommand):
@@ -417,13 +759,16 @@ class RepairCommand(SwengClassCommand):
 
     arg_name = "repair"
 
-    def register(self, parser):
-        pass
-
     def execute(self, args):
         super(RepairCommand, self).execute(args)
 
-        ldap_object = epfl.EPFL_LDAP()
+        from swengmgmt import epfl
+
+        # Unless the roster is refreshed, the recent directory entries are
+        # reused.
+        ldap_object = epfl.EPFL_LDAP(
+            cache=None if self.session.refresh_roster
+            else self.session.stateCache())
         self.student_sheet.repair(ldap_object)
 
 
@@ -432,12 +777,13 @@ class ClassOpen(GithubCommand):
 
     arg_name = "class-open"
 
-    def register(self, parser):
-        pass
+    arguments = [JOBS]
 
     def execute(self, args):
         super(ClassOpen, self).execute(args)
-        self.sweng_class.openTeamReposToClass(self.github_org)
+        if not self.sweng_class.openTeamReposToClass(self.github_org,
+                                                     workers=args.jobs):
+            sys.exit(1)
 
 
 class ClassClose(GithubCommand):
@@ -445,12 +791,13 @@ class ClassClose(GithubCommand):
 
     arg_name = "class-close"
 
-    def register(self, parser):
-        pass
+    arguments = [JOBS]
 
     def execute(self, args):
         super(ClassClose, self).execute(args)
-        self.sweng_class.closeTeamReposToClass(self.github_org)
+        if not self.sweng_class.closeTeamReposToClass(self.github_org,
+                                                      workers=args.jobs):
+            sys.exit(1)
 
 
 class ClassCreate(GithubCommand):
@@ -458,12 +805,7 @@ class ClassCreate(GithubCommand):
 
     arg_name = "class-create"
 
-    def register(self, parser):
-        parser.add_argument("--exclude", nargs="*",
-                            help="A list of students to exclude.")
-        parser.add_argument("students", nargs="*",
-                        help="A list of students to consider. "
-                             "Leave empty to include everyone.")
+    arguments = [EXCLUDE_STUDENTS, STUDENTS]
 
     def execute(self, args):
         super(ClassCreate, self).execute(args)
@@ -472,19 +814,442 @@ class ClassCreate(GithubCommand):
         student_list = self.sweng_class.findStudents(query)
 
         for student in student_list:
-            self.sweng_class.addStudentToClassTeam(student, self.github_org)
+            with metrics.entity():
+                self.sweng_class.addStudentToClassTeam(student, self.github_org)
+
+class AuditCommand(Command):
+    """Report the drift between the roster, LDAP and Github, without
+    changing anything."""
+
+    arg_name = "audit"
+    arguments = [
+        arg("-f", "--format", choices=sorted(output.FORMATS),
+            default="tabular",
+            help="The output format of the drifts."),
+        WIDTH,
+        JOBS,
+        arg("--no-ldap", dest="ldap", action="store_false", default=True,
+            help="Do not look the students up in the directory."),
+        arg("--members", action="store_true", default=False,
+            help="Also list the members of the Github team of each student "
+            "and team, one call each."),
+        arg("--exam-access", choices=["push", "pull"],
+            help="The expected access of the students to their exam "
+            "repository. Defaults to the access of most of them."),
+        arg("--team-access", choices=["push", "pull"],
+            help="The expected access of the teams to their repository. "
+            "Defaults to the access of most of them."),
+    ]
+
+    def execute(self, args):
+        super(AuditCommand, self).execute(args)
+
+        from swengmgmt import audit
+        from swengmgmt import epfl
+        from swengmgmt import github
+
+        org_config = self.config["organization"]
+        github_org = self.session.githubOrg()
+        snapshot = self.session.githubSnapshot()
+        state_cache = (None if self.session.refresh_roster
+                       else self.session.stateCache())
+
+        # Listed while the roster is loaded, without the session, which the
+        # command holds.
+        if snapshot:
+            listings = [snapshot.teams, snapshot.repos]
+        else:
+            listings = [
+                lambda: list(github.iterOrgTeams(github_org)),
+                lambda: list(students.SwEngClass(
+                    self.config).iterGithubRepos(github_org)),
+            ]
+        listings += [
+            lambda: [member["login"] for member in github.iterTeamMembers(
+                github_org, org_config["class-team-id"])],
+            lambda: [member["login"] for member in github.iterTeamMembers(
+                github_org, org_config["staff-team-id"])],
+        ]
+        background = audit.Background(listings).start()
+
+        sweng_class = self.session.loadClass()
+        class_audit = audit.ClassAudit(sweng_class, workers=args.jobs)
+        class_audit.checkRoster()
+
+        complete = True
+        if args.ldap:
+            complete = class_audit.checkLdap(
+                lambda: epfl.EPFL_LDAP(cache=state_cache))
+
+        with metrics.phase("github"):
+            team_list, repo_list, class_members, staff_members = (
+                background.results())
+            class_audit.checkGithub(team_list, repo_list, class_members,
+                                    staff_members,
+                                    {"student": args.exam_access,
+                                     "team": args.team_access})
+            if args.members:
+                complete = class_audit.checkMembers(
+                    lambda team_id: github.iterTeamMembers(
+                        github_org, team_id)) and complete
+
+        writer = output.createWriter(args.format, audit.FIELDS, args.width)
+        writer.begin()
+        for drift in class_audit.sortedDrifts():
+            writer.write(drift)
+        writer.end()
+
+        counts = class_audit.counts()
+        if counts:
+            logging.warning("%d drifts: %s." % (
+                sum(count for _, count in counts),
+                ", ".join("%d %s" % (count, category)
+                          for category, count in counts)))
+        else:
+            logging.info("No drift found.")
+        if not complete:
+            logging.error("Some checks failed; the audit is incomplete.")
+            sys.exit(2)
+        if counts:
+            sys.exit(1)
+
+
+class StudentsGradeCommand(SwengClassCommand):
+    """Run a grading script on the exam repository of each student."""
+
+    arg_name = "students-grade"
+
+    arguments = [
+        EXCLUDE_STUDENTS,
+        arg("--script", required=True,
+            help="The executable run at the root of a worktree of each "
+            "repository. Its exit status tells whether the student passed, "
+            "and the last line of its output is reported as their result."),
+        arg("-o", "--output", default="grades.csv",
+            help="The CSV file of the results, by gaspar."),
+        arg("--clones", default="grading/clones",
+            help="The directory of the clones of the repositories."),
+        arg("--logs", default="grading/logs",
+            help="The directory of the outputs of the script."),
+        arg("--cache", default="grading/cache.json",
+            help="The results of the previous runs, by commit and script."),
+        arg("--ref", default="HEAD",
+            help="The branch, tag or commit graded in each repository."),
+        arg("--no-fetch", dest="fetch", action="store_false", default=True,
+            help="Grade the clones as they are, without Github."),
+        arg("--cpu", type=int, default=600,
+            help="The CPU time limit of the script and all of its processes, "
+            "in seconds."),
+        arg("--timeout", type=int, default=900,
+            help="The time after which the script is killed, in seconds."),
+        arg("-j", "--jobs", type=int, default=multiprocessing.cpu_count(),
+            help="The number of scripts run at once. Defaults to the number "
+            "of cores."),
+        STUDENTS,
+    ]
+
+    def execute(self, args):
+        if not os.access(args.script, os.X_OK):
+            logging.error("%s is not an executable script." % args.script)
+            sys.exit(2)
+
+        super(StudentsGradeCommand, self).execute(args)
+
+        from swengmgmt import bulk
+        from swengmgmt import grading
+        from swengmgmt import store
+
+        if args.fetch:
+            self.session.loadGithub()
+        query = students.StudentQuery(args.students, args.exclude)
+        student_list = self.sweng_class.findStudents(query)
+
+        cache = store.StateCache(args.cache)
+        grader = grading.Grader(args.script, args.clones, args.logs, cache,
+                                cpu_seconds=args.cpu, timeout=args.timeout,
+                                ref=args.ref, fetch=args.fetch)
+        runner = bulk.BulkRunner(bulk.BulkReport(None, self.arg_name),
+                                 key=lambda student: student.gaspar,
+                                 workers=args.jobs)
+        try:
+            failures = runner.run(student_list, grader.grade).get("failed", 0)
+        finally:
+            cache.flush()
+            with open(args.output, "wb") as f:
+                writer = output.createWriter("csv", grading.FIELDS, stream=f)
+                writer.begin()
+                for gaspar in sorted(grader.results):
+                    writer.write(grader.results[gaspar])
+                writer.end()
+
+        logging.info("Graded %d students: %s. Results in %s." % (
+            len(grader.results),
+            ", ".join("%d %s" % (count, status) for status, count
+                      in sorted(grader.counts().iteritems())),
+            args.output))
+        if failures:
+            logging.error("Could not grade %d students." % failures)
+            sys.exit(1)
+
 
 ALL_COMMANDS = [StudentsListCommand, StudentsPermCommand, StudentsCreateCommand,
                 StudentsDeleteCommand, TeamsListCommand, TeamsPermCommand,
                 TeamsCreateCommand, TeamsDeleteCommand, RepairCommand,
                 ClassOpen, ClassClose, ClassCreate, StaffPermCommand,
-                StudentsHideCommand, StudentsPopulateCommand]
+                StudentsHideCommand, StudentsPopulateCommand, AuditCommand,
+                StudentsGradeCommand]
+
+
+
+class SessionCommand(Command):
+    """A command acting on the session shared by a server or shell."""
+
+    arguments = [
+        arg("parts", nargs="*",
+            help="The parts of the session to consider, among %s. "
+            "Leave empty to include the roster and the Github data."
+            % ", ".join(session.PARTS)),
+    ]
+
+    def _checkParts(self, args):
+        if not getattr(args, "session", None):
+            logging.error("'%s' only applies to a running server or shell."
+                          % self.arg_name)
+            return None
+        parts = args.parts or ["roster"]
+        unknown = set(parts) - set(session.PARTS)
+        if unknown:
+            logging.error("Unknown session parts: %s" % ", ".join(unknown))
+            return None
+        return parts
+
+
+class RefreshCommand(SessionCommand):
+    """Reload parts of the shared session now."""
+
+    arg_name = "refresh"
+
+    def execute(self, args):
+        parts = self._checkParts(args)
+        if not parts:
+            return
+        super(RefreshCommand, self).execute(args)
+        self.session.refresh(parts)
+
+
+class InvalidateCommand(SessionCommand):
+    """Drop parts of the shared session, to be reloaded on next use."""
+
+    arg_name = "invalidate"
+
+    def execute(self, args):
+        parts = self._checkParts(args)
+        if not parts:
+            return
+        super(InvalidateCommand, self).execute(args)
+        self.session.invalidate(parts)
+
+
+SESSION_COMMANDS = [RefreshCommand, InvalidateCommand]
+
+
+PRELOAD = arg("--no-preload", dest="preload", action="store_false",
+              default=True,
+              help="Load the roster and the Github data on the first command "
+              "that needs them, instead of at startup.")
+
+
+class ServeCommand(Command):
+    """Serve commands from a warm session over a Unix socket."""
+
+    arg_name = "serve"
+    arguments = [PRELOAD]
+
+    def execute(self, args):
+        super(ServeCommand, self).execute(args)
+
+        from swengmgmt import daemon
+
+        if args.preload:
+            self.session.loadGithub()
+
+        parser = argparse.ArgumentParser(prog="manage.py")
+        registerCommands(parser, ALL_COMMANDS + SESSION_COMMANDS)
+        daemon.CommandServer(args.socket, self.session, parser).serve()
+
+
+class ShellCommand(Command):
+    """Run commands interactively on a single loaded class."""
+
+    arg_name = "shell"
+    arguments = [PRELOAD]
+
+    def execute(self, args):
+        super(ShellCommand, self).execute(args)
+
+        from swengmgmt import shell
+
+        if args.preload:
+            self.session.loadGithub()
+
+        command_list = ALL_COMMANDS + SESSION_COMMANDS
+        parser = argparse.ArgumentParser(prog="", add_help=False)
+        registerCommands(parser, command_list)
+        shell.ClassShell(parser, command_list, self.session).run()
+
+
+class WebhookListenCommand(Command):
+    """Keep a snapshot of the class on Github up to date from webhooks."""
+
+    arg_name = "webhook-listen"
+    arguments = [
+        arg("--bind", default="127.0.0.1",
+            help="The address to listen on."),
+        arg("--port", type=int,
+            help="The port to listen on. Defaults to webhook.port in the "
+            "configuration, or 8042."),
+        arg("--save-deliveries", metavar="DIR",
+            help="Save each verified delivery to DIR, to be replayed later "
+            "with bench/replay.py."),
+    ]
+
+    def execute(self, args):
+        super(WebhookListenCommand, self).execute(args)
+
+        from swengmgmt import webhook
+
+        webhook_config = self.config.get("webhook") or {}
+        if not webhook_config.get("secret"):
+            logging.error("The configuration has no webhook secret.")
+            sys.exit(2)
+        state_cache = self.session.stateCache()
+        if not state_cache:
+            logging.error("The snapshot is kept in the cache, which is "
+                          "disabled in the configuration.")
+            sys.exit(2)
+
+        snapshot = webhook.OrgSnapshot(state_cache,
+                                       self.config["organization"])
+        listener = webhook.WebhookListener(
+            snapshot, webhook_config["secret"],
+            (args.bind, args.port or webhook_config.get("port", 8042)),
+            args.save_deliveries).start()
+        try:
+            # The class repositories are listed as by the other commands,
+            # without loading the roster.
+            github_org = self.session.githubOrg()
+            listener.seed(github_org, students.SwEngClass(
+                self.config).iterGithubRepos(github_org))
+            logging.info("The snapshot is up to date.")
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.stop()
+
+
+class RunCommand(Command):
+    """Run a script of commands, loading the class data only once."""
+
+    arg_name = "run"
+    arguments = [
+        arg("--serial", action="store_true", default=False,
+            help="Run the lines ending with '&' one after the other too."),
+        arg("-k", "--keep-going", action="store_true", default=False,
+            help="Keep running the script after a failed step."),
+        arg("script", type=argparse.FileType("r"),
+            help="The script to run, with one command per line."),
+    ]
+
+    def execute(self, args):
+        super(RunCommand, self).execute(args)
+
+        from swengmgmt import batch
+
+        parser = argparse.ArgumentParser(prog=args.script.name)
+        registerCommands(parser, ALL_COMMANDS + SESSION_COMMANDS)
+        try:
+            steps = batch.parseScript(args.script, parser)
+        except batch.ScriptError, e:
+            logging.error(str(e))
+            sys.exit(2)
+        if not batch.confirmBackgroundSteps(steps, args):
+            return
+
+        start = time.time()
+        runner = batch.ScriptRunner(parser, self.session)
+        success = runner.run(steps, serial=args.serial,
+                             keep_going=args.keep_going)
+        runner.printSummary(steps, time.time() - start)
+        if not success:
+            sys.exit(1)
+
+
+def runCommandLine(parser, shared_session, argv, exclusive=True,
+                   confirmed=False):
+    """Run one command line on a shared session and return its exit status.
+
+    Unless exclusive is False, the command holds the session for itself
+    until it is done. If confirmed, it does not ask for the confirmation of
+    an operation on the entire class.
+    """
+
+    start = time.time()
+    try:
+        if exclusive:
+            shared_session.lock.acquire()
+        try:
+            args = parser.parse_args(argv)
+            # The steps have no global options, e.g., -y: they take those of
+            # the command line that started the session.
+            for name, value in vars(shared_session.global_args or
+                                    argparse.Namespace()).iteritems():
+                if not hasattr(args, name):
+                    setattr(args, name, value)
+            if confirmed:
+                args.yes = True
+            args.session = shared_session
+            command = args.command()
+            try:
+                command.execute(args)
+            finally:
+                command.finalize()
+        finally:
+            if exclusive:
+                shared_session.lock.release()
+        return 0
+    except SystemExit, e:
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        logging.exception("Command '%s' failed." % " ".join(argv))
+        return 1
+    finally:
+        logging.info("'%s' took %.3f s." % (" ".join(argv), time.time() - start))
 
 
 def registerGlobalArguments(parser):
-    parser.add_argument("-c", "--config", default="config.yaml",
-                        help="The configuration file to use. "
-                        "Relative paths are appended to the script directory.")
+    parser.add_argument("-c", "--config", action="append",
+                        help="The configuration file to use, config.yaml by "
+                        "default. Relative paths are appended to the script "
+                        "directory. Given several times, the command is run "
+                        "on each configuration concurrently.")
+    parser.add_argument("--config-jobs", type=int,
+                        help="With several configurations, the number run "
+                        "at once. All of them by default.")
+    parser.add_argument("-y", "--yes", action="store_true", default=False,
+                        help="Proceed with the operations affecting most or "
+                        "the entire class, without asking.")
+    parser.add_argument("--rate-limit-share", type=int, default=1,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--shards", type=int,
+                        help="Split the students or teams of a bulk command "
+                        "between SHARDS processes, each with its own Github "
+                        "token, from github.shard_tokens in the "
+                        "authentication file.")
+    parser.add_argument("--shard", type=shard.shardSpec,
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--shard-report", help=argparse.SUPPRESS)
     parser.add_argument("-a", "--auth", default="auth.yaml",
                         help="The authentication cache file to use. "
                         "Relative paths are appended to the script directory.")
@@ -495,14 +1260,46 @@ def registerGlobalArguments(parser):
                         default=False,
                         help="Refrain from requesting user input.  Useful when "
                         "using the command in batch mode.")
+    parser.add_argument("--refresh-roster", action="store_true",
+                        default=False,
+                        help="Look up the roster worksheets and the LDAP "
+                        "entries again, even if they are cached.")
+    parser.add_argument("--profile", action="store_true", default=False,
+                        help="Print the calls made to each backend, with "
+                        "their latency and size, at exit.")
+    parser.add_argument("--profile-trace", metavar="FILE",
+                        help="Also write the calls to FILE, in the Chrome "
+                        "trace format (see chrome://tracing).")
+    parser.add_argument("--record", metavar="FILE",
+                        help="Record the HTTP responses of Sheets and Github "
+                        "to the cassette FILE, without the credentials.")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="Replay the HTTP responses recorded in the "
+                        "cassette FILE, instead of contacting Sheets and "
+                        "Github.")
+    parser.add_argument("--replay-latency", choices=["recorded", "zero"],
+                        default="recorded",
+                        help="Wait as long as the recorded responses took, "
+                        "or not at all.")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write the statistics of the run to FILE, in "
+                        "the Prometheus text format (for the node exporter "
+                        "textfile collector).")
+    parser.add_argument("-s", "--socket", default="manage.sock",
+                        help="The socket of the command server. "
+                        "Relative paths are appended to the script directory.")
+    parser.add_argument("-r", "--remote", action="store_true",
+                        default=False,
+                        help="Run the command on the server listening on the "
+                        "socket, instead of in this process.")
 
 
 def registerCommands(parser, commands):
     subparsers = parser.add_subparsers(help="The operation to perform on the class")
 
     for command in commands:
-        cmd_inst = command()
         subparser = subparsers.add_parser(command.arg_name,
                                           help=command.__doc__)
-        cmd_inst.register(subparser)
-        subparser.set_defaults(command=cmd_inst)
+        for flags, options in command.arguments:
+            subparser.add_argument(*flags, **options)
+        subparser.set_defaults(command=command)
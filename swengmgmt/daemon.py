@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Command server keeping a warm session, and its thin client.
+
+The client sends the command line of one command over a Unix socket; the
+server runs it against its session and streams back the output. The messages
+are JSON objects, one per line:
+
+  client -> server  {"argv": [...]}            the command to run
+  server -> client  {"stream": "out", "data": ...}
+                    {"prompt": ..., "secret": false}
+  client -> server  {"answer": ...}            the reply to a prompt
+  server -> client  {"status": 0}              the command is done
+"""
+
+
+import __builtin__
+import errno
+import getpass
+import json
+import logging
+import os
+import socket
+import SocketServer
+import sys
+
+from swengmgmt import commands
+
+
+LOG_FORMAT = '-- [%(asctime)s] %(message)s'
+
+
+class ServerError(Exception):
+    pass
+
+
+class Channel(object):
+    """A line-based JSON message channel over a socket."""
+
+    def __init__(self, rfile, wfile):
+        self._rfile = rfile
+        self._wfile = wfile
+
+    def send(self, **message):
+        self._wfile.write(json.dumps(message) + "\n")
+        self._wfile.flush()
+
+    def receive(self):
+        line = self._rfile.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def prompt(self, text, secret=False):
+        self.send(prompt=text, secret=secret)
+        reply = self.receive()
+        if reply is None:
+            raise EOFError()
+        return reply["answer"]
+
+
+class ClientStream(object):
+    """File-like object forwarding the writes of a command to the client."""
+
+    def __init__(self, channel, name):
+        self._channel = channel
+        self._name = name
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.decode("utf-8", "replace")
+        self._channel.send(stream=self._name, data=data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        # Not a terminal, so the output is never highlighted.
+        return self._channel._wfile.fileno()
+
+
+class _CommandHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        channel = Channel(self.rfile, self.wfile)
+        request = channel.receive()
+        if not request:
+            return
+        status = self.server.runCommand(request["argv"], channel)
+        channel.send(status=status)
+
+
+class CommandServer(SocketServer.UnixStreamServer):
+    """Runs the commands of its clients, one at a time, on a shared session."""
+
+    def __init__(self, socket_path, session, parser):
+        self._session = session
+        self._parser = parser
+
+        if os.path.exists(socket_path):
+            if isServing(socket_path):
+                raise ServerError("A server is already listening on %s"
+                                  % socket_path)
+            os.unlink(socket_path)
+
+        # The socket gives access to the authenticated clients.
+        old_umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, socket_path,
+                                                   _CommandHandler)
+        finally:
+            os.umask(old_umask)
+
+    def serve(self):
+        logging.info("Serving commands on %s." % self.server_address)
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            os.unlink(self.server_address)
+            logging.info("Server stopped.")
+
+    def runCommand(self, argv, channel):
+        """Run one command line, with its I/O redirected to the channel."""
+
+        saved = (sys.stdout, sys.stderr, __builtin__.raw_input, getpass.getpass)
+
+        handler = logging.StreamHandler(ClientStream(channel, "err"))
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logging.getLogger().addHandler(handler)
+
+        sys.stdout = ClientStream(channel, "out")
+        sys.stderr = ClientStream(channel, "err")
+        __builtin__.raw_input = lambda prompt="": channel.prompt(prompt)
+        getpass.getpass = lambda prompt="Password: ", stream=None: \
+            channel.prompt(prompt, secret=True)
+
+        try:
+            return commands.runCommandLine(self._parser, self._session, argv)
+        finally:
+            logging.getLogger().removeHandler(handler)
+            (sys.stdout, sys.stderr,
+             __builtin__.raw_input, getpass.getpass) = saved
+
+
+def isServing(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error, e:
+        if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+            return False
+        raise
+    finally:
+        sock.close()
+    return True
+
+
+def sendCommand(socket_path, argv):
+    """Run a command line on the server and return its exit status."""
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error, e:
+        raise ServerError("Cannot reach the server on %s: %s"
+                          % (socket_path, e.strerror))
+
+    try:
+        channel = Channel(sock.makefile("rb"), sock.makefile("wb"))
+        channel.send(argv=argv)
+        while True:
+            message = channel.receive()
+            if message is None:
+                raise ServerError("The server closed the connection.")
+            if "data" in message:
+                stream = sys.stdout if message["stream"] == "out" else sys.stderr
+                stream.write(message["data"].encode("utf-8"))
+                stream.flush()
+            elif "prompt" in message:
+                if message["secret"]:
+                    answer = getpass.getpass(message["prompt"])
+                else:
+                    answer = raw_input(message["prompt"])
+                channel.send(answer=answer)
+            elif "status" in message:
+                return message["status"]
+    finally:
+        sock.close()
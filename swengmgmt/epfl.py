@@ -18,16 +18,23 @@
 """EPFL student directory."""
 
 
-import ldap
 import re
+import time
+
+from swengmgmt import profiling
 
 # TODO: Move this in a configuration
 LDAP_HOST = "ldap://ldap.epfl.ch"
 
+# How long the directory entries are kept in the state cache, in seconds.
+LDAP_CACHE_TTL = 24 * 3600
+
 
 class EPFLStudentData(object):
     """Encode basic EPFL student information."""
 
+    __slots__ = ("name", "email", "gaspar", "sciper")
+
     def __init__(self, name=None, email=None, gaspar=None, sciper=None):
         self.name = name
         self.email = email
@@ -63,8 +70,14 @@ class EPFL_LDAP(object):
     scope = 'o=epfl,c=ch'
     default_filter = ['displayName', 'mail', 'uid', 'uniqueIdentifier']
 
-    def __init__(self):
+    def __init__(self, cache=None):
+        # Imported here, so that loading the student data model does not
+        # require the LDAP bindings.
+        import ldap
+        self._ldap = ldap
         self.ldap_obj = ldap.initialize(LDAP_HOST)
+        # The entries found recently, by this run or a concurrent one.
+        self._cache = cache
 
     def pick_best_result(self, results):
         """
@@ -92,8 +105,29 @@ class EPFL_LDAP(object):
         else:
             raise StudentUndefinedError()
 
-        result = self.ldap_obj.search_s(self.scope, ldap.SCOPE_SUBTREE,
+        cached = self._cache and self._cache.get("ldap", query)
+        if cached and time.time() - cached["time"] < LDAP_CACHE_TTL:
+            entry = cached["entry"]
+        else:
+            entry = self._search(query)
+            if self._cache:
+                self._cache.put("ldap", query,
+                                {"time": time.time(), "entry": entry})
+
+        # Refresh the student description
+        student_data.name = entry["name"]
+        student_data.email = entry["email"]
+        student_data.gaspar = entry["gaspar"]
+        student_data.sciper = entry["sciper"]
+
+        return student_data
+
+    def _search(self, query):
+        start = time.time()
+        result = self.ldap_obj.search_s(self.scope, self._ldap.SCOPE_SUBTREE,
                                         query, self.default_filter)
+        profiling.record("ldap", "search", start, time.time() - start,
+                         len(repr(result)))
 
         if not result:
             raise StudentNotFoundError()
@@ -101,11 +135,7 @@ class EPFL_LDAP(object):
             result = self.pick_best_result(result)
 
         entry = result[0][1]
-
-        # Refresh the student description
-        student_data.name=entry['displayName'][0].decode("utf8")
-        student_data.email=entry['mail'][0].decode("utf8")
-        student_data.gaspar=entry['uid'][0].decode("utf8")
-        student_data.sciper=entry['uniqueIdentifier'][0].decode("utf8")
-
-        return student_data
+        return {"name": entry['displayName'][0].decode("utf8"),
+                "email": entry['mail'][0].decode("utf8"),
+                "gaspar": entry['uid'][0].decode("utf8"),
+                "sciper": entry['uniqueIdentifier'][0].decode("utf8")}
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Simultaneous permission changes, e.g., at the end of an exam.
+
+Everything that can be done ahead of time is: the Github teams are checked
+beforehand, and the worker threads open their connections to Github and keep
+them warm. When the flip is fired, the workers send their edits at once, and
+the completion time of each one is recorded.
+"""
+
+
+import logging
+import Queue
+import threading
+import time
+
+from swengmgmt import github
+from swengmgmt import metrics
+
+
+# The most concurrent requests Github tolerates, per its secondary limits.
+MAX_WORKERS = 100
+
+# Time to warm the connections before a scheduled flip, in seconds.
+WARM_AHEAD = 10
+
+# Interval between two warm-ups while waiting, in seconds. Requesting the
+# rate limit does not count against it.
+KEEPALIVE = 30
+
+
+class FlipResult(object):
+    __slots__ = ("entity", "start", "end", "error")
+
+    def __init__(self, entity):
+        self.entity = entity
+        self.start = None
+        self.end = None
+        self.error = None
+
+
+class PermissionFlip(object):
+    """Changes the team permission of many students or teams at once."""
+
+    def __init__(self, github_client, entities, permission, workers=20):
+        self._client = github_client
+        self._entities = entities
+        self._permission = permission
+        self._workers = max(1, min(workers, MAX_WORKERS))
+
+        self.results = []
+        self._queue = Queue.Queue()
+        self._go = threading.Event()
+        self._fired = threading.Event()
+        self._threads = []
+
+    def prepare(self):
+        """Check the entities, and return the problems that prevent the flip.
+
+        The entities that already have the permission are left out.
+        """
+
+        problems = []
+        for entity in self._entities:
+            if not entity.gh_team:
+                problems.append("%s does not have a Github team." % entity)
+            elif entity.gh_team.permission != self._permission:
+                self.results.append(FlipResult(entity))
+            else:
+                with metrics.entity():
+                    metrics.skip()
+
+        logging.info("%d teams to change to %s, %d already are."
+                     % (len(self.results), self._permission,
+                        len(self._entities) - len(self.results)
+                        - len(problems)))
+        return problems
+
+    def _warm(self):
+        # One concurrent request per worker, for the pool to keep as many
+        # connections open.
+        threads = [threading.Thread(target=github.rateLimitRemaining,
+                                    args=(self._client,))
+                   for _ in xrange(min(self._workers, len(self.results)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _keepWarm(self):
+        while not self._fired.wait(KEEPALIVE):
+            self._warm()
+
+    def _work(self):
+        self._go.wait()
+        while True:
+            try:
+                result = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            gh_team = result.entity.gh_team
+            result.start = time.time()
+            try:
+                with metrics.entity():
+                    if not gh_team.edit(gh_team.name, self._permission):
+                        result.error = "Team not found"
+            except Exception, e:
+                result.error = str(e)
+            result.end = time.time()
+
+    def arm(self):
+        """Open the connections and start the workers, waiting to fire."""
+
+        github.widenConnectionPool(self._client, self._workers)
+        self._warm()
+
+        for result in self.results:
+            self._queue.put(result)
+        self._threads = [threading.Thread(target=self._work)
+                         for _ in xrange(min(self._workers,
+                                             len(self.results)))]
+        keepalive = threading.Thread(target=self._keepWarm)
+        for thread in self._threads + [keepalive]:
+            # Not to keep the process alive if interrupted before firing.
+            thread.daemon = True
+            thread.start()
+
+    def abort(self):
+        """Release the armed workers without sending any edit."""
+
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                break
+        self._fired.set()
+        self._go.set()
+
+    def waitUntil(self, timestamp):
+        while True:
+            left = timestamp - time.time()
+            if left <= 0:
+                return
+            if left > 60:
+                logging.info("Waiting %d s until %s."
+                             % (left, time.strftime("%H:%M:%S",
+                                                    time.localtime(timestamp))))
+            time.sleep(min(left, 60))
+
+    def fire(self):
+        """Send all the edits and return the time they were sent."""
+
+        fired_at = time.time()
+        self._fired.set()
+        self._go.set()
+        for thread in self._threads:
+            thread.join()
+        return fired_at
+
+    def failed(self):
+        return [result for result in self.results if result.error]
+
+    def spread(self):
+        """Return the first and last completion times of the successful edits."""
+
+        ends = [result.end for result in self.results if not result.error]
+        return (min(ends), max(ends)) if ends else (None, None)
@@ -22,11 +22,21 @@ import getpass
 import github3
 import socket
 import logging
+import time
 
 
 class GithubAuthorizationError(Exception):
     pass
 
+
+class SearchLimitError(Exception):
+    """The search API did not return all the results."""
+    pass
+
+
+class TemplateError(Exception):
+    pass
+
 def two_factor_callback():
     try:
     # Python 2
@@ -40,12 +50,167 @@ def two_factor_callback():
         code = prompt("GitHub 2-Factor auth code: ")
     return code
 
+def repository(github_org, full_name):
+    """Fetch the full repository object named "owner/name"."""
+
+    url = github_org._build_url("repos", *full_name.split("/", 1))
+    json = github_org._json(github_org._get(url), 200)
+    return github3.repos.Repository(json, github_org) if json else None
+
+
+def iterJsonPages(github_obj, url, params=None):
+    """Yield the JSON pages of a paginated listing, without parsing them into
+    github3 objects."""
+
+    params = dict(params or {}, per_page=100)
+    while url:
+        response = github_obj._get(url, params=params)
+        page = github_obj._json(response, 200)
+        if page is None:
+            return
+        yield page
+        url = response.links.get("next", {}).get("url")
+        # The next URL carries the parameters.
+        params = None
+
+
+def iterJson(github_obj, url, params=None):
+    """Yield the JSON items of a paginated listing."""
+
+    for page in iterJsonPages(github_obj, url, params):
+        for item in page:
+            yield item
+
+
+def iterOrgTeams(github_org):
+    """Yield the teams of the organization, as JSON."""
+
+    return iterJson(github_org,
+                    github_org._build_url("orgs", github_org.login, "teams"))
+
+
+def iterTeamMembers(github_org, team_id):
+    """Yield the members of a team, as JSON, without fetching the team."""
+
+    return iterJson(github_org,
+                    github_org._build_url("teams", str(team_id), "members"))
+
+
+def iterOrgRepos(github_org):
+    """Yield the repositories of the organization, as JSON."""
+
+    return iterJson(github_org,
+                    github_org._build_url("orgs", github_org.login, "repos"),
+                    {"type": "all"})
+
+
+def searchOrgRepos(github_org, text):
+    """Yield the repositories of the organization with text in their name, as
+    JSON.
+
+    The search API matches words, not prefixes, so the results still need
+    filtering. Raises SearchLimitError once they are exhausted if some were
+    left out (the search API returns 1000 results at most).
+    """
+
+    query = "%s in:name org:%s fork:true" % (text, github_org.login)
+    count = total_count = 0
+    for page in iterJsonPages(github_org,
+                              github_org._build_url("search", "repositories"),
+                              {"q": query}):
+        total_count = page["total_count"]
+        for item in page["items"]:
+            count += 1
+            yield item
+    if count < total_count:
+        raise SearchLimitError("%d of %d results for '%s'"
+                               % (count, total_count, text))
+
+
+def iterRecentOrgRepos(github_org, seconds):
+    """Yield the repositories of the organization created in the last seconds,
+    as JSON.
+
+    They may not be in the search index yet.
+    """
+
+    url = github_org._build_url("orgs", github_org.login, "repos")
+    params = {"type": "all", "sort": "created", "direction": "desc"}
+    # The timestamps are in ISO 8601, in UTC, so they compare as strings.
+    since = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                          time.gmtime(time.time() - seconds))
+    for repo in iterJson(github_org, url, params):
+        if repo["created_at"] < since:
+            return
+        yield repo
+
+
+# Still required by some Github Enterprise versions for template repositories.
+TEMPLATE_MEDIA_TYPE = "application/vnd.github.baptiste-preview+json"
+
+
+def templateRepository(github_org, full_name):
+    """Return the JSON of the template repository named "owner/name".
+
+    Raises TemplateError if it does not exist or is not a template.
+    """
+
+    url = github_org._build_url("repos", *full_name.split("/", 1))
+    json = github_org._json(github_org._get(
+        url, headers={"Accept": TEMPLATE_MEDIA_TYPE}), 200)
+    if not json:
+        raise TemplateError("Repository %s not found" % full_name)
+    if not json.get("is_template"):
+        raise TemplateError("%s is not a template repository" % full_name)
+    return json
+
+
+def generateRepo(github_org, template, name, private=True,
+                 all_branches=False):
+    """Create a repository of the organization from a template repository.
+
+    The content is copied by Github, without going through this machine.
+    Returns the JSON of the new repository.
+    """
+
+    url = github_org._build_url("repos", *template.split("/", 1)) + "/generate"
+    data = {"owner": github_org.login, "name": name, "private": private,
+            "include_all_branches": all_branches}
+    json = github_org._json(github_org._post(
+        url, data, headers={"Accept": TEMPLATE_MEDIA_TYPE}), 201)
+    if not json:
+        raise TemplateError("Repository %s not found" % template)
+    return json
+
+
+def rateLimitRemaining(github_client):
+    """Return the number of core API requests left in the rate limit."""
+
+    # Not github_client.ratelimit_remaining, which ignores Github Enterprise.
+    url = github_client._build_url("rate_limit")
+    json = github_client._json(github_client._get(url), 200) or {}
+    return json.get("resources", {}).get("core", {}).get("remaining", 0)
+
+
+def widenConnectionPool(github_client, size):
+    """Keep up to size connections open, for as many concurrent requests."""
+
+    import requests.adapters
+
+    session = github_client._session
+    for adapter in session.adapters.itervalues():
+        # Not the adapters replaying a cassette.
+        if isinstance(adapter, requests.adapters.HTTPAdapter):
+            adapter.init_poolmanager(size, size)
+
+
 class GithubAuthProvider(object):
     SCOPES = [ "repo", "delete_repo" ]
 
-    def __init__(self, config, auth_config):
+    def __init__(self, config, auth_config, shard=None):
         self._config = config
         self._auth_config = auth_config
+        self._shard = shard
         self.token = None
 
     def authenticate(self, non_interactive=False):
@@ -65,6 +230,12 @@ class GithubAuthProvider(object):
 
         self.token = self._auth_config.setdefault("github", {}).get("token")
 
+        # Each shard of a bulk command uses a token of its own, if any.
+        shard_tokens = self._auth_config["github"].get("shard_tokens")
+        if self._shard and shard_tokens:
+            self.token = shard_tokens[self._shard[0] % len(shard_tokens)]
+            return
+
         if not self.token:
             if non_interactive:
                 raise GithubAuthorizationError("Interactive mode needed")
@@ -91,4 +262,6 @@ class GithubAuthProvider(object):
         self._auth_config["github"]["token"] = str(self.token)
 
     def getClient(self):
-        return github3.login(token=self.token)
+        # Github Enterprise, or a local stand-in such as the benchmark fake.
+        api_url = self._config["github_auth"].get("api_url")
+        return github3.login(token=self.token, url=api_url)
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Grading the exam repositories of the students with a script.
+
+The repository of each student is mirrored in a directory of clones, and
+the script is run in a worktree of its own, detached at the graded commit,
+as a session of its own, killed once its processes together used more CPU
+time than a limit, or after a wall-clock timeout. The results are cached by
+commit and script, so that the repositories unchanged since the last run, or
+still at the commit of the template, are not graded again: the script is
+expected to depend only on the commit. The runs stopped by a limit are not
+cached, as they may pass with higher ones.
+"""
+
+
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from swengmgmt import metrics
+from swengmgmt import profiling
+
+
+FIELDS = [
+    ("gaspar", "Gaspar"),
+    ("commit", "Commit"),
+    ("status", "Status"),
+    ("exit-code", "Exit Code"),
+    ("result", "Result"),
+    ("seconds", "Time (s)"),
+    ("cpu-seconds", "CPU (s)"),
+    ("cached", "Cached"),
+    ("log", "Log"),
+]
+
+# The section of the cache holding the results, by "<commit>:<script>".
+CACHE_SECTION = "grades"
+
+# The status of the runs stopped by each limit, never cached.
+LIMIT_STATUSES = {"cpu": "cpu-limit", "timeout": "timeout"}
+
+# How often the CPU time of a running script is measured, in seconds.
+POLL_INTERVAL = 0.5
+
+
+class GradingError(Exception):
+    pass
+
+
+def scriptDigest(path):
+    """Return the SHA-1 of the content of the script."""
+
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _git(args, git_dir=None):
+    command = ["git"] + (["--git-dir", git_dir] if git_dir else []) + args
+    with profiling.span("git", args[0]):
+        process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+        out = process.communicate()[0]
+    if process.returncode:
+        raise GradingError("'%s' failed: %s" % (" ".join(command),
+                                                out.strip()))
+    return out.strip()
+
+
+def _lastLine(path):
+    with open(path, "rb") as f:
+        lines = [line.strip() for line in f.read()[-4096:].splitlines()]
+    lines = [line for line in lines if line]
+    return lines[-1].decode("utf-8", "replace") if lines else u""
+
+
+def _session(sid):
+    """Return the processes of the session, and the CPU time used by each of
+    them and by the children it reaped, or none without /proc."""
+
+    processes = {}
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return processes
+    for pid in pids:
+        try:
+            with open("/proc/%s/stat" % pid) as f:
+                stat = f.read()
+        except IOError:
+            continue
+        # After the command name, the fields from the state on: session is
+        # the 4th, and utime, stime, cutime and cstime the 12th to 15th.
+        fields = stat[stat.rindex(")") + 2:].split()
+        if int(fields[3]) == sid:
+            processes[int(pid)] = (sum(int(field) for field in fields[11:15])
+                                   / float(os.sysconf("SC_CLK_TCK")))
+    return processes
+
+
+def _kill(sid, pids=()):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except OSError:
+            pass
+    try:
+        os.killpg(sid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def runScript(script, cwd, log_path, cpu_seconds, timeout, env=None):
+    """Run the script in cwd, its output to log_path, and return its exit
+    code, the CPU time it used, and the limit which stopped it, "cpu" or
+    "timeout", if any.
+
+    All of its processes together get cpu_seconds of CPU time, and are
+    killed after timeout seconds.
+    """
+
+    # setsid puts it in a session of its own, to be measured and killed with
+    # its children, even those in process groups of their own.
+    command = ["setsid", script]
+    limit = []
+    used = [0.0]
+    done = threading.Event()
+
+    def monitor(sid):
+        deadline = time.time() + timeout
+        while not done.wait(POLL_INTERVAL):
+            processes = _session(sid)
+            # The CPU time of orphans, reaped out of the session, is lost.
+            used[0] = max(used[0], sum(processes.itervalues()))
+            if used[0] > cpu_seconds:
+                limit.append("cpu")
+            elif time.time() > deadline:
+                limit.append("timeout")
+            if limit:
+                _kill(sid, processes)
+                return
+
+    with open(log_path, "wb") as log, open(os.devnull, "rb") as devnull:
+        process = subprocess.Popen(command, cwd=cwd, env=env, stdin=devnull,
+                                   stdout=log, stderr=subprocess.STDOUT,
+                                   close_fds=True)
+        thread = threading.Thread(target=monitor, args=(process.pid,))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                try:
+                    status, usage = os.wait4(process.pid, 0)[1:]
+                    break
+                except OSError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+        finally:
+            done.set()
+            thread.join()
+            # What it left behind.
+            _kill(process.pid, _session(process.pid))
+
+    # The script and the children it reaped, if /proc missed some.
+    used = max(used[0], usage.ru_utime + usage.ru_stime)
+    if not limit and used > cpu_seconds:
+        limit.append("cpu")
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
+    return process.returncode, used, limit[0] if limit else None
+
+
+class Grader(object):
+    """Grades students with a script, one at a time per thread.
+
+    The mirror of the repository of each student is clone_dir/<gaspar>.git,
+    cloned or fetched before grading unless fetch is False. The output of
+    each run is kept in log_dir.
+    """
+
+    def __init__(self, script, clone_dir, log_dir, cache, cpu_seconds=600,
+                 timeout=900, ref="HEAD", fetch=True):
+        self.script = os.path.abspath(script)
+        self.digest = scriptDigest(script)
+        self.clone_dir = clone_dir
+        self.log_dir = log_dir
+        self.cache = cache
+        self.cpu_seconds = cpu_seconds
+        self.timeout = timeout
+        self.ref = ref
+        self.fetch = fetch
+
+        self.results = {}
+        self._lock = threading.Lock()
+        # Students at the same commit wait for the first one to be graded.
+        self._key_locks = {}
+        # The results not cached, of the runs stopped by a limit.
+        self._limited = {}
+        for directory in (clone_dir, log_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    def _mirror(self, student):
+        """Return the mirror of the repository of the student, or None if
+        they have none."""
+
+        path = os.path.join(self.clone_dir, "%s.git" % student.gaspar)
+        if not self.fetch:
+            return path if os.path.isdir(path) else None
+        if not student.gh_repo:
+            return None
+        if os.path.isdir(path):
+            _git(["fetch", "--prune", "origin"], path)
+        else:
+            _git(["clone", "--mirror", "--quiet", student.repo_ssh_url, path])
+        return path
+
+    def _run(self, student, mirror, commit):
+        # After the cache key, for the cached results to keep their log.
+        log_path = os.path.join(self.log_dir, "%s-%s.log"
+                                % (commit, self.digest[:12]))
+        worktree = tempfile.mkdtemp(prefix="grade-%s-" % student.gaspar)
+        try:
+            _git(["worktree", "add", "--detach", worktree, commit], mirror)
+            env = dict(os.environ, SWENG_COMMIT=commit)
+            start = time.time()
+            returncode, cpu, limit = runScript(self.script, worktree,
+                                               log_path, self.cpu_seconds,
+                                               self.timeout, env)
+            duration = time.time() - start
+        finally:
+            shutil.rmtree(worktree, ignore_errors=True)
+            _git(["worktree", "prune"], mirror)
+
+        if limit:
+            status = LIMIT_STATUSES[limit]
+        elif returncode == 0:
+            status = "passed"
+        else:
+            status = "failed"
+        return {"status": status, "exit-code": returncode,
+                "result": _lastLine(log_path), "seconds": "%.3f" % duration,
+                "cpu-seconds": "%.3f" % cpu, "log": log_path}
+
+    def _record(self, student, result):
+        result["gaspar"] = student.gaspar
+        with self._lock:
+            self.results[student.gaspar] = result
+
+    def grade(self, student):
+        """Grade the student, unless their commit was already graded with
+        the script, and return False on an error before the script ran."""
+
+        try:
+            mirror = self._mirror(student)
+            if not mirror:
+                metrics.skip()
+                self._record(student, {"status": "no-repo"})
+                return True
+            commit = _git(["rev-parse", "--verify",
+                           "%s^{commit}" % self.ref], mirror)
+
+            key = "%s:%s" % (commit, self.digest)
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                result = (self._limited.get(key) or
+                          self.cache.get(CACHE_SECTION, key))
+                if result:
+                    metrics.skip()
+                    result = dict(result, cached="yes")
+                else:
+                    result = self._run(student, mirror, commit)
+                    if result["status"] in LIMIT_STATUSES.values():
+                        self._limited[key] = dict(result)
+                    else:
+                        self.cache.put(CACHE_SECTION, key, dict(result))
+                        self.cache.flush()
+                    logging.info("Graded %s at %s: %s." % (
+                        student.gaspar, commit[:12], result["status"]))
+        except GradingError, e:
+            logging.error(str(e))
+            self._record(student, {"status": "error", "result": str(e)})
+            return False
+
+        result["commit"] = commit
+        self._record(student, result)
+        return True
+
+    def counts(self):
+        counts = {}
+        for result in self.results.itervalues():
+            counts[result["status"]] = counts.get(result["status"], 0) + 1
+        return counts
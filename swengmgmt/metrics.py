@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run statistics, exported in the Prometheus text format.
+
+The file is meant for the textfile collector of the node exporter, so it is
+written atomically: to a temporary file in the same directory, renamed over
+the previous one.
+
+The time of a run is split in phases (loading the configuration,
+authenticating, loading the roster and listing the Github data), and the
+rest is accounted to the command itself, including the Github listing
+streamed by the list commands. Nested phases are not counted in their
+parent. The entities handled by the commands are counted as
+processed, skipped or failed.
+"""
+
+
+import contextlib
+import os
+import tempfile
+import threading
+import time
+
+
+PHASES = ["config", "auth", "roster", "github"]
+RESULTS = ["processed", "skipped", "failed"]
+
+
+class RunMetrics(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.start = time.time()
+        self.phases = dict((phase, 0.0) for phase in PHASES)
+        self.entities = dict((result, 0) for result in RESULTS)
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Each stack frame is [name, start, time spent in nested phases].
+        stack = self._stack()
+        frame = [name, time.time(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            stack.pop()
+            duration = time.time() - frame[1]
+            if stack:
+                stack[-1][2] += duration
+            with self._lock:
+                self.phases[name] += duration - frame[2]
+
+    def count(self, result):
+        with self._lock:
+            self.entities[result] += 1
+
+    def write(self, path, command, success, profiler=None):
+        duration = time.time() - self.start
+        labels = {"command": command}
+
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for extra, value in samples:
+                all_labels = dict(labels, **extra)
+                lines.append("%s{%s} %s" % (name, ",".join(
+                    '%s="%s"' % (key, _escape(all_labels[key]))
+                    for key in sorted(all_labels)), _number(value)))
+
+        metric("sweng_run_timestamp_seconds", "gauge",
+               "When the run started, in seconds since the epoch.",
+               [({}, self.start)])
+        metric("sweng_run_duration_seconds", "gauge",
+               "Duration of the run.", [({}, duration)])
+        metric("sweng_run_success", "gauge",
+               "Whether the run succeeded.", [({}, 1 if success else 0)])
+
+        phases = dict(self.phases)
+        phases["command"] = max(duration - sum(phases.values()), 0.0)
+        metric("sweng_phase_duration_seconds", "gauge",
+               "Duration of each phase of the run.",
+               [({"phase": phase}, phases[phase])
+                for phase in PHASES + ["command"]])
+
+        metric("sweng_entities", "gauge",
+               "Students and teams handled by the command, by result.",
+               [({"result": result}, self.entities[result])
+                for result in RESULTS])
+
+        if profiler:
+            calls, errors, seconds = {}, {}, {}
+            for (backend, _), stats in profiler.stats.iteritems():
+                calls[backend] = calls.get(backend, 0) + stats.calls
+                errors[backend] = errors.get(backend, 0) + stats.errors
+                seconds[backend] = seconds.get(backend, 0.0) + stats.total
+            metric("sweng_api_calls", "gauge",
+                   "Calls made to each backend.",
+                   [({"backend": b}, calls[b]) for b in sorted(calls)])
+            metric("sweng_api_errors", "gauge",
+                   "Failed calls to each backend.",
+                   [({"backend": b}, errors[b]) for b in sorted(errors)])
+            metric("sweng_api_duration_seconds", "gauge",
+                   "Time spent waiting for each backend.",
+                   [({"backend": b}, seconds[b]) for b in sorted(seconds)])
+
+            rate_limits = sorted(profiler.rate_limits.iteritems())
+            if rate_limits:
+                metric("sweng_rate_limit_remaining", "gauge",
+                       "Requests left in the rate limit at the end of the run.",
+                       [({"resource": resource}, last)
+                        for resource, (_, last, _) in rate_limits])
+                metric("sweng_rate_limit_limit", "gauge",
+                       "Requests allowed in each rate limit window.",
+                       [({"resource": resource}, limit)
+                        for resource, (_, _, limit) in rate_limits])
+                metric("sweng_rate_limit_used", "gauge",
+                       "Requests of the rate limit used by the run.",
+                       [({"resource": resource}, max(first - last, 0))
+                        for resource, (first, last, _) in rate_limits])
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".sweng-metrics-",
+                                        dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+def _escape(value):
+    return (unicode(value).encode("utf-8").replace("\\", "\\\\")
+            .replace("\n", "\\n").replace('"', '\\"'))
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+_metrics = None
+_local = threading.local()
+
+
+def start():
+    global _metrics
+    _metrics = RunMetrics()
+    return _metrics
+
+
+def active():
+    return _metrics
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Account the time spent in the block to the given phase."""
+
+    if not _metrics:
+        yield
+        return
+    with _metrics.phase(name):
+        yield
+
+
+@contextlib.contextmanager
+def entity():
+    """Count the student or team handled in the block by its result."""
+
+    _local.skipped = False
+    try:
+        yield
+    except Exception:
+        if _metrics:
+            _metrics.count("failed")
+        raise
+    if _metrics:
+        _metrics.count("skipped" if _local.skipped else "processed")
+
+
+def skip():
+    """Mark the entity handled by the current thread as skipped."""
+
+    _local.skipped = True
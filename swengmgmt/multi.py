@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Running one command line across the configurations of several classes.
+
+Each configuration (a course, or the organization of a past year) is run by
+a process of its own, concurrently, with the same command line. The tokens
+are obtained once, before the processes start, and shared through the
+authentication file. Each process keeps its own rate limiter, and takes an
+equal share of the Github rate limit of the token with the others on the
+same Github instance. Its files (reports, metrics, traces, cassettes) are
+named after its organization.
+
+The logs are printed as they come, prefixed by the organization. The
+outputs are merged at the end: the records of the JSON, JSON lines and CSV
+formats get an "organization" field, and the other outputs are printed one
+after the other, under the name of their organization.
+"""
+
+
+import csv
+import json
+import logging
+import os
+import StringIO
+import subprocess
+import sys
+import threading
+import time
+
+
+# The options naming a file, one for each configuration.
+PATH_OPTIONS = ["--metrics", "--profile-trace", "--record", "--replay",
+                "--report"]
+
+
+def _loadConfig(path):
+    import yaml
+
+    with open(path, "r") as f:
+        return yaml.load(f) or {}
+
+
+def configLabels(config_paths, configs):
+    """Return the organization of each configuration, made unique."""
+
+    labels = []
+    for path, config in zip(config_paths, configs):
+        label = ((config.get("organization") or {}).get("name") or
+                 os.path.splitext(os.path.basename(path))[0])
+        if label in labels:
+            label = "%s-%d" % (label, len(labels) + 1)
+        labels.append(label)
+    return labels
+
+
+def rateLimitShares(configs):
+    """Return the number of configurations sharing the Github rate limit of
+    each one, i.e., on the same Github instance."""
+
+    instances = [(config.get("github_auth") or {}).get("api_url")
+                 for config in configs]
+    return [instances.count(instance) for instance in instances]
+
+
+def perConfigPath(path, label):
+    """Return the path of the file of one configuration, given the common
+    one, e.g., report-sweng-2019.json for report.json."""
+
+    root, ext = os.path.splitext(path)
+    return "%s-%s%s" % (root, label, ext)
+
+
+def rewriteArgv(argv, label, drop=()):
+    """Return the command line of one child run, given the common one.
+
+    The options in drop are left out with their values, and the files of
+    PATH_OPTIONS are named after label.
+    """
+
+    result = []
+    skip = False
+    rewrite = False
+    for token in argv:
+        option = token.split("=", 1)[0]
+        if skip:
+            skip = False
+        elif rewrite:
+            result.append(perConfigPath(token, label))
+            rewrite = False
+        elif token in drop:
+            skip = True
+        elif option in drop or any(
+                len(flag) == 2 and token.startswith(flag) and
+                not token.startswith("--") for flag in drop):
+            # --option=value, or -oVALUE.
+            pass
+        elif token in PATH_OPTIONS:
+            result.append(token)
+            rewrite = True
+        elif option in PATH_OPTIONS:
+            result.append("%s=%s" % (option, perConfigPath(
+                token.split("=", 1)[1], label)))
+        else:
+            result.append(token)
+    return result
+
+
+def childArgv(argv, config_path, label, share, confirmed=False):
+    """Return the command line of one configuration, given the common one."""
+
+    result = ["-c", config_path, "-n", "--rate-limit-share", str(share)]
+    if confirmed:
+        result.append("--yes")
+    return result + rewriteArgv(argv, label,
+                                ("-c", "--config", "--config-jobs"))
+
+
+def authenticate(config_paths, auth_path, non_interactive):
+    """Obtain the tokens of every configuration, one after the other, so
+    that each one is asked for only once and shared by the processes."""
+
+    from swengmgmt import session
+
+    for path in config_paths:
+        config_session = session.Session(path, auth_path, non_interactive)
+        config = config_session.loadConfig()
+        config_session.githubClient()
+        if (config.get("roster") or {}).get("backend", "sheets") == "sheets":
+            config_session.googleClient()
+        config_session.save()
+
+
+class ChildRun(object):
+    """The run of a command line in a child process."""
+
+    def __init__(self, label, argv):
+        self.label = label
+        self.argv = argv
+        self.output = ""
+        self.status = None
+        self.duration = 0.0
+
+    def _relayLogs(self, stream, lock):
+        for line in iter(stream.readline, ""):
+            with lock:
+                sys.stderr.write("[%s] %s" % (self.label, line))
+                sys.stderr.flush()
+
+    def run(self, program, lock):
+        start = time.time()
+        # Nothing to read: the prompts would be mixed up.
+        with open(os.devnull, "r") as devnull:
+            process = subprocess.Popen([sys.executable, program] + self.argv,
+                                       stdin=devnull,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE)
+        relay = threading.Thread(target=self._relayLogs,
+                                 args=(process.stderr, lock))
+        relay.daemon = True
+        relay.start()
+        self.output = process.stdout.read()
+        self.status = process.wait()
+        relay.join()
+        self.duration = time.time() - start
+
+
+def runAll(runs, program, jobs):
+    """Run up to jobs child runs at a time, and return the highest exit
+    status."""
+
+    lock = threading.Lock()
+    slots = threading.Semaphore(max(jobs, 1))
+
+    def run(child_run):
+        with slots:
+            child_run.run(program, lock)
+
+    threads = [threading.Thread(target=run, args=(child_run,))
+               for child_run in runs]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    # Join with a timeout, so that Ctrl-C reaches the main thread.
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+
+    for child_run in runs:
+        logging.info("%s: %s in %.3f s." % (
+            child_run.label,
+            "done" if child_run.status == 0
+            else "failed (status %d)" % child_run.status,
+            child_run.duration))
+    # Killed by a signal, the status is negative.
+    return max(child_run.status if child_run.status >= 0 else 1
+               for child_run in runs)
+
+
+def _mergeJsonLines(label, text, stream):
+    for line in text.splitlines():
+        if line.strip():
+            record = json.loads(line)
+            record["organization"] = label
+            stream.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+def _mergeCsv(label, text, stream, header):
+    rows = list(csv.reader(StringIO.StringIO(text)))
+    if not rows:
+        return
+    writer = csv.writer(stream)
+    if not header:
+        writer.writerow(["organization"] + rows[0])
+        header.append(rows[0])
+    for row in rows[1:]:
+        writer.writerow([label] + row)
+
+
+def _printSection(config_run, stream):
+    if config_run.output:
+        stream.write("== %s ==\n%s\n" % (config_run.label,
+                                          config_run.output.rstrip()))
+
+
+def mergeOutputs(format, runs, stream=None):
+    """Print the outputs of the runs, merged for the record formats.
+
+    The outputs that cannot be merged, e.g., of a failed run, are printed
+    after the others.
+    """
+
+    stream = stream or sys.stdout
+    unmerged = []
+    if format == "json":
+        records = []
+        for config_run in runs:
+            try:
+                run_records = json.loads(config_run.output or "[]")
+            except ValueError:
+                unmerged.append(config_run)
+                continue
+            for record in run_records:
+                record["organization"] = config_run.label
+                records.append(record)
+        stream.write("[%s\n]\n" % ",".join(
+            "\n" + json.dumps(record, sort_keys=True) for record in records))
+    elif format == "jsonl":
+        for config_run in runs:
+            merged = StringIO.StringIO()
+            try:
+                _mergeJsonLines(config_run.label, config_run.output, merged)
+            except ValueError:
+                unmerged.append(config_run)
+                continue
+            stream.write(merged.getvalue())
+    elif format == "csv":
+        header = []
+        for config_run in runs:
+            _mergeCsv(config_run.label, config_run.output, stream, header)
+    else:
+        unmerged = runs
+
+    for config_run in unmerged:
+        _printSection(config_run, stream)
+    stream.flush()
+
+
+def run(args, argv, config_paths, program):
+    """Run the command line of the program across the configurations, and
+    return the highest exit status."""
+
+    configs = [_loadConfig(path) for path in config_paths]
+    labels = configLabels(config_paths, configs)
+
+    if not args.replay:
+        authenticate(config_paths, args.auth, args.non_interactive)
+
+    # Confirmed once for all the classes.
+    confirmed = False
+    if getattr(args.command, "class_operation", False) and not (
+            getattr(args, "students", None) or getattr(args, "teams", None)):
+        if not args.command.confirmClassOperation(args):
+            return 0
+        confirmed = True
+
+    default_report = None
+    if hasattr(args, "report") and not args.report:
+        default_report = "%s-report.json" % args.command.arg_name
+        argv = argv + ["--report", default_report]
+
+    runs = [ChildRun(label, childArgv(argv, path, label, share, confirmed))
+            for path, label, share in zip(config_paths, labels,
+                                          rateLimitShares(configs))]
+    status = runAll(runs, program, args.config_jobs or len(runs))
+    mergeOutputs(getattr(args, "format", None) or
+                 getattr(args, "flip_format", None), runs)
+
+    # As in a single run, the default reports go once everything is done.
+    if default_report:
+        _removeCompleteReports(args, [
+            perConfigPath(default_report, config_run.label)
+            for config_run in runs if config_run.status == 0])
+    return status
+
+
+def _removeCompleteReports(args, paths):
+    from swengmgmt import bulk
+
+    for path in paths:
+        try:
+            report = bulk.BulkReport(path, args.command.reportOperation(args))
+        except bulk.ReportError:
+            continue
+        if report.complete() and report.remove():
+            logging.info("All done; removed %s." % path)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record output in tabular and machine-readable formats.
+
+Except for the plain tabular format, which needs all the records to size its
+columns, the writers print each record as soon as it is written.
+"""
+
+
+import csv
+import json
+import sys
+
+
+def _utf8(value):
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return str(value)
+
+
+class RecordWriter(object):
+    """Writes records (dicts) with the given fields, a list of (key, title)."""
+
+    def __init__(self, fields, stream=None):
+        self._fields = fields
+        self._stream = stream or sys.stdout
+
+    def begin(self):
+        pass
+
+    def write(self, record):
+        raise NotImplementedError()
+
+    def end(self):
+        pass
+
+    def _flush(self):
+        self._stream.flush()
+
+
+class JsonWriter(RecordWriter):
+    """A JSON array, with one record per line."""
+
+    def begin(self):
+        self._first = True
+        self._stream.write("[")
+
+    def write(self, record):
+        self._stream.write("\n" if self._first else ",\n")
+        self._first = False
+        json.dump(dict((key, record.get(key)) for key, _ in self._fields),
+                  self._stream, sort_keys=True)
+        self._flush()
+
+    def end(self):
+        self._stream.write("\n]\n")
+
+
+class JsonLinesWriter(RecordWriter):
+    """One JSON object per line."""
+
+    def write(self, record):
+        json.dump(dict((key, record.get(key)) for key, _ in self._fields),
+                  self._stream, sort_keys=True)
+        self._stream.write("\n")
+        self._flush()
+
+
+class CsvWriter(RecordWriter):
+    """CSV with a header row, in UTF-8."""
+
+    def begin(self):
+        self._writer = csv.writer(self._stream)
+        self._writer.writerow([key for key, _ in self._fields])
+
+    def write(self, record):
+        self._writer.writerow([_utf8(record.get(key))
+                               for key, _ in self._fields])
+        self._flush()
+
+
+class TabularWriter(RecordWriter):
+    """Aligned columns. The records are printed at the end."""
+
+    def begin(self):
+        self._records = []
+
+    def write(self, record):
+        self._records.append(record)
+
+    def _widths(self):
+        widths = {}
+        for key, title in self._fields:
+            widths[key] = max([len(title)] +
+                              [len(record.get(key) or "N/A")
+                               for record in self._records])
+        return widths
+
+    def _printHeader(self, widths):
+        for key, title in self._fields:
+            print >>self._stream, " %s" % title[:widths[key]].ljust(widths[key]),
+        print >>self._stream
+        for key, title in self._fields:
+            print >>self._stream, " %s" % ("=" * widths[key]),
+        print >>self._stream
+
+    def _printRow(self, record, widths):
+        for key, _ in self._fields:
+            value = (record.get(key) or "N/A")[:widths[key]]
+            print >>self._stream, " %s" % _utf8(value.ljust(widths[key])),
+        print >>self._stream
+
+    def end(self):
+        widths = self._widths()
+        self._printHeader(widths)
+        for record in self._records:
+            self._printRow(record, widths)
+
+
+class FixedWidthWriter(TabularWriter):
+    """Columns of at most the given width, printed as they come."""
+
+    def __init__(self, fields, width, stream=None):
+        super(FixedWidthWriter, self).__init__(fields, stream)
+        self._fixed_widths = dict((key, max(width, 1)) for key, _ in fields)
+
+    def begin(self):
+        self._printHeader(self._fixed_widths)
+
+    def write(self, record):
+        self._printRow(record, self._fixed_widths)
+        self._flush()
+
+    def end(self):
+        pass
+
+
+FORMATS = {
+    "json": JsonWriter,
+    "jsonl": JsonLinesWriter,
+    "csv": CsvWriter,
+    "tabular": TabularWriter,
+}
+
+
+def createWriter(format, fields, width=None, stream=None):
+    if format == "tabular" and width:
+        return FixedWidthWriter(fields, width, stream)
+    return FORMATS[format](fields, stream)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Accounting of the calls made to each backend.
+
+The profiler is process-wide and off by default. Once started, it records
+the calls to Google Sheets and Github made through instrumented clients,
+and the spans explicitly marked in the code (LDAP searches, git commands).
+"""
+
+
+import contextlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import urlparse
+
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+class EndpointStats(object):
+    """Call count, transferred bytes and latency of one endpoint."""
+
+    __slots__ = ("calls", "errors", "bytes", "total", "max", "histogram")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def add(self, duration, size, error):
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.bytes += size
+        self.total += duration
+        self.max = max(self.max, duration)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+
+class Profiler(object):
+    def __init__(self, trace=False):
+        self._lock = threading.Lock()
+        self.start = time.time()
+        self.stats = {}
+        # Backend -> [remaining at first call, last remaining, limit]
+        self.rate_limits = {}
+        self.events = [] if trace else None
+
+    def record(self, backend, endpoint, start, duration, size=0, error=False):
+        with self._lock:
+            self.stats.setdefault((backend, endpoint),
+                                  EndpointStats()).add(duration, size, error)
+            if self.events is not None:
+                self.events.append({
+                    "name": endpoint,
+                    "cat": backend,
+                    "ph": "X",
+                    "ts": int((start - self.start) * 1e6),
+                    "dur": int(duration * 1e6),
+                    "pid": os.getpid(),
+                    "tid": threading.current_thread().ident,
+                    "args": {"bytes": size, "error": error},
+                })
+
+    def recordRateLimit(self, backend, remaining, limit):
+        with self._lock:
+            entry = self.rate_limits.setdefault(backend,
+                                                [remaining, remaining, limit])
+            entry[1] = remaining
+            entry[2] = limit
+
+    def printSummary(self, stream=None):
+        stream = stream or sys.stderr
+        elapsed = time.time() - self.start
+
+        print >>stream
+        print >>stream, "Profile (%.3f s in total):" % elapsed
+        print >>stream, " %-8s %-40s %6s %6s %10s %9s %9s %9s" % (
+            "Backend", "Endpoint", "Calls", "Errors", "Bytes", "Total (s)",
+            "Mean (ms)", "Max (ms)")
+        for (backend, endpoint), stats in sorted(self.stats.iteritems()):
+            print >>stream, " %-8s %-40s %6d %6d %10d %9.3f %9.1f %9.1f" % (
+                backend, endpoint, stats.calls, stats.errors, stats.bytes,
+                stats.total, 1000 * stats.total / stats.calls,
+                1000 * stats.max)
+
+        print >>stream
+        print >>stream, "Latency histograms (number of calls per bucket, ms):"
+        print >>stream, " %-49s %s" % ("", " ".join(
+            "%6s" % ("<=%d" % (1000 * bound)) for bound in LATENCY_BUCKETS) +
+            " %6s" % (">%d" % (1000 * LATENCY_BUCKETS[-1])))
+        for (backend, endpoint), stats in sorted(self.stats.iteritems()):
+            print >>stream, " %-8s %-40s %s" % (backend, endpoint, " ".join(
+                "%6d" % count for count in stats.histogram))
+
+        if self.rate_limits:
+            print >>stream
+            print >>stream, "Rate limits:"
+            for backend, (first, last, limit) in sorted(
+                    self.rate_limits.iteritems()):
+                print >>stream, " %-15s %d of %d remaining, %d used" % (
+                    backend, last, limit, max(first - last, 0))
+
+    def writeTrace(self, path):
+        """Write the calls in the Chrome trace event format."""
+
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events or [],
+                       "displayTimeUnit": "ms"}, f)
+
+
+_profiler = None
+
+
+def start(trace=False):
+    global _profiler
+    _profiler = Profiler(trace=trace)
+    return _profiler
+
+
+def active():
+    return _profiler
+
+
+def record(backend, endpoint, start, duration, size=0, error=False):
+    if _profiler:
+        _profiler.record(backend, endpoint, start, duration, size, error)
+
+
+@contextlib.contextmanager
+def span(backend, endpoint):
+    """Record the code in the block as one call to the backend."""
+
+    if not _profiler:
+        yield
+        return
+
+    start = time.time()
+    error = True
+    try:
+        yield
+        error = False
+    finally:
+        _profiler.record(backend, endpoint, start, time.time() - start,
+                         error=error)
+
+
+# Path segments followed by a name, replaced by a placeholder.
+_NAMED_SEGMENTS = {
+    "orgs": [":org"],
+    "users": [":user"],
+    "members": [":user"],
+    "memberships": [":user"],
+    "repos": [":owner", ":repo"],
+}
+
+
+def githubEndpoint(method, url):
+    """Name the endpoint of a Github API URL, e.g. "GET /teams/:id"."""
+
+    segments = urlparse.urlparse(url).path.strip("/").split("/")
+    if segments[:2] == ["api", "v3"]:
+        segments = segments[2:]
+
+    result = []
+    placeholders = []
+    for segment in segments:
+        if placeholders:
+            result.append(placeholders.pop(0))
+        elif segment.isdigit():
+            result.append(":id")
+        else:
+            result.append(segment)
+            placeholders = list(_NAMED_SEGMENTS.get(segment, []))
+    return "%s /%s" % (method, "/".join(result))
+
+
+def instrumentGithub(client, backend="github"):
+    """Record the requests made through a github3 client."""
+
+    session = getattr(client, "_session", None) or client.session
+
+    def onResponse(response, *args, **kwargs):
+        if not _profiler:
+            return
+        read_start = time.time()
+        size = len(response.content or "")
+        duration = response.elapsed.total_seconds() + time.time() - read_start
+        request = response.request
+        _profiler.record(backend, githubEndpoint(request.method, request.url),
+                         time.time() - duration, duration, size,
+                         error=response.status_code >= 400)
+
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        limit = response.headers.get("X-RateLimit-Limit")
+        if remaining is not None and limit is not None:
+            path = urlparse.urlparse(request.url).path
+            resource = "search" if "/search/" in path else "core"
+            _profiler.recordRateLimit("%s/%s" % (backend, resource),
+                                      int(remaining), int(limit))
+
+    session.hooks.setdefault("response", []).append(onResponse)
+
+
+_GDATA_FEED_RE = re.compile(r"/feeds/([^/]+)")
+
+
+def instrumentGData(client, backend="sheets"):
+    """Record the requests made through a gdata client."""
+
+    http_client = client.http_client
+    request = http_client.request
+
+    def instrumented(http_request, *args, **kwargs):
+        if not _profiler:
+            return request(http_request, *args, **kwargs)
+
+        match = _GDATA_FEED_RE.search(http_request.uri.path or "")
+        endpoint = "%s %s" % (http_request.method,
+                              "/feeds/%s" % match.group(1) if match
+                              else http_request.uri.path)
+        start = time.time()
+        try:
+            response = request(http_request, *args, **kwargs)
+            # Read the body here, to account for its size and transfer time.
+            body = response.read()
+        except Exception:
+            _profiler.record(backend, endpoint, start, time.time() - start,
+                             error=True)
+            raise
+        response.read = lambda *args: body
+        _profiler.record(backend, endpoint, start, time.time() - start,
+                         len(body), error=response.status >= 400)
+        return response
+
+    http_client.request = instrumented
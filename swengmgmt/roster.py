@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Rosters kept in local files, instead of the Google spreadsheet.
+
+The students and the teams are read from CSV files or from the tables of a
+SQLite database, with the same columns as the worksheets. As in the list feed
+of a spreadsheet, the column names are matched in lowercase and without
+spaces, so that the worksheets exported as CSV can be used as is.
+"""
+
+
+import csv
+import logging
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+
+from swengmgmt import epfl
+from swengmgmt import metrics
+from swengmgmt import profiling
+
+
+BACKENDS = ["sheets", "csv", "sqlite"]
+
+
+class RosterError(Exception):
+    pass
+
+
+def columnKey(header):
+    """Return the key of a column, given its header, as the list feed of
+    Sheets makes it, so that every backend has the same fields."""
+
+    return re.sub(r"[^\w.-]|_", "", header.lower(), flags=re.UNICODE)
+
+
+# The keys of the columns read or written by the tool. The other columns,
+# e.g., of notes, are kept as they are.
+KEYS = ["name", "e-mail", "gaspar", "sciper", "team", "githubid", "githubslug"]
+
+
+def _text(value):
+    if value is None:
+        return u""
+    if isinstance(value, str):
+        value = value.decode("utf-8")
+    return unicode(value).strip()
+
+
+def _checkKeys(keys, path):
+    for key in KEYS:
+        if keys.count(key) > 1:
+            raise RosterError("Several '%s' columns in %s" % (key, path))
+
+
+class Row(dict):
+    """A row of a table, by column key, which keeps the values read, by
+    column, to write back those not changed as they were."""
+
+    def __init__(self, keys, values):
+        super(Row, self).__init__()
+        # The first of several columns with the same key, e.g., blank.
+        for key, value in reversed(zip(keys, values)):
+            self[key] = _text(value)
+        self.values = list(values)
+
+    def changes(self, keys):
+        """Return the columns whose values changed since read, by index."""
+
+        first = {}
+        for index, key in enumerate(keys):
+            first.setdefault(key, index)
+        changes = {}
+        for key, index in first.iteritems():
+            value = _text(self.values[index] if index < len(self.values)
+                          else None)
+            if key in self and self[key] != value:
+                changes[index] = self[key]
+        return changes
+
+
+class CsvTable(object):
+    """A table in a CSV file, with a header row."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self):
+        """Return the columns and the rows, by column key."""
+
+        with profiling.span("csv", "read"):
+            try:
+                with open(self.path, "rb") as f:
+                    reader = csv.reader(f)
+                    columns = [_text(column).lstrip(u"\ufeff")
+                               for column in next(reader, [])]
+                    keys = [columnKey(column) for column in columns]
+                    _checkKeys(keys, self.path)
+                    rows = [Row(keys, [value.decode("utf-8")
+                                       for value in row])
+                            for row in reader if any(row)]
+            except IOError, e:
+                raise RosterError("Cannot read %s: %s" % (self.path, e))
+        return columns, rows
+
+    def write(self, columns, rows):
+        """Write back the rows with the values changed, atomically."""
+
+        keys = [columnKey(column) for column in columns]
+        # The header and the mode of the file, as they were.
+        with open(self.path, "rb") as f:
+            header = next(csv.reader(f), [])
+        mode = stat.S_IMODE(os.stat(self.path).st_mode)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".roster-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for row in rows:
+                    values = list(row.values)
+                    for index, value in row.changes(keys).iteritems():
+                        values.extend([u""] * (index + 1 - len(values)))
+                        values[index] = value
+                    writer.writerow([value.encode("utf-8")
+                                     for value in values])
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class SqliteTable(object):
+    """A table in a SQLite database."""
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+
+    def _connect(self):
+        if not os.path.exists(self.path):
+            raise RosterError("Cannot read %s: no such file" % self.path)
+        return sqlite3.connect(self.path)
+
+    def _quoted(self, name=None):
+        return '"%s"' % (name or self.table).replace('"', '""')
+
+    def read(self):
+        """Return the columns and the rows, by column key."""
+
+        with profiling.span("sqlite", "select"):
+            connection = self._connect()
+            try:
+                cursor = connection.execute("SELECT rowid, * FROM %s"
+                                            % self._quoted())
+                columns = [column[0] for column in cursor.description[1:]]
+                keys = [columnKey(column) for column in columns]
+                _checkKeys(keys, self.path)
+                rows = []
+                for values in cursor:
+                    row = Row(keys, values[1:])
+                    row.rowid = values[0]
+                    rows.append(row)
+            except sqlite3.Error, e:
+                raise RosterError("Cannot read %s from %s: %s"
+                                  % (self.table, self.path, e))
+            finally:
+                connection.close()
+        return columns, rows
+
+    def write(self, columns, rows):
+        """Update the values changed, in one transaction."""
+
+        keys = [columnKey(column) for column in columns]
+        connection = self._connect()
+        try:
+            with connection:
+                for row in rows:
+                    changes = sorted(row.changes(keys).iteritems())
+                    if not changes:
+                        continue
+                    connection.execute(
+                        "UPDATE %s SET %s WHERE rowid = ?" % (
+                            self._quoted(),
+                            ", ".join("%s = ?" % self._quoted(columns[index])
+                                      for index, _ in changes)),
+                        [value for _, value in changes] + [row.rowid])
+        finally:
+            connection.close()
+
+
+class StudentRoster(object):
+    """The students of the class, in a local table."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def repair(self, ldap_object):
+        columns, rows = self._table.read()
+        for key in ["name", "e-mail", "gaspar", "sciper"]:
+            if key not in [columnKey(column) for column in columns]:
+                raise RosterError("No '%s' column in %s"
+                                  % (key, self._table.path))
+
+        for row in rows:
+            with metrics.entity():
+                student = epfl.EPFLStudentData(
+                    name=row.get("name"),
+                    email=row.get("e-mail"),
+                    gaspar=row.get("gaspar"),
+                    sciper=row.get("sciper"))
+
+                try:
+                    ldap_object.lookup(student)
+                except epfl.StudentNotFoundError:
+                    logging.warning("%s not found. Skipping." % student)
+                    metrics.skip()
+                    continue
+
+                row["name"] = _text(student.name)
+                row["e-mail"] = _text(student.email)
+                row["gaspar"] = _text(student.gaspar)
+                row["sciper"] = _text(student.sciper)
+
+                logging.info("Updated %s" % student)
+
+        self._table.write(columns, rows)
+
+    def getStudentList(self, student_factory):
+        _, rows = self._table.read()
+        return [student_factory(
+            name=row.get("name", u""),
+            email=row.get("e-mail", u""),
+            gaspar=row.get("gaspar", u""),
+            sciper=row.get("sciper", u""),
+            team_name=row.get("team", u""),
+            github_id=row.get("githubid", u"")) for row in rows]
+
+
+class TeamRoster(object):
+    """The teams of the class, in a local table."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def getTeamList(self, team_factory):
+        _, rows = self._table.read()
+        return [team_factory(name=row.get("team", u""),
+                             github_slug=row.get("githubslug", u""))
+                for row in rows]
+
+
+def openRoster(roster_config, base_dir):
+    """Return the student and team rosters of a "csv" or "sqlite" backend.
+
+    The relative paths are taken from base_dir.
+    """
+
+    def path(name):
+        if name not in roster_config:
+            raise RosterError("The roster configuration has no '%s'" % name)
+        return os.path.join(base_dir, os.path.expanduser(roster_config[name]))
+
+    backend = roster_config.get("backend")
+    if backend == "csv":
+        return (StudentRoster(CsvTable(path("students"))),
+                TeamRoster(CsvTable(path("teams"))))
+    if backend == "sqlite":
+        database = path("database")
+        return (StudentRoster(SqliteTable(
+                    database, roster_config.get("students_table", "students"))),
+                TeamRoster(SqliteTable(
+                    database, roster_config.get("teams_table", "teams"))))
+    raise RosterError("Unknown roster backend '%s', not one of %s"
+                      % (backend, ", ".join(BACKENDS)))
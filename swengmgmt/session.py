@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""State shared by the commands of a run."""
+
+
+import copy
+import functools
+import logging
+import os
+import threading
+
+from swengmgmt import metrics
+from swengmgmt import profiling
+from swengmgmt import store
+from swengmgmt import students
+
+
+# The state cache, relative to the configuration.
+DEFAULT_STATE_CACHE = "sweng-cache.json"
+
+# The parts of a session that can be invalidated and refreshed, each mapped to
+# the parts that have to be reloaded along with it.
+PARTS = ["config", "auth", "roster", "github"]
+DEPENDENTS = {
+    "config": PARTS,
+    "auth": ["auth", "github"],
+    "roster": ["roster", "github"],
+    "github": ["github"],
+}
+
+
+def _locked(method):
+    """Serialize the calls to a session method across threads."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Session(object):
+    """Configuration, authenticated clients and class data.
+
+    Everything is loaded lazily, on first use. A plain invocation of the tool
+    uses one session for its single command; the long-running modes keep the
+    session across commands, so that authentication, the roster and the
+    Github snapshot are only loaded once, until explicitly invalidated.
+    """
+
+    def __init__(self, config_path, auth_path, non_interactive=False,
+                 google_client=None, cassette=None, refresh_roster=False,
+                 shard=None):
+        self.config_path = config_path
+        self.auth_path = auth_path
+        self.non_interactive = non_interactive
+        # Download the worksheets even if they did not change.
+        self.refresh_roster = refresh_roster
+        # Records the HTTP traffic of the clients, or replays it to them.
+        self.cassette = cassette
+        # The (index, count) of the shard of a bulk command run by this
+        # process, if any.
+        self.shard = shard
+        # The global options of the command line that started the session,
+        # for the commands run later on it by the long-running modes.
+        self.global_args = None
+
+        self.config = None
+        self.auth_config = None
+        # The authentication as read, to write back only what changed.
+        self._auth_loaded = None
+        self._state_cache = None
+
+        # An already authenticated client can be passed in, e.g., a fake one.
+        self._google_client = google_client
+        self._github_client = None
+
+        self.student_sheet = None
+        self.team_sheet = None
+        self.sweng_class = None
+        self.github_org = None
+        self._github_loaded = False
+
+        # Guards the lazy loading. The long-running modes also hold it while
+        # a command runs, unless they run several commands concurrently.
+        self.lock = threading.RLock()
+
+    @_locked
+    def loadConfig(self):
+        if self.config is not None:
+            return self.config
+
+        with metrics.phase("config"):
+            import yaml
+
+            self.config = {}
+            if os.path.exists(self.config_path):
+                with open(self.config_path, "r") as f:
+                    self.config = yaml.load(f)
+
+            self.auth_config = store.LockedFile(self.auth_path).read()
+            self._auth_loaded = copy.deepcopy(self.auth_config)
+
+        return self.config
+
+    @_locked
+    def save(self):
+        if self._state_cache:
+            self._state_cache.flush()
+
+        if self.auth_config is None:
+            return
+
+        # Only the tokens obtained by this run are written, over the latest
+        # file: a concurrent run may have obtained the others.
+        changed = dict((name, value)
+                       for name, value in self.auth_config.iteritems()
+                       if value and value != self._auth_loaded.get(name))
+        if not changed:
+            return
+        with store.LockedFile(self.auth_path).transaction() as auth_config:
+            auth_config.update(copy.deepcopy(changed))
+        self._auth_loaded = copy.deepcopy(self.auth_config)
+
+    @_locked
+    def stateCache(self):
+        """Return the cache shared with the other runs, or None if disabled.
+
+        The cache holds the keys and rows of the worksheets, and the recent
+        LDAP entries.
+        """
+
+        if self._state_cache is None:
+            self.loadConfig()
+            path = self.config.get("cache", (self.config.get("spreadsheet")
+                                             or {}).get("cache",
+                                                        DEFAULT_STATE_CACHE))
+            if not path:
+                return None
+            # Relative to the configuration, as the roster files.
+            path = os.path.join(
+                os.path.dirname(os.path.abspath(self.config_path)),
+                os.path.expanduser(path))
+            self._state_cache = store.StateCache(path)
+        return self._state_cache
+
+    def _replaying(self):
+        return self.cassette is not None and self.cassette.replaying
+
+    @_locked
+    def googleClient(self):
+        if not self._google_client:
+            from swengmgmt import spreadsheets
+
+            self.loadConfig()
+            gdata_auth = spreadsheets.GDataOAuthProvider(self.config,
+                                                         self.auth_config)
+            with metrics.phase("auth"):
+                if not self._replaying():
+                    gdata_auth.authenticate(self.non_interactive)
+                self._google_client = gdata_auth.getClient()
+            if self.cassette:
+                self.cassette.attachGData(self._google_client)
+            if profiling.active():
+                profiling.instrumentGData(self._google_client)
+        return self._google_client
+
+    @_locked
+    def githubClient(self):
+        if not self._github_client:
+            from swengmgmt import github
+
+            self.loadConfig()
+            github_auth = github.GithubAuthProvider(self.config,
+                                                    self.auth_config,
+                                                    self.shard)
+            with metrics.phase("auth"):
+                if not self._replaying():
+                    github_auth.authenticate(self.non_interactive)
+                else:
+                    # The replayed responses need no credentials, but github3
+                    # refuses to send most requests without a token.
+                    from swengmgmt import cassette
+                    github_auth.token = cassette.SCRUBBED
+                self._github_client = github_auth.getClient()
+            if self.cassette:
+                self.cassette.attachGithub(self._github_client)
+            if profiling.active():
+                profiling.instrumentGithub(self._github_client)
+        return self._github_client
+
+    @_locked
+    def loadClass(self):
+        """Return the SwEng class, populated from the roster."""
+
+        if self.sweng_class:
+            return self.sweng_class
+
+        self.loadConfig()
+        roster_config = self.config.get("roster") or {}
+        backend = roster_config.get("backend", "sheets")
+
+        if backend == "sheets":
+            from swengmgmt import spreadsheets
+
+            google_client = self.googleClient()
+            cache = self._rosterCache()
+            loader = self.config["spreadsheet"].get("loader", "list")
+            if loader not in spreadsheets.LOADERS:
+                raise ValueError("Unknown spreadsheet loader '%s', not one "
+                                 "of %s" % (loader,
+                                            ", ".join(spreadsheets.LOADERS)))
+
+        with metrics.phase("roster"):
+            if backend == "sheets":
+                self.student_sheet = spreadsheets.SwEngStudentSpreadsheet(
+                    google_client,
+                    self.config["spreadsheet"]["title"],
+                    self.config["spreadsheet"]["students_worksheet"],
+                    cache, loader)
+
+                self.team_sheet = spreadsheets.SwEngTeamSpreadsheet(
+                    google_client,
+                    self.config["spreadsheet"]["title"],
+                    self.config["spreadsheet"]["teams_worksheet"],
+                    cache, loader)
+            else:
+                from swengmgmt import roster
+
+                # The roster files are found relative to the configuration.
+                self.student_sheet, self.team_sheet = roster.openRoster(
+                    roster_config,
+                    os.path.dirname(os.path.abspath(self.config_path)))
+
+            self.sweng_class = students.SwEngClass(self.config)
+            self.sweng_class.shard = self.shard
+            self.sweng_class.populateFromSpreadsheet(self.student_sheet,
+                                                     self.team_sheet)
+        self._github_loaded = False
+        return self.sweng_class
+
+    def _rosterCache(self):
+        from swengmgmt import spreadsheets
+
+        state_cache = self.stateCache()
+        if not state_cache:
+            return None
+        return spreadsheets.RosterCache(state_cache,
+                                        refresh=self.refresh_roster)
+
+    @_locked
+    def githubOrg(self):
+        """Return the Github organization, without listing its contents."""
+
+        if not self.github_org:
+            self.loadConfig()
+            github_client = self.githubClient()
+            with metrics.phase("github"):
+                self.github_org = github_client.organization(
+                    self.config["organization"]["name"])
+        return self.github_org
+
+    @_locked
+    def loadGithub(self):
+        """Return the Github organization, with the class data attached."""
+
+        sweng_class = self.loadClass()
+        github_org = self.githubOrg()
+
+        if not self._github_loaded:
+            with metrics.phase("github"):
+                sweng_class.updateGithubData(github_org,
+                                             self.githubSnapshot())
+            self._github_loaded = True
+        return github_org
+
+    def githubSnapshot(self):
+        """Return the snapshot kept by a webhook listener, if it is running."""
+
+        if not self.config.get("webhook"):
+            return None
+
+        from swengmgmt import webhook
+
+        return webhook.currentSnapshot(self.stateCache(),
+                                       self.config["organization"])
+
+    def iterGithub(self):
+        """Yield the students and teams as their Github data gets attached.
+
+        If the Github data is already loaded, everything is yielded at once.
+        """
+
+        with self.lock:
+            sweng_class = self.loadClass()
+            if self._github_loaded:
+                for entity in (sweng_class.students.values() +
+                               sweng_class.teams.values()):
+                    yield entity
+                return
+
+            for entity in sweng_class.iterGithubData(self.githubOrg(),
+                                                     self.githubSnapshot()):
+                yield entity
+            self._github_loaded = True
+
+    @_locked
+    def invalidate(self, parts):
+        """Drop the given parts, and everything that depends on them."""
+
+        parts = set(dep for part in parts for dep in DEPENDENTS[part])
+
+        if "config" in parts:
+            self.save()
+            self.config = None
+            self.auth_config = None
+            self._state_cache = None
+        if "auth" in parts:
+            self._google_client = None
+            self._github_client = None
+            self.github_org = None
+        if "roster" in parts:
+            self.student_sheet = None
+            self.team_sheet = None
+            self.sweng_class = None
+        if "github" in parts:
+            if self.sweng_class:
+                self.sweng_class.clearGithubData()
+            self._github_loaded = False
+
+        logging.info("Invalidated %s." % ", ".join(p for p in PARTS
+                                                    if p in parts))
+        return parts
+
+    @_locked
+    def refresh(self, parts):
+        """Invalidate the given parts and load them again right away."""
+
+        parts = self.invalidate(parts)
+        config = self.loadConfig()
+        if "auth" in parts:
+            # Google only for a roster kept in Sheets.
+            if (config.get("roster") or {}).get("backend",
+                                                "sheets") == "sheets":
+                self.googleClient()
+            self.githubClient()
+        self.loadGithub()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bulk commands split between processes, each with a Github token.
+
+The rate limit of one token bounds how fast a bulk command can go. With
+--shards N, the command line is run by N processes, the shards, each on the
+students or teams whose key hashes to it, and with the token of the same
+rank in the "shard_tokens" list of the "github" section of the
+authentication file. The split only depends on the keys and N, so that an
+interrupted command resumes with the same shards.
+
+Each shard saves the outcome for each entity to a report of its own, which
+the coordinator reads to log the progress, and merges at the end.
+"""
+
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from swengmgmt import bulk
+from swengmgmt import multi
+from swengmgmt import store
+
+
+# The interval between two progress logs, in seconds.
+PROGRESS_INTERVAL = 10
+
+
+def shardSpec(text):
+    """Parse "I/N", the rank of a shard, from 1, and their number, into
+    (index, count)."""
+
+    try:
+        rank, count = [int(part) for part in text.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not I/N" % text)
+    if not 1 <= rank <= count:
+        raise argparse.ArgumentTypeError("'%s' is not a shard" % text)
+    return rank - 1, count
+
+
+def shardOf(key, count):
+    """Return the shard of a key, the same in every process and run."""
+
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    return int(hashlib.sha1(key).hexdigest(), 16) % count
+
+
+def inShard(key, shard):
+    return shard is None or shardOf(key, shard[1]) == shard[0]
+
+
+def rateLimitShares(count, token_count):
+    """Return the number of shards sharing the token of each shard."""
+
+    token_count = max(token_count, 1)
+    return [len(range(index % token_count, count, token_count))
+            for index in xrange(count)]
+
+
+def _readEntries(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)["entries"]
+    except (IOError, ValueError, KeyError):
+        return {}
+
+
+def _counts(entries):
+    counts = {}
+    for entry in entries.itervalues():
+        counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+    return counts
+
+
+def _logProgress(paths, stopped):
+    while not stopped.wait(PROGRESS_INTERVAL):
+        counts = _counts(dict((key, entry) for path in paths
+                              for key, entry in _readEntries(path).iteritems()))
+        logging.info("Progress: %d done, %d failed."
+                     % (counts.get("done", 0), counts.get("failed", 0)))
+
+
+def coordinate(args, argv, program):
+    """Run the bulk command line of the program in args.shards shards, and
+    return the highest exit status."""
+
+    count = args.shards
+    # The shards cannot ask for anything: the tokens are obtained before.
+    if not args.replay:
+        multi.authenticate([args.config], args.auth, args.non_interactive)
+    tokens = ((store.LockedFile(args.auth).read().get("github") or {})
+              .get("shard_tokens") or [])
+    if len(tokens) < count:
+        logging.warning("%d Github tokens for %d shards: some of them share "
+                        "a token, and its rate limit." % (max(len(tokens), 1),
+                                                           count))
+
+    confirmed = False
+    if getattr(args.command, "class_operation", False) and not (
+            getattr(args, "students", None) or getattr(args, "teams", None)):
+        if not args.command.confirmClassOperation(args):
+            return 0
+        confirmed = True
+
+    # The reports of a resumable command are kept next to its report, the
+    # others only for the run.
+    directory = None
+    default_report = not getattr(args, "report", None)
+    if hasattr(args, "report"):
+        report_path = args.report or "%s-report.json" % args.command.arg_name
+    else:
+        directory = tempfile.mkdtemp(prefix="sweng-shards-")
+        report_path = os.path.join(directory, "report.json")
+    paths = [multi.perConfigPath(report_path, "shard-%d" % (index + 1))
+             for index in xrange(count)]
+
+    runs = []
+    shares = rateLimitShares(count, len(tokens))
+    for index in xrange(count):
+        child_argv = ["-n", "--shard", "%d/%d" % (index + 1, count),
+                      "--shard-report", paths[index],
+                      "--rate-limit-share", str(shares[index])]
+        if confirmed:
+            child_argv.append("--yes")
+        runs.append(multi.ChildRun(
+            "shard %d/%d" % (index + 1, count),
+            child_argv + multi.rewriteArgv(argv, "shard-%d" % (index + 1),
+                                           ("--shards", "--report",
+                                            "--rate-limit-share"))))
+
+    start = time.time()
+    stopped = threading.Event()
+    progress = threading.Thread(target=_logProgress, args=(paths, stopped))
+    progress.daemon = True
+    progress.start()
+    try:
+        status = multi.runAll(runs, program, count)
+    finally:
+        stopped.set()
+        progress.join()
+    duration = time.time() - start
+    multi.mergeOutputs(None, runs)
+
+    entries = {}
+    for path in paths:
+        entries.update(_readEntries(path))
+    try:
+        report = bulk.BulkReport(None if directory else report_path,
+                                 args.command.reportOperation(args))
+    except bulk.ReportError, e:
+        logging.error(str(e))
+        return 2
+    report.merge(entries)
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+    elif status == 0 and report.complete():
+        # Nothing left to resume: the next run starts over. The report asked
+        # for is kept, but not the ones of the shards.
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        if default_report and report.remove():
+            logging.info("All done; removed %s." % report_path)
+
+    # Not counting the entities done by a previous run.
+    entries = dict((key, entry) for key, entry in entries.iteritems()
+                   if entry["time"] >= start)
+    for key, entry in sorted(entries.iteritems()):
+        if entry["status"] == "failed":
+            logging.error("Failed on %s: %s" % (key, entry.get("error", "")))
+    counts = _counts(entries)
+    logging.info("%d done, %d failed, by %d shards in %.3f s (%.1f per "
+                 "second)." % (counts.get("done", 0), counts.get("failed", 0),
+                               count, duration,
+                               len(entries) / max(duration, 0.001)))
+    return status
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Interactive shell running commands on a shared session."""
+
+
+import cmd
+import logging
+import shlex
+
+from swengmgmt import commands
+
+
+class ClassShell(cmd.Cmd):
+    """Reads command lines and runs them on one loaded SwEng class."""
+
+    intro = ("SwEng management shell. Type 'help' for the list of commands, "
+             "'<command> -h' for their usage and 'exit' to quit.")
+    prompt = "sweng> "
+
+    def __init__(self, parser, command_list, shared_session):
+        cmd.Cmd.__init__(self)
+        self._parser = parser
+        self._command_list = command_list
+        self._session = shared_session
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        try:
+            argv = shlex.split(line)
+        except ValueError, e:
+            logging.error("Cannot parse '%s': %s" % (line, e))
+            return
+        if argv[0] not in self.completenames(""):
+            logging.error("Unknown command '%s'. Type 'help' for the list "
+                          "of commands." % argv[0])
+            return
+        try:
+            commands.runCommandLine(self._parser, self._session, argv)
+        except KeyboardInterrupt:
+            print
+            logging.warning("Interrupted '%s'." % line)
+
+    def completenames(self, text, *ignored):
+        names = [command.arg_name for command in self._command_list]
+        names.extend(["help", "exit"])
+        return [name for name in names if name.startswith(text)]
+
+    def do_help(self, line):
+        if line:
+            self.default("%s -h" % line)
+            return
+        for command in self._command_list:
+            print "  %-20s %s" % (command.arg_name, command.__doc__)
+        print "  %-20s %s" % ("exit", "Leave the shell.")
+
+    def do_exit(self, line):
+        return True
+
+    def do_EOF(self, line):
+        print
+        return True
+
+    def run(self):
+        while True:
+            try:
+                self.cmdloop()
+                return
+            except KeyboardInterrupt:
+                print
+                self.intro = None
@@ -20,15 +20,26 @@
 
 import logging
 
+import gdata.client
 import gdata.gauth
 import gdata.spreadsheets.client
+import gdata.spreadsheets.data
 
 from swengmgmt import epfl
+from swengmgmt import metrics
+from swengmgmt import roster
 
 
 DEFAULT_STUDENTS_WORKSHEET = "Students"
 DEFAULT_TEAMS_WORKSHEET = "Teams"
 
+# How the rows are downloaded: whole, from the list feed, or only the columns
+# read by the tool, from the cells feed.
+LOADERS = ["list", "cells"]
+
+# The most cell updates sent in one batch request.
+BATCH_SIZE = 1000
+
 
 class AuthorizationFailedError(Exception):
     pass
@@ -81,85 +92,299 @@ class GDataOAuthProvider(object):
 
     def getClient(self):
         client = gdata.spreadsheets.client.SpreadsheetsClient()
+        if not self.token:
+            # Unauthenticated, e.g., to replay a cassette.
+            return client
         return self.token.authorize(client)
 
 
+def _runs(numbers):
+    """Group sorted numbers into (first, last) runs of consecutive ones."""
+
+    runs = []
+    for number in numbers:
+        if runs and runs[-1][1] == number - 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return runs
+
+
+class RosterCache(object):
+    """The keys and rows of the worksheets, kept in the state cache.
+
+    The rows of a worksheet are stored along with its version (the time it
+    was last updated, and its ETag), and served as long as the version is
+    the same. With refresh, the worksheets are looked up and downloaded
+    again in any case.
+    """
+
+    def __init__(self, state, refresh=False):
+        self._state = state
+        self.refresh = refresh
+
+    def getKeys(self, ssheet_title, wsheet_name):
+        """Return the spreadsheet key and worksheet ID, or None if unknown."""
+
+        if self.refresh:
+            return None
+        return self._state.get("worksheet-keys",
+                               "%s/%s" % (ssheet_title, wsheet_name))
+
+    def putKeys(self, ssheet_title, wsheet_name, ssheet_key, wsheet_id):
+        self._state.put("worksheet-keys",
+                        "%s/%s" % (ssheet_title, wsheet_name),
+                        [ssheet_key, wsheet_id])
+
+    def get(self, key, version):
+        """Return the rows cached for the worksheet, or None if outdated."""
+
+        if self.refresh:
+            return None
+        entry = self._state.get("worksheets", key)
+        if entry and entry["version"] == version:
+            return entry["rows"]
+        return None
+
+    def put(self, key, version, rows):
+        self._state.put("worksheets", key, {"version": version, "rows": rows})
+        self._state.flush()
+
+
 class DataSpreadsheet(object):
     """Interface to a worksheet in a Google spreadsheet."""
 
-    def __init__(self, client, ssheet_title, wsheet_name):
+    # The columns kept from the list feed.
+    COLUMNS = []
+
+    def __init__(self, client, ssheet_title, wsheet_name, cache=None,
+                 loader="list"):
         self._ssheet_title = ssheet_title
         self._wsheet_name = wsheet_name
         self._client = client
+        self._cache = cache
+        self._loader = loader
 
         self.ssheet_key = None
         self.wsheet_id = None
+        self.version = None
 
     def _fetchSpreadsheet(self):
         if self.ssheet_key and self.wsheet_id:
             return
 
-        ssheet_q = gdata.spreadsheets.client.SpreadsheetQuery(
-            title=self._ssheet_title,
-            title_exact=True)
-        ssheet_feed = self._client.get_spreadsheets(q=ssheet_q)
-        self.ssheet_key = ssheet_feed.entry[0].get_spreadsheet_key()
-
         wsheet_q = gdata.spreadsheets.client.WorksheetQuery(
             title=self._wsheet_name,
             title_exact=True)
-        wsheet_feed = self._client.get_worksheets(self.ssheet_key, q=wsheet_q)
-        self.wsheet_id = wsheet_feed.entry[0].get_worksheet_id()
+
+        # The spreadsheet key found by an earlier run saves looking it up by
+        # title, as long as the spreadsheet still has the worksheet.
+        keys = self._cache and self._cache.getKeys(self._ssheet_title,
+                                                   self._wsheet_name)
+        wsheet_feed = None
+        if keys:
+            try:
+                wsheet_feed = self._client.get_worksheets(keys[0], q=wsheet_q)
+                self.ssheet_key = keys[0]
+            except gdata.client.RequestError:
+                logging.info("Looking up the spreadsheet '%s' again."
+                             % self._ssheet_title)
+
+        if not wsheet_feed or not wsheet_feed.entry:
+            ssheet_q = gdata.spreadsheets.client.SpreadsheetQuery(
+                title=self._ssheet_title,
+                title_exact=True)
+            ssheet_feed = self._client.get_spreadsheets(q=ssheet_q)
+            self.ssheet_key = ssheet_feed.entry[0].get_spreadsheet_key()
+            wsheet_feed = self._client.get_worksheets(self.ssheet_key,
+                                                      q=wsheet_q)
+
+        wsheet_entry = wsheet_feed.entry[0]
+        self.wsheet_id = wsheet_entry.get_worksheet_id()
+        if self._cache and keys != [self.ssheet_key, self.wsheet_id]:
+            self._cache.putKeys(self._ssheet_title, self._wsheet_name,
+                                self.ssheet_key, self.wsheet_id)
+        if wsheet_entry.updated is not None:
+            self.version = "%s %s" % (wsheet_entry.updated.text,
+                                      getattr(wsheet_entry, "etag", None) or "")
+
+    def _getRows(self):
+        """Return the rows of the worksheet, as dicts by column.
+
+        They are only downloaded if the worksheet changed since they were
+        cached.
+        """
+
+        self._fetchSpreadsheet()
+
+        key = "%s/%s" % (self.ssheet_key, self.wsheet_id)
+        if self._cache and self.version:
+            rows = self._cache.get(key, self.version)
+            if rows is not None:
+                logging.info("Worksheet '%s' unchanged since %s. Using the "
+                             "cached rows." % (self._wsheet_name,
+                                               self.version.split()[0]))
+                return rows
+
+        if self._loader == "cells":
+            _, cells = self._getCells()
+            rows = [dict((column, row.get(column)) for column in self.COLUMNS)
+                    for _, row in sorted(cells.iteritems())]
+        else:
+            list_feed = self._client.get_list_feed(self.ssheet_key,
+                                                   self.wsheet_id)
+            rows = [dict((column, entry.get_value(column))
+                         for column in self.COLUMNS)
+                    for entry in list_feed.entry]
+
+        if self._cache and self.version:
+            self._cache.put(key, self.version, rows)
+        return rows
+
+    def _getCells(self):
+        """Return the positions of the columns read by the tool, and the
+        values of their cells, by row and column, up to the first empty row.
+
+        The header row is fetched first, then the cells of the columns, one
+        range of adjacent columns at a time, so that the other columns of the
+        worksheet (e.g., annotations) are not downloaded.
+        """
+
+        header = self._client.get_cells(
+            self.ssheet_key, self.wsheet_id,
+            q=gdata.spreadsheets.client.CellQuery(min_row=1, max_row=1))
+        positions = {}
+        for entry in header.entry:
+            column = roster.columnKey(entry.cell.text or "")
+            if column in self.COLUMNS and column not in positions:
+                positions[column] = int(entry.cell.col)
+
+        columns = dict((position, column)
+                       for column, position in positions.iteritems())
+        cells = {}
+        for first, last in _runs(sorted(columns)):
+            feed = self._client.get_cells(
+                self.ssheet_key, self.wsheet_id,
+                q=gdata.spreadsheets.client.CellQuery(min_row=2, min_col=first,
+                                                      max_col=last))
+            for entry in feed.entry:
+                cells.setdefault(int(entry.cell.row), {})[
+                    columns[int(entry.cell.col)]] = entry.cell.text
+
+        # As the list feed, stop at the first empty row: what follows, e.g.,
+        # notes or another table, is not part of the roster.
+        end = 2
+        while end in cells:
+            end += 1
+        return positions, dict((row, values)
+                               for row, values in cells.iteritems()
+                               if row < end)
 
 
 class SwEngStudentSpreadsheet(DataSpreadsheet):
     """Interface to a SwEng students worksheet."""
 
-    def __init__(self, client, ssheet_title, wsheet_name=None):
+    COLUMNS = ["name", "e-mail", "gaspar", "sciper", "team", "githubid"]
+
+    # The columns completed by repair.
+    REPAIRED_COLUMNS = ["name", "e-mail", "gaspar", "sciper"]
+
+    def __init__(self, client, ssheet_title, wsheet_name=None, cache=None,
+                 loader="list"):
         wsheet_name = wsheet_name or DEFAULT_STUDENTS_WORKSHEET
 
         super(SwEngStudentSpreadsheet, self).__init__(client,
                                                       ssheet_title,
-                                                      wsheet_name)
+                                                      wsheet_name,
+                                                      cache,
+                                                      loader)
+
+    def _lookup(self, ldap_object, get_value):
+        """Return the student completed from LDAP, or None if not found."""
+
+        student = epfl.EPFLStudentData(
+            name=get_value("name"),
+            email=get_value("e-mail"),
+            gaspar=get_value("gaspar"),
+            sciper=get_value("sciper"))
+
+        try:
+            ldap_object.lookup(student)
+        except epfl.StudentNotFoundError:
+            logging.warning("%s not found. Skipping." % student)
+            metrics.skip()
+            return None
+        return student
 
     def repair(self, ldap_object):
         self._fetchSpreadsheet()
 
+        if self._loader == "cells":
+            self._repairCells(ldap_object)
+            return
+
         list_feed = self._client.get_list_feed(self.ssheet_key, self.wsheet_id)
         for entry in list_feed.entry:
-            student = epfl.EPFLStudentData(
-                name=entry.get_value("name"),
-                email=entry.get_value("e-mail"),
-                gaspar=entry.get_value("gaspar"),
-                sciper=entry.get_value("sciper"))
-
-            try:
-                ldap_object.lookup(student)
-            except epfl.StudentNotFoundError:
-                logging.warning("%s not found. Skipping." % student)
-                continue
-
-            entry.set_value("name", student.name)
-            entry.set_value("e-mail", student.email)
-            entry.set_value("gaspar", student.gaspar)
-            entry.set_value("sciper", student.sciper)
-            self._client.update(entry)
-
-            logging.info("Updated %s" % student)
+            with metrics.entity():
+                student = self._lookup(ldap_object, entry.get_value)
+                if not student:
+                    continue
+
+                entry.set_value("name", student.name)
+                entry.set_value("e-mail", student.email)
+                entry.set_value("gaspar", student.gaspar)
+                entry.set_value("sciper", student.sciper)
+                self._client.update(entry)
+
+                logging.info("Updated %s" % student)
+
+    def _repairCells(self, ldap_object):
+        # Only the cells that change are sent, in batches.
+        positions, cells = self._getCells()
+        missing = set(self.REPAIRED_COLUMNS) - set(positions)
+        if missing:
+            raise ValueError("No %s column in worksheet '%s'"
+                             % (", ".join(sorted(missing)), self._wsheet_name))
+
+        updates = []
+        for row, values in sorted(cells.iteritems()):
+            with metrics.entity():
+                student = self._lookup(ldap_object, values.get)
+                if not student:
+                    continue
+
+                for column, value in zip(self.REPAIRED_COLUMNS,
+                                         [student.name, student.email,
+                                          student.gaspar, student.sciper]):
+                    value = unicode(value or "")
+                    if value != (values.get(column) or ""):
+                        updates.append((row, positions[column], value))
+
+                logging.info("Updated %s" % student)
+
+        for start in xrange(0, len(updates), BATCH_SIZE):
+            batch = gdata.spreadsheets.data.build_batch_cells_update(
+                self.ssheet_key, self.wsheet_id)
+            for row, col, value in updates[start:start + BATCH_SIZE]:
+                batch.add_set_cell(row, col, value)
+            result = self._client.batch(batch, force=True)
+            for entry in result.entry:
+                status = entry.batch_status
+                if status is not None and status.code not in ("200", "201"):
+                    logging.error("Could not update cell %s: %s"
+                                  % (entry.id.text if entry.id else "?",
+                                     status.reason))
 
     def getStudentList(self, student_factory):
-        self._fetchSpreadsheet()
-
         result = []
-        list_feed = self._client.get_list_feed(self.ssheet_key, self.wsheet_id)
-        for entry in list_feed.entry:
+        for row in self._getRows():
             student = student_factory(
-                name=(entry.get_value("name") or "").strip(),
-                email=(entry.get_value("e-mail") or "").strip(),
-                gaspar=(entry.get_value("gaspar") or "").strip(),
-                sciper=(entry.get_value("sciper") or "").strip(),
-                team_name=(entry.get_value("team") or "").strip(),
-                github_id=(entry.get_value("githubid") or "").strip())
+                name=(row["name"] or "").strip(),
+                email=(row["e-mail"] or "").strip(),
+                gaspar=(row["gaspar"] or "").strip(),
+                sciper=(row["sciper"] or "").strip(),
+                team_name=(row["team"] or "").strip(),
+                github_id=(row["githubid"] or "").strip())
 
             result.append(student)
 
@@ -169,22 +394,24 @@ class SwEngStudentSpreadsheet(DataSpreadsheet):
 class SwEngTeamSpreadsheet(DataSpreadsheet):
     """Interface to a SwEng teams worksheet."""
 
-    def __init__(self, client, spreadsheet_title, wsheet_name=None):
+    COLUMNS = ["team", "githubslug"]
+
+    def __init__(self, client, spreadsheet_title, wsheet_name=None,
+                 cache=None, loader="list"):
         wsheet_name = wsheet_name or DEFAULT_TEAMS_WORKSHEET
 
         super(SwEngTeamSpreadsheet, self).__init__(client,
                                                    spreadsheet_title,
-                                                   wsheet_name)
+                                                   wsheet_name,
+                                                   cache,
+                                                   loader)
 
     def getTeamList(self, team_factory):
-        self._fetchSpreadsheet()
-
         result = []
-        list_feed = self._client.get_list_feed(self.ssheet_key, self.wsheet_id)
-        for entry in list_feed.entry:
+        for row in self._getRows():
             team = team_factory(
-                name=entry.get_value("team").strip(),
-                github_slug=entry.get_value("githubslug").strip())
+                name=row["team"].strip(),
+                github_slug=row["githubslug"].strip())
             result.append(team)
 
         return result
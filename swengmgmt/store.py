@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Files shared by the runs of the tool on the same machine.
+
+Several TAs or cron jobs may run the tool at once, with the same
+authentication and cache files. Each file is guarded by an advisory lock on
+a companion ".lock" file: shared to read it, exclusive to change it. Changes
+are made on the latest contents, read under the lock, and written to a
+temporary file renamed over the previous one, only if they changed
+anything, so that the runs never lose each other's updates nor see a file
+half-written.
+"""
+
+
+import contextlib
+import copy
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No locking on platforms without it, e.g., Windows.
+    fcntl = None
+
+
+class LockedFile(object):
+    """A YAML or JSON file, read and changed under a file lock.
+
+    The file is created only readable by its owner, as it holds tokens or
+    personal data; an existing file keeps its mode.
+    """
+
+    def __init__(self, path, format="yaml"):
+        self.path = path
+        self.format = format
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        if not fcntl:
+            yield
+            return
+        fd = os.open("%s.lock" % self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            try:
+                if self.format == "json":
+                    data = json.load(f)
+                else:
+                    import yaml
+                    data = yaml.safe_load(f)
+            except Exception, e:
+                logging.warning("Ignoring the corrupt file %s: %s"
+                                % (self.path, e))
+                return {}
+        return data or {}
+
+    def _write(self, data):
+        mode = 0o600
+        if os.path.exists(self.path):
+            mode = stat.S_IMODE(os.stat(self.path).st_mode)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".%s-" % os.path.basename(self.path), dir=directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                if self.format == "json":
+                    json.dump(data, f)
+                else:
+                    import yaml
+                    yaml.safe_dump(data, stream=f, default_flow_style=False)
+            os.chmod(tmp_path, mode)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self):
+        with self._locked(False):
+            return self._load()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Yield the current contents, and write them back if changed."""
+
+        with self._locked(True):
+            data = self._load()
+            original = copy.deepcopy(data)
+            yield data
+            if data != original:
+                self._write(data)
+
+    def mtime(self):
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+
+class StateCache(object):
+    """Data kept between runs, in sections of keys and JSON values.
+
+    The file is read again whenever another run changed it, and the local
+    changes are merged into it on flush, so that concurrent runs reuse each
+    other's data instead of overwriting it. A value of None stands for a
+    deleted key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = LockedFile(path, "json")
+        self._data = None
+        self._mtime = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _reload(self):
+        mtime = self._file.mtime()
+        if self._data is not None and mtime == self._mtime:
+            return
+        self._data = self._file.read()
+        self._mtime = mtime
+        for section, entries in self._pending.iteritems():
+            _merge(self._data, section, entries)
+
+    def get(self, section, key, default=None):
+        with self._lock:
+            self._reload()
+            return self._data.get(section, {}).get(key, default)
+
+    def items(self, section):
+        """Return the keys and values of a section, as a dict."""
+
+        with self._lock:
+            self._reload()
+            return dict(self._data.get(section, {}))
+
+    def put(self, section, key, value):
+        """Change a value, to be written on the next flush."""
+
+        with self._lock:
+            self._reload()
+            _merge(self._data, section, {key: value})
+            self._pending.setdefault(section, {})[key] = value
+
+    def delete(self, section, key):
+        self.put(section, key, None)
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            with self._file.transaction() as data:
+                for section, entries in self._pending.iteritems():
+                    _merge(data, section, entries)
+            self._pending = {}
+            # Read again on next use, with the changes of the other runs.
+            self._data = None
+
+
+def _merge(data, section, entries):
+    values = data.setdefault(section, {})
+    for key, value in entries.iteritems():
+        if value is None:
+            values.pop(key, None)
+        else:
+            values[key] = value
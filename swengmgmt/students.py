@@ -18,18 +18,144 @@
 """Student management."""
 
 
+import functools
+import json
 import logging
 import re
 import shlex
 import subprocess
 
 from swengmgmt import epfl
+from swengmgmt import metrics
+from swengmgmt import profiling
 from util import cd
 
 
+class GithubRef(object):
+    """Compact handle to a Github object.
+
+    Only the fields used by the tool are kept. The full github3 object, which
+    carries the whole JSON payload, is fetched on first use of any other
+    attribute (e.g., a mutation such as ``edit`` or ``delete``).
+    """
+
+    __slots__ = ("id", "name", "_org", "_obj")
+
+    def __init__(self, github_org, id, name, obj=None):
+        self._org = github_org
+        self._obj = obj
+        self.id = id
+        self.name = name
+
+    def _fetch(self):
+        raise NotImplementedError()
+
+    def _url(self):
+        raise NotImplementedError()
+
+    def delete(self):
+        # Without fetching the full object first.
+        return self._org._boolean(self._org._delete(self._url()), 204, 404)
+
+    @property
+    def obj(self):
+        if self._obj is None:
+            self._obj = self._fetch()
+        return self._obj
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return getattr(self.obj, attr)
+
+    def __eq__(self, other):
+        return (isinstance(other, GithubRef) and type(self) == type(other)
+                and self.id == other.id)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return "<%s [%s]>" % (self.__class__.__name__, self)
+
+    def __str__(self):
+        return self.name
+
+
+class GithubTeamRef(GithubRef):
+    __slots__ = ("permission",)
+
+    def __init__(self, github_org, id, name, permission, obj=None):
+        super(GithubTeamRef, self).__init__(github_org, id, name, obj)
+        self.permission = permission
+
+    @classmethod
+    def fromObject(cls, gh_team, github_org, keep=False):
+        return cls(github_org, gh_team.id, gh_team.name, gh_team.permission,
+                   obj=gh_team if keep else None)
+
+    @classmethod
+    def fromJson(cls, json, github_org):
+        return cls(github_org, json["id"], json["name"], json["permission"])
+
+    def _fetch(self):
+        return self._org.team(self.id)
+
+    def _url(self):
+        return self._org._build_url("teams", str(self.id))
+
+    def edit(self, name, permission=None):
+        """Rename the team or change its permission, in a single call."""
+
+        data = {"name": name}
+        if permission:
+            data["permission"] = permission
+        result = self._org._json(self._org._patch(self._url(),
+                                                  data=json.dumps(data)), 200)
+        if not result:
+            return False
+        self.name = result["name"]
+        self.permission = result["permission"]
+        return True
+
+
+class GithubRepoRef(GithubRef):
+    __slots__ = ("full_name", "ssh_url")
+
+    def __init__(self, github_org, id, name, full_name, ssh_url, obj=None):
+        super(GithubRepoRef, self).__init__(github_org, id, name, obj)
+        self.full_name = full_name
+        self.ssh_url = ssh_url
+
+    @classmethod
+    def fromObject(cls, gh_repo, github_org, keep=False):
+        return cls(github_org, gh_repo.id, gh_repo.name, gh_repo.full_name,
+                   gh_repo.ssh_url, obj=gh_repo if keep else None)
+
+    @classmethod
+    def fromJson(cls, json, github_org):
+        return cls(github_org, json["id"], json["name"], json["full_name"],
+                   json["ssh_url"])
+
+    def _fetch(self):
+        from swengmgmt import github
+        return github.repository(self._org, self.full_name)
+
+    def _url(self):
+        return self._org._build_url("repos", *self.full_name.split("/", 1))
+
+    def __str__(self):
+        return self.full_name
+
+
 class GithubEntity(object):
     """Mix-in for Github data manipulation."""
 
+    __slots__ = ()
+
     @property
     def repo_ssh_url(self):
         return self.gh_repo.ssh_url if self.gh_repo else None
@@ -44,14 +170,19 @@ class GithubEntity(object):
 
     def updateTeamPermission(self, permission):
         if permission == self.gh_team.permission:
+            metrics.skip()
             return
 
         self.gh_team.edit(self.gh_team.name,
                           permission)
+        self.gh_team.permission = permission
         logging.info("%s has now %s access to their repository"
                      % (self, permission))
 
     def eraseGithubData(self):
+        if not (self.gh_team or self.gh_repo):
+            metrics.skip()
+
         if not self.gh_team:
             logging.info("%s does not have a team. Skipping." % self)
         else:
@@ -72,6 +203,8 @@ class GithubEntity(object):
 
 
 class SwEngStudent(epfl.EPFLStudentData, GithubEntity):
+    __slots__ = ("team_name", "team", "github_id", "gh_team", "gh_repo")
+
     def __init__(self, team_name=None, github_id=None, **kwargs):
         super(SwEngStudent, self).__init__(**kwargs)
 
@@ -84,6 +217,8 @@ class SwEngStudent(epfl.EPFLStudentData, GithubEntity):
 
 
 class SwEngTeam(GithubEntity):
+    __slots__ = ("name", "github_slug", "students", "gh_team", "gh_repo")
+
     def __init__(self, name=None, github_slug=None):
         super(SwEngTeam, self).__init__()
 
@@ -143,11 +278,25 @@ class TeamQuery(Query):
 class SwEngClass(object):
     STUDENT_TEAM_FMT = "%s%s (%s)"
 
+    # The age under which the repositories are listed besides being searched,
+    # as they may not be in the search index yet, in seconds.
+    RECENT_REPOS = 600
+
     def __init__(self, config):
         self._org_config = config["organization"]
         self.teams = {}
         self.students = {}
 
+        # The (category, subject, detail) of the roster rows that could not
+        # be taken as is, and the names of the Github teams and repositories
+        # of the class that belong to no one on the roster.
+        self.roster_problems = []
+        self.unmatched = []
+
+        # The (index, count) of the shard of the students and teams found by
+        # this process, if any.
+        self.shard = None
+
         self._student_team_re = re.compile(
             "".join([re.escape(self._org_config["exam-team-prefix"]),
                      r"(.*) \((.*)\)"]))
@@ -166,18 +315,47 @@ class SwEngClass(object):
         staff_team.edit(name=staff_team.name,
                         permission=permission)
 
+    def _rosterProblem(self, category, subject, detail):
+        logging.warning("%s: %s." % (subject, detail))
+        self.roster_problems.append((category, subject, detail))
+
     def populateFromSpreadsheet(self, student_sheet, team_sheet):
+        self.roster_problems = []
+
+        # On duplicate rows, the last one is kept.
         student_list = student_sheet.getStudentList(SwEngStudent)
-        self.students = { student.gaspar: student for student in student_list }
+        self.students = {}
+        for student in student_list:
+            if student.gaspar in self.students:
+                self._rosterProblem("duplicate-student", student.gaspar,
+                                    "on several rows of the students "
+                                    "worksheet")
+            self.students[student.gaspar] = student
 
         team_list = team_sheet.getTeamList(SwEngTeam)
-        self.teams = { team.name: team for team in team_list }
+        self.teams = {}
+        slugs = set()
+        for team in team_list:
+            if team.name in self.teams:
+                self._rosterProblem("duplicate-team", team.name,
+                                    "on several rows of the teams worksheet")
+            elif team.github_slug in slugs:
+                self._rosterProblem("duplicate-team", team.name,
+                                    "Github slug '%s' shared with another "
+                                    "team" % team.github_slug)
+            self.teams[team.name] = team
+            slugs.add(team.github_slug)
 
-        for student in student_list:
+        for student in self.students.itervalues():
             if not student.team_name:
                 continue
 
-            student.team = self.teams[student.team_name]
+            student.team = self.teams.get(student.team_name)
+            if not student.team:
+                self._rosterProblem("unknown-team", student.gaspar,
+                                    "team '%s' not in the teams worksheet"
+                                    % student.team_name)
+                continue
             student.team.students.append(student)
 
     def updateFromLDAP(self, ldap_object):
@@ -190,73 +368,196 @@ class SwEngClass(object):
                 logging.warning("Could not find student %s. Skipping" % student)
 
     def findStudents(self, query):
+        from swengmgmt import shard
+
         result = []
         for student in self.students.itervalues():
-            if query.match(student):
+            if (query.match(student) and
+                    shard.inShard(student.gaspar, self.shard)):
                 result.append(student)
         return result
 
     def findTeams(self, query):
+        from swengmgmt import shard
+
         result = []
         for team in self.teams.itervalues():
-            if query.match(team):
+            if query.match(team) and shard.inShard(team.name, self.shard):
                 result.append(team)
         return result
 
-    # TODO: Consolidate the two calls below, to avoid extra API calls
-
-    def _updateStudentGithubData(self, github_org):
-        for gh_team in github_org.iter_teams():
-            match = self._student_team_re.match(gh_team.name)
-            if not match:
-                continue
-            student = self.students[match.group(1)]
-            student.gh_team = gh_team
+    def classifyTeam(self, name):
+        """Return ("student", gaspar) or ("team", team name) for a Github
+        team named like the class ones, or None."""
+
+        match = self._student_team_re.match(name)
+        if match:
+            return "student", match.group(1)
+        match = self._team_re.match(name)
+        if match:
+            return "team", match.group(1)
+        return None
+
+    def classifyRepo(self, name):
+        """Return ("student", gaspar) or ("team", Github slug) for a
+        repository named like the class ones, or None."""
+
+        match = self._student_repo_re.match(name)
+        if match:
+            return "student", match.group(1)
+        match = self._team_repo_re.match(name)
+        if match:
+            return "team", match.group(1)
+        return None
+
+    def _attachGithubTeam(self, team_json, github_org):
+        """Attach a team, given as listed in JSON."""
+
+        match = self.classifyTeam(team_json["name"])
+        if not match:
+            return
+        kind, key = match
+        entity = (self.students if kind == "student" else self.teams).get(key)
+        if not entity:
+            self.unmatched.append(team_json["name"])
+            return
+        entity.gh_team = GithubTeamRef.fromJson(team_json, github_org)
+
+    def _attachGithubRepo(self, repo_json, github_org, teams_by_slug):
+        """Attach a repository, given as listed in JSON, and return the entity
+        it belongs to, if any."""
+
+        match = self.classifyRepo(repo_json["name"])
+        if not match:
+            return None
+        kind, key = match
+        entity = (self.students if kind == "student"
+                  else teams_by_slug).get(key)
+        if not entity:
+            self.unmatched.append(repo_json["full_name"])
+            return None
+        entity.gh_repo = GithubRepoRef.fromJson(repo_json, github_org)
+        return entity
+
+    def iterGithubRepos(self, github_org):
+        """Yield the repositories of the organization that may be the class',
+        as JSON.
+
+        With the "search" repo listing, only the repositories named like the
+        class ones are listed, plus those created too recently to be found.
+        Otherwise, or if the search fails, all of them are.
+        """
+
+        from swengmgmt import github
+
+        if self._org_config.get("repo-listing", "full") != "search":
+            for repo_json in github.iterOrgRepos(github_org):
+                yield repo_json
+            return
 
-        for gh_repo in github_org.iter_repos():
-            match = self._student_repo_re.match(gh_repo.name)
-            if not match:
-                continue
-            student = self.students[match.group(1)]
-            student.gh_repo = gh_repo
+        import itertools
+        import github3
+
+        seen = set()
+        try:
+            for repo_json in itertools.chain(
+                    github.iterRecentOrgRepos(github_org, self.RECENT_REPOS),
+                    github.searchOrgRepos(
+                        github_org, self._org_config["exam-repo-prefix"]),
+                    github.searchOrgRepos(
+                        github_org, self._org_config["homework-repo-prefix"])):
+                if repo_json["id"] not in seen:
+                    seen.add(repo_json["id"])
+                    yield repo_json
+        except (github.SearchLimitError, github3.GitHubError), e:
+            logging.warning("Could not search the repositories (%s). "
+                            "Listing all of them." % e)
+            for repo_json in github.iterOrgRepos(github_org):
+                if repo_json["id"] not in seen:
+                    yield repo_json
+
+    def iterGithubData(self, github_org, snapshot=None):
+        """Attach the Github data to the students and teams of the class.
+
+        The organization teams and repositories are listed once, as raw JSON:
+        github3 objects are only built for what gets changed. The students
+        and teams are yielded as soon as the data they show is complete: the
+        Github team and repository, and for students the repository of their
+        team too. The others are yielded at the end.
+
+        With a snapshot kept by the webhook listener, its teams and
+        repositories are attached instead, without listing anything.
+        """
+
+        from swengmgmt import github
 
-    def _updateTeamGithubData(self, github_org):
         teams_by_slug = { team.github_slug: team
                          for team in self.teams.itervalues() }
+        self.unmatched = []
 
-        for gh_team in github_org.iter_teams():
-            match = self._team_re.match(gh_team.name)
-            if not match:
+        if snapshot:
+            team_list, repos = snapshot.teams(), snapshot.repos()
+        else:
+            team_list = github.iterOrgTeams(github_org)
+            repos = self.iterGithubRepos(github_org)
+
+        for team_json in team_list:
+            self._attachGithubTeam(team_json, github_org)
+
+        done = set()
+        waiting_for_team = {}
+        for repo_json in repos:
+            entity = self._attachGithubRepo(repo_json, github_org,
+                                            teams_by_slug)
+            if isinstance(entity, SwEngStudent):
+                if entity.team and not entity.team.gh_repo:
+                    waiting_for_team.setdefault(entity.team.name,
+                                                []).append(entity)
+                    continue
+                ready = [entity]
+            elif isinstance(entity, SwEngTeam):
+                ready = [entity] + waiting_for_team.pop(entity.name, [])
+            else:
                 continue
-            team = self.teams[match.group(1)]
-            team.gh_team = gh_team
 
-        for gh_repo in github_org.iter_repos():
-            match = self._team_repo_re.match(gh_repo.name)
-            if not match:
-                continue
-            team = teams_by_slug[match.group(1)]
-            team.gh_repo = gh_repo
+            for entity in ready:
+                done.add(id(entity))
+                yield entity
 
-    def updateGithubData(self, github_org):
-        self._updateStudentGithubData(github_org)
-        self._updateTeamGithubData(github_org)
+        if self.unmatched:
+            logging.warning("Skipped %d Github teams and repositories of no "
+                            "one on the roster. See the audit command."
+                            % len(self.unmatched))
+
+        for entity in self.students.values() + self.teams.values():
+            if id(entity) not in done:
+                yield entity
+
+    def clearGithubData(self):
+        for entity in self.students.values() + self.teams.values():
+            entity.gh_team = None
+            entity.gh_repo = None
+        self.unmatched = []
+
+    def updateGithubData(self, github_org, snapshot=None):
+        for _ in self.iterGithubData(github_org, snapshot):
+            pass
 
     def createTeamRepo(self, team, github_org):
         # Create the repo
         if not team.gh_repo:
-            team.gh_repo = github_org.create_repo(
+            team.gh_repo = GithubRepoRef.fromObject(github_org.create_repo(
                 "".join([self._org_config["homework-repo-prefix"], team.github_slug]),
-                private=True)
+                private=True), github_org)
 
         github_org.team(self._org_config["staff-team-id"]).add_repo(
             team.gh_repo.full_name)
 
         # Create the Github team
         if not team.gh_team:
-            team.gh_team = github_org.create_team(
+            team.gh_team = GithubTeamRef.fromObject(github_org.create_team(
                 "".join([self._org_config["homework-team-prefix"], team.name]),
-                permissions='push')
+                permission='push'), github_org, keep=True)
 
         team.gh_team.add_repo(team.gh_repo.full_name)
 
@@ -281,7 +582,7 @@ class SwEngClass(object):
             if student.gh_team:
                 staff_team = github_org.team(self._org_config["staff-team-id"])
                 if staff_team in (a for a in student.gh_repo.iter_teams()):
-                    if not student.gh_team.remove_repo(student.gh_repo):
+                    if not student.gh_team.remove_repo(student.gh_repo.full_name):
                             #"".join([self._org_config["exam-repo-prefix"], student.gaspar])):
                         logging.warning("Unable to remove {st} as a collaborator for their repo".format(
                             st=student
@@ -298,6 +599,7 @@ class SwEngClass(object):
                 st="Student '{st}' has a gh_repo, but no team!".format(st=student)
                 logging.error(st)
         else:
+            metrics.skip()
             logging.info("Student {st} does not have a repo. Skipping".format(st=student))
 
     def cloneRepo(self, repo_path, student, github_org):
@@ -305,31 +607,62 @@ class SwEngClass(object):
         self.createExamRepo(student, github_org, add_to_team=False)
         self.hideExamRepo(student, github_org)
         with cd(repo_path):
-            subprocess.check_call(shlex.split(
-                "git remote add student {student_url}".format(
-                    student_url=student.gh_repo.ssh_url
-                )
-            ))
-            subprocess.check_call(shlex.split(
-                "git push student 'refs/remotes/origin/*:refs/heads/*'"
-            ))
-            subprocess.check_call(shlex.split(
-                "git remote rm student"
-            ))
+            with profiling.span("git", "remote add"):
+                subprocess.check_call(shlex.split(
+                    "git remote add student {student_url}".format(
+                        student_url=student.gh_repo.ssh_url
+                    )
+                ))
+            with profiling.span("git", "push"):
+                subprocess.check_call(shlex.split(
+                    "git push student 'refs/remotes/origin/*:refs/heads/*'"
+                ))
+            with profiling.span("git", "remote rm"):
+                subprocess.check_call(shlex.split(
+                    "git remote rm student"
+                ))
+
+    def generateRepo(self, student, github_org, template, all_branches=False):
+        """Create the exam repo of the student from a template repository.
+
+        Unlike cloneRepo, nothing is pushed from here, so existing exam repos
+        cannot be populated: they are skipped.
+        """
+
+        if student.gh_repo:
+            metrics.skip()
+            logging.info("Exam repo already exists for student %s. "
+                         "Skipping." % student)
+            return
+
+        self.createExamRepo(student, github_org, add_to_team=False,
+                            template=template, all_branches=all_branches)
+        self.hideExamRepo(student, github_org)
 
     def deleteExamRepo(self, student, github_org):
         if student.gh_repo:
             if student.gh_repo.delete():
+                student.gh_repo = None
                 logging.info("Deleting exam repo for student {}".format(student))
             else:
                 logging.warn("Student {} doesn't have an exam repo".format(student))
+        else:
+            metrics.skip()
 
-    def createExamRepo(self, student, github_org, add_to_team=True, read_only=False):
-        # Create the repo
+    def createExamRepo(self, student, github_org, add_to_team=True,
+                       read_only=False, template=None, all_branches=False):
+        # Create the repo, from the template repository if any
         if not student.gh_repo:
-            student.gh_repo = github_org.create_repo(
-                "".join([self._org_config["exam-repo-prefix"], student.gaspar]),
-                private=True)
+            name = "".join([self._org_config["exam-repo-prefix"],
+                            student.gaspar])
+            if template:
+                from swengmgmt import github
+                student.gh_repo = GithubRepoRef.fromJson(github.generateRepo(
+                    github_org, template, name, private=True,
+                    all_branches=all_branches), github_org)
+            else:
+                student.gh_repo = GithubRepoRef.fromObject(
+                    github_org.create_repo(name, private=True), github_org)
             github_org.team(self._org_config["staff-team-id"]).add_repo(
                 student.gh_repo.full_name)
             logging.info("Created exam repo for student %s." % student)
@@ -339,10 +672,10 @@ class SwEngClass(object):
             
         # Create the GitHub team
         if not student.gh_team:
-            student.gh_team = github_org.create_team(
+            student.gh_team = GithubTeamRef.fromObject(github_org.create_team(
                 "".join([self._org_config["exam-team-prefix"], student.gaspar,
                          " (%s)" % student.name]),
-                permission="push")
+                permission="push"), github_org, keep=True)
 
             logging.info("Created exam team for student %s." % student)
 
@@ -370,19 +703,78 @@ class SwEngClass(object):
         student_gh_id = student.github_id
         if not class_team.is_member(student_gh_id):
             class_team.invite(student_gh_id)
+        else:
+            metrics.skip()
+
+    def _classTeamState(self, class_team):
+        """Return the members (lowercase logins) and repos of the class team.
+
+        Pending invitations are not listed as members, so they are sent
+        again until accepted.
+        """
+
+        from swengmgmt import github
+
+        members = set(member["login"].lower() for member in
+                      github.iterJson(class_team, class_team._api + "/members"))
+        repos = set(repo["full_name"].lower() for repo in
+                    github.iterJson(class_team, class_team._api + "/repos"))
+        return members, repos
 
-    def openTeamReposToClass(self, github_org):
+    def _changeClassTeam(self, name, changes, workers):
+        """Make the changes, lists of calls by team, with teams in parallel."""
+
+        from swengmgmt import bulk
+
+        for team in self.teams.itervalues():
+            if not changes.get(team.name):
+                with metrics.entity():
+                    metrics.skip()
+
+        changed = [team for team in self.teams.itervalues()
+                   if changes.get(team.name)]
+        logging.info("%s: %d calls for %d teams, %d teams unchanged."
+                     % (name, sum(len(calls) for calls in changes.values()),
+                        len(changed), len(self.teams) - len(changed)))
+
+        runner = bulk.BulkRunner(bulk.BulkReport(None, name),
+                                 key=lambda team: team.name, workers=workers)
+        counts = runner.run(changed, lambda team: all(
+            [call() for call in changes[team.name]]))
+        return counts.get("failed", 0) == 0
+
+    def openTeamReposToClass(self, github_org, workers=8):
         class_team = github_org.team(self._org_config["class-team-id"])
+        members, repos = self._classTeamState(class_team)
 
+        changes = {}
         for team in self.teams.itervalues():
+            calls = changes[team.name] = []
             for student in team.students:
-                class_team.invite(student.github_id)
-            class_team.add_repo(team.gh_repo.full_name)
-
-    def closeTeamReposToClass(self, github_org):
+                if student.github_id.lower() not in members:
+                    calls.append(functools.partial(class_team.invite,
+                                                   student.github_id))
+            if not team.gh_repo:
+                logging.warning("%s does not have a repo. Skipping it." % team)
+            elif team.gh_repo.full_name.lower() not in repos:
+                calls.append(functools.partial(class_team.add_repo,
+                                               team.gh_repo.full_name))
+
+        return self._changeClassTeam("class-open", changes, workers)
+
+    def closeTeamReposToClass(self, github_org, workers=8):
         class_team = github_org.team(self._org_config["class-team-id"])
+        members, repos = self._classTeamState(class_team)
 
+        changes = {}
         for team in self.teams.itervalues():
-            class_team.remove_repo(team.gh_repo.full_name)
+            calls = changes[team.name] = []
+            if team.gh_repo and team.gh_repo.full_name.lower() in repos:
+                calls.append(functools.partial(class_team.remove_repo,
+                                               team.gh_repo.full_name))
             for student in team.students:
-                class_team.remove_member(student.github_id)
+                if student.github_id.lower() in members:
+                    calls.append(functools.partial(class_team.remove_member,
+                                                   student.github_id))
+
+        return self._changeClassTeam("class-close", changes, workers)
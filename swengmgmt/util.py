@@ -17,8 +17,11 @@
 
 
 import contextlib
+import datetime
 import os
 import sys
+import threading
+import time
 
 
 """Misc utilities."""
@@ -83,3 +86,55 @@ def red_green(s, r_value=None, g_value=None):
         return green(bold(s))
     else:
         return s
+
+
+class ThreadOutput(object):
+    """Replacement for sys.stdout giving some threads their own stream.
+
+    Threads that did not redirect their output write to the default stream.
+    """
+
+    def __init__(self, default):
+        self._default = default
+        self._streams = {}
+
+    def redirect(self, stream):
+        """Send the output of the current thread to the given stream."""
+        self._streams[threading.current_thread().ident] = stream
+
+    def restore(self):
+        self._streams.pop(threading.current_thread().ident, None)
+
+    def _stream(self):
+        return self._streams.get(threading.current_thread().ident,
+                                 self._default)
+
+    def write(self, data):
+        stream = self._stream()
+        if stream is not self._default and isinstance(data, unicode):
+            data = data.encode("utf-8")
+        stream.write(data)
+
+    def flush(self):
+        self._stream().flush()
+
+    def fileno(self):
+        return self._default.fileno()
+
+
+def parseTime(text):
+    """Parse HH:MM[:SS], today, into a timestamp (for argparse)."""
+
+    import argparse
+
+    for fmt in ("%H:%M:%S", "%H:%M"):
+        try:
+            parsed = datetime.datetime.strptime(text, fmt).time()
+            break
+        except ValueError:
+            pass
+    else:
+        raise argparse.ArgumentTypeError("'%s' is not HH:MM[:SS]" % text)
+
+    at = datetime.datetime.combine(datetime.date.today(), parsed)
+    return time.mktime(at.timetuple())
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# This file is part of the sweng-management tool.
+#
+# sweng-management is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Foobar is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Foobar.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Snapshot of the class on Github, kept up to date by organization webhooks.
+
+The listener lists the teams and repositories of the class once, into the
+state cache, then applies the repository, team, membership and team_add
+events Github sends it. Every event updates the teams and repositories it
+carries, or removes them when they are deleted. Events whose signature does
+not match the shared secret are refused.
+
+While the listener runs, it marks the snapshot as alive, and the commands
+attach the snapshot to the class instead of listing the organization. If it
+stopped, or its last mark is too old, they list it as usual.
+"""
+
+
+import BaseHTTPServer
+import hashlib
+import hmac
+import json
+import logging
+import os
+import SocketServer
+import threading
+import time
+
+from swengmgmt import github
+
+
+EVENTS = ["repository", "team", "membership", "team_add"]
+
+# The sections of the state cache holding the snapshot of an organization,
+# by its name, as several classes may share the cache.
+TEAMS = "github-teams:%s"
+REPOS = "github-repos:%s"
+LISTENER = "github-listener:%s"
+
+# Interval between two marks of the listener, in seconds. The snapshot is
+# used until three marks are missed.
+HEARTBEAT = 60
+MAX_AGE = 3 * HEARTBEAT
+
+
+class SignatureError(Exception):
+    pass
+
+
+def signature(secret, body):
+    return "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+
+def verifySignature(secret, body, header):
+    """Check the X-Hub-Signature-256 header of a delivery."""
+
+    if not header:
+        raise SignatureError("The delivery is not signed")
+    if not hmac.compare_digest(str(header), signature(secret, body)):
+        raise SignatureError("The signature does not match")
+
+
+def _teamJson(team_json):
+    return {"id": team_json["id"], "name": team_json["name"],
+            "permission": team_json.get("permission") or "pull"}
+
+
+def _repoJson(repo_json):
+    return {"id": repo_json["id"], "name": repo_json["name"],
+            "full_name": repo_json["full_name"],
+            "ssh_url": repo_json["ssh_url"]}
+
+
+class OrgSnapshot(object):
+    """The teams and repositories of the class, in the state cache.
+
+    Only those named with the prefixes of the class are kept, with the
+    fields read by the tool.
+    """
+
+    def __init__(self, state, org_config):
+        self._state = state
+        self._org_config = org_config
+        self._lock = threading.Lock()
+
+        org = org_config["name"].lower()
+        self._teams = TEAMS % org
+        self._repos = REPOS % org
+        self._listener = LISTENER % org
+
+    def _isClassTeam(self, name):
+        return name.startswith((self._org_config["exam-team-prefix"],
+                                self._org_config["homework-team-prefix"]))
+
+    def _isClassRepo(self, name):
+        return name.startswith((self._org_config["exam-repo-prefix"],
+                                self._org_config["homework-repo-prefix"]))
+
+    def _owned(self, repo_json):
+        owner = repo_json.get("owner", {}).get("login")
+        # Transferred out of the organization, or listed from it.
+        return not owner or owner.lower() == self._org_config["name"].lower()
+
+    def _putTeam(self, team_json):
+        if self._isClassTeam(team_json["name"]):
+            self._state.put(self._teams, str(team_json["id"]),
+                            _teamJson(team_json))
+        else:
+            # It may have been renamed out of the class.
+            self._state.delete(self._teams, str(team_json["id"]))
+
+    def _putRepo(self, repo_json):
+        if self._isClassRepo(repo_json["name"]) and self._owned(repo_json):
+            self._state.put(self._repos, str(repo_json["id"]),
+                            _repoJson(repo_json))
+        else:
+            self._state.delete(self._repos, str(repo_json["id"]))
+
+    def seed(self, github_org, repos):
+        """Replace the snapshot with the listed teams and repositories."""
+
+        teams = dict((str(team_json["id"]), _teamJson(team_json))
+                     for team_json in github.iterOrgTeams(github_org)
+                     if self._isClassTeam(team_json["name"]))
+        repos = dict((str(repo_json["id"]), _repoJson(repo_json))
+                     for repo_json in repos
+                     if self._isClassRepo(repo_json["name"]))
+
+        with self._lock:
+            for section, listed in ((self._teams, teams),
+                                    (self._repos, repos)):
+                for key in set(self._state.items(section)) - set(listed):
+                    self._state.delete(section, key)
+                for key, value in listed.iteritems():
+                    self._state.put(section, key, value)
+            self._state.flush()
+        logging.info("Listed %d teams and %d repositories of the class."
+                     % (len(teams), len(repos)))
+
+    def apply(self, event, payload):
+        """Apply a webhook event, and return a description of it."""
+
+        action = payload.get("action")
+        team_json = payload.get("team")
+        repo_json = payload.get("repository")
+
+        with self._lock:
+            if event == "repository":
+                if action == "deleted":
+                    self._state.delete(self._repos, str(repo_json["id"]))
+                else:
+                    self._putRepo(repo_json)
+            elif event in ("team", "membership", "team_add"):
+                if action == "deleted" or (team_json or {}).get("deleted"):
+                    self._state.delete(self._teams, str(team_json["id"]))
+                elif team_json:
+                    self._putTeam(team_json)
+                if repo_json:
+                    self._putRepo(repo_json)
+            else:
+                return None
+            self._state.put(self._listener, "updated", time.time())
+            self._state.flush()
+
+        return " ".join(filter(None, [
+            event, action,
+            (team_json or {}).get("name"), (repo_json or {}).get("name")]))
+
+    def mark(self, alive=True):
+        with self._lock:
+            self._state.put(self._listener, "organization",
+                            self._org_config["name"])
+            self._state.put(self._listener, "alive",
+                            time.time() if alive else 0)
+            self._state.flush()
+
+    def teams(self):
+        return self._state.items(self._teams).values()
+
+    def repos(self):
+        return self._state.items(self._repos).values()
+
+    def alive(self):
+        """Return whether a listener of the organization marked the snapshot
+        recently."""
+
+        organization = self._state.get(self._listener, "organization") or ""
+        if organization.lower() != self._org_config["name"].lower():
+            return False
+        alive = self._state.get(self._listener, "alive") or 0
+        return time.time() - alive <= MAX_AGE
+
+
+def currentSnapshot(state, org_config):
+    """Return the snapshot of the class, if a listener keeps it up to date."""
+
+    if not state:
+        return None
+    snapshot = OrgSnapshot(state, org_config)
+    if not snapshot.alive():
+        return None
+    logging.info("Using the Github snapshot kept by the webhook listener.")
+    return snapshot
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def _reply(self, code, text):
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def do_POST(self):
+        listener = self.server.listener
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            verifySignature(listener.secret, body,
+                            self.headers.get("X-Hub-Signature-256"))
+        except SignatureError, e:
+            logging.warning("Refused a delivery from %s: %s."
+                            % (self.client_address[0], e))
+            self._reply(401, "%s\n" % e)
+            return
+
+        event = self.headers.get("X-GitHub-Event")
+        delivery = self.headers.get("X-GitHub-Delivery") or "%.6f" % time.time()
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self._reply(400, "Not JSON\n")
+            return
+
+        listener.record(event, delivery, body)
+        try:
+            self._reply(200, listener.handle(event, payload) + "\n")
+        except (KeyError, TypeError), e:
+            logging.warning("Could not apply the %s delivery %s: missing %s."
+                            % (event, delivery, e))
+            self._reply(400, "Malformed payload\n")
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class WebhookListener(object):
+    """Serves the webhook deliveries of Github over HTTP.
+
+    The deliveries received while the snapshot is first listed are applied
+    once it is. With record_dir, each verified delivery is also saved there,
+    to be replayed with bench/replay.py.
+    """
+
+    def __init__(self, snapshot, secret, address, record_dir=None):
+        self.snapshot = snapshot
+        self.secret = str(secret)
+        self.record_dir = record_dir
+        self._server = _Server(address, _Handler)
+        self._server.listener = self
+        self._seeded = False
+        self._pending = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def record(self, event, delivery, body):
+        if not self.record_dir:
+            return
+        path = os.path.join(self.record_dir, "%.6f-%s.json"
+                            % (time.time(), delivery))
+        with open(path, "w") as f:
+            json.dump({"event": event, "delivery": delivery, "body": body}, f)
+
+    def handle(self, event, payload):
+        if event == "ping":
+            return "pong"
+        if event not in EVENTS:
+            return "ignored"
+        with self._lock:
+            if not self._seeded:
+                self._pending.append((event, payload))
+                return "queued"
+        description = self.snapshot.apply(event, payload)
+        logging.info("Applied %s." % description)
+        return "applied"
+
+    def seed(self, github_org, repos):
+        self.snapshot.seed(github_org, repos)
+        with self._lock:
+            for event, payload in self._pending:
+                logging.info("Applied %s." % self.snapshot.apply(event,
+                                                                 payload))
+            self._pending = []
+            self._seeded = True
+        self.snapshot.mark()
+
+    def _heartbeat(self):
+        while not self._stopped.wait(HEARTBEAT):
+            if self._seeded:
+                self.snapshot.mark()
+
+    def start(self):
+        # The events missed since the last listener stopped are only caught
+        # up by listing the class again.
+        self.snapshot.mark(alive=False)
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        heartbeat = threading.Thread(target=self._heartbeat)
+        heartbeat.daemon = True
+        heartbeat.start()
+        logging.info("Listening for webhooks on %s:%d." % self.address)
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._server.shutdown()
+        self._server.server_close()
+        # The snapshot is not kept up to date anymore.
+        self.snapshot.mark(alive=False)